@@ -1,7 +1,7 @@
 import json
 import os
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam
 from datetime import datetime
 import logging
 
@@ -9,6 +9,27 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# config.json中dd属性 -> modulemte.db_deviceinfo字段
+DEVICE_FIELD_MAP = {
+    "mode": "Product_Mode",
+    "speed": "Speed_Code",
+    "module_type": "Module_Type",
+    "tech": "Tech_Name",
+    "package_density": "PKG_Density",
+    "module_density": "Product_Density",
+    "family": "Product_Family",
+    "module_config": "Module_Config",
+    "organization": "Organization",
+    "device_group": "Product_Group_ID"
+}
+# 批量查询设备信息时IN列表分块大小
+DEVICE_CHUNK_SIZE = 1000
+
+
+def _normalize_key(series):
+    """匹配键：去空格转大写（近似MySQL不区分大小写的比较）"""
+    return series.map(str).str.strip().str.upper()
+
 
 class Config:
     """配置类，存储数据库连接和文件路径信息"""
@@ -269,6 +290,39 @@ class DatabaseHandler:
             return None
 
 
+    def get_special_keys(self):
+        """一次读取spc_flw_modtst中所有(run_no, sub_no)，返回归一化键的frozenset"""
+        try:
+            query = text("SELECT DISTINCT run_no, sub_no FROM cmsalpha.spc_flw_modtst")
+            with self.engine.connect() as conn:
+                df = pd.read_sql(query, conn)
+            return frozenset(zip(_normalize_key(df["run_no"]), _normalize_key(df["sub_no"])))
+        except Exception as e:
+            logger.error(f"读取特殊流程lot失败: {str(e)}")
+            return frozenset()
+
+    def get_device_infos(self, devices):
+        """批量查询modulemte.db_deviceinfo，返回以归一化Device为索引的DataFrame（同一Device取第一条）"""
+        devices = list(dict.fromkeys(devices))
+        frames = []
+        query = text("""
+            SELECT * FROM modulemte.db_deviceinfo 
+            WHERE Device IN :devices
+        """).bindparams(bindparam("devices", expanding=True))
+        try:
+            with self.engine.connect() as conn:
+                for i in range(0, len(devices), DEVICE_CHUNK_SIZE):
+                    frames.append(pd.read_sql(query, conn, params={"devices": devices[i:i + DEVICE_CHUNK_SIZE]}))
+        except Exception as e:
+            logger.error(f"批量查询设备信息失败: {str(e)}")
+            return pd.DataFrame()
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        df.index = _normalize_key(df["Device"])
+        return df[~df.index.duplicated(keep="first")]
+
+
 class ConfigHandler:
     """配置文件处理类，负责读取和验证config.json"""
 
@@ -323,6 +377,27 @@ class ConfigHandler:
         return self.config_data
 
 
+class CompiledRule:
+    """config.json规则预编译：目标值转为frozenset，字段名映射一次完成"""
+
+    def __init__(self, rule):
+        self.id = rule["id"]
+        self.sub_even = rule["distinguishing_conditions"] == "Sub_Even"
+        dd_properties = rule["material_properties"].get("dd", {})
+        dy_properties = rule["material_properties"].get("dy", {})
+        # dd非空时即要求能查到设备信息（即使各属性目标值均为空）
+        self.needs_device = bool(dd_properties)
+        # dd按原值比较，dy按去空格字符串比较
+        self.dd = [(DEVICE_FIELD_MAP.get(prop.lower(), prop), frozenset(values))
+                   for prop, values in dd_properties.items() if values]
+        self.dy = [(prop.lower(), frozenset(str(tv).strip() for tv in values))
+                   for prop, values in dy_properties.items() if values]
+        process_settings = rule["process_settings"]
+        self.process_str = ";".join(process_settings["operList"]) + ";"
+        self.bd_str = ";".join(process_settings["BDList"]) + ";"
+        self.sc_str = ";".join(process_settings["SCList"]) + ";"
+
+
 class ProcessGenerator:
     """Process生成类，根据规则生成Process Excel"""
 
@@ -330,138 +405,101 @@ class ProcessGenerator:
         self.db_handler = db_handler
         self.config_handler = config_handler
         self.rules = config_handler.get_rules()
+        self.compiled_rules = [CompiledRule(rule) for rule in self.rules]
+
+    def _candidate_mask(self, wip_data):
+        """lot/sub非空、Sub为偶数且不在特殊流程中的行"""
+        lot_ids = wip_data["lot_id"]
+        sub_nos = wip_data["sub"]
+        has_keys = lot_ids.map(bool) & sub_nos.map(bool)
+        for lot_id, sub_no in zip(lot_ids[~has_keys], sub_nos[~has_keys]):
+            logger.warning(f"Lot ID或Sub No为空，跳过记录: {lot_id}-{sub_no}")
+
+        # Sub No取其中数字判断奇偶
+        digits = sub_nos.map(str).str.replace(r"\D", "", regex=True)
+        has_digits = digits != ""
+        for sub_no in sub_nos[has_keys & ~has_digits]:
+            logger.warning(f"Sub No格式异常，无法判断奇偶: {sub_no}，跳过")
+        is_sub_even = digits.str[-1:].isin(list("02468"))
+
+        special_keys = self.db_handler.get_special_keys()
+        in_special = pd.MultiIndex.from_arrays([_normalize_key(lot_ids), _normalize_key(sub_nos)]).isin(special_keys)
+        return has_keys & has_digits & is_sub_even & ~in_special
+
+    def _device_frame(self, wip_data, candidates):
+        """按WIP行对齐的设备信息，及是否查到设备信息的mask"""
+        new_devices = wip_data.get("new_device", pd.Series(None, index=wip_data.index, dtype=object))
+        device_keys = _normalize_key(new_devices)
+        has_device = new_devices.map(bool) & new_devices.notna()
+        infos = self.db_handler.get_device_infos(new_devices[candidates & has_device].map(str).str.strip())
+        if infos.empty:
+            return pd.DataFrame(index=wip_data.index), pd.Series(False, index=wip_data.index)
+        found = has_device & device_keys.isin(infos.index)
+        device_frame = infos.reindex(device_keys.values)
+        device_frame.index = wip_data.index
+        return device_frame, found
+
+    @staticmethod
+    def _dy_values(wip_data, prop):
+        """dy属性比较值（同逐行逻辑）：hist_code取batch_no后四位（batch_no为None不匹配），其余转去空格字符串"""
+        if prop == "hist_code":
+            batch_no = wip_data.get("batch_no", pd.Series(None, index=wip_data.index, dtype=object))
+            return batch_no.map(lambda value: None if value is None else str(value).strip()[-4:])
+        column = wip_data.get(prop, pd.Series(None, index=wip_data.index, dtype=object))
+        return column.map(lambda value: str(value).strip() if value is not None else "")
 
     def generate(self, output_path):
-        """生成Process Excel"""
+        """生成Process Excel：规则预编译，特殊lot与设备信息批量预取，对整张WIP表按规则计算mask"""
         try:
             # 获取WIP数据
             wip_data = self.db_handler.get_wip_data()
             if wip_data.empty:
                 logger.warning("没有找到WIP数据")
                 return False
-
-            process_data = []
-
-            for _, wip_row in wip_data.iterrows():
-                lot_id = wip_row.get("lot_id")
-                sub_no = wip_row.get("sub")
-                if not lot_id or not sub_no:
-                    logger.warning(f"Lot ID或Sub No为空，跳过记录: {lot_id}-{sub_no}")
+            wip_data = wip_data.reset_index(drop=True)
+
+            candidates = self._candidate_mask(wip_data)
+            if any(rule.sub_even and rule.needs_device for rule in self.compiled_rules):
+                device_frame, device_found = self._device_frame(wip_data, candidates)
+
+            # 同一属性的比较值只计算一次，供所有规则共用
+            dy_values = {}
+            full_lot_ids = wip_data["lot_id"].map(str) + wip_data["sub"].map(str)
+            matches = []
+            for rule_index, rule in enumerate(self.compiled_rules):
+                if not rule.sub_even:
                     continue
-
-                # 处理Sub No偶数判断
-                try:
-                    sub_num = int(''.join(filter(str.isdigit, str(sub_no))))
-                    is_sub_even = (sub_num % 2 == 0)
-                except (ValueError, TypeError):
-                    logger.warning(f"Sub No格式异常，无法判断奇偶: {sub_no}，跳过")
+                mask = candidates.copy()
+                if rule.needs_device:
+                    mask &= device_found
+                    for field, targets in rule.dd:
+                        actual = device_frame[field] if field in device_frame.columns else \
+                            pd.Series(None, index=wip_data.index, dtype=object)
+                        mask &= actual.isin(targets)
+                for prop, targets in rule.dy:
+                    if prop not in dy_values:
+                        dy_values[prop] = self._dy_values(wip_data, prop)
+                    mask &= dy_values[prop].isin(targets)
+                if not mask.any():
                     continue
-
-                # 遍历规则
-                for rule in self.rules:
-                    if rule["distinguishing_conditions"] != "Sub_Even":
-                        continue
-
-                    if not is_sub_even:
-                        continue
-
-                    if self.db_handler.check_lot_in_special(lot_id, sub_no):
-                        continue
-
-                    # 检查device属性匹配
-                    dd_properties = rule["material_properties"].get("dd", {})
-                    if dd_properties:
-                        device_info = self.db_handler.get_device_info(wip_row.get("new_device"))
-                        if not device_info:
-                            logger.debug(f"未找到设备信息: {wip_row.get('new_device')}，跳过")
-                            continue
-
-                        dd_match = True
-                        for prop, target_values in dd_properties.items():
-                            if not target_values:
-                                continue
-
-                            # 从config.json映射到db_deviceinfo表
-                            device_field_map = {
-                                "mode": "Product_Mode",
-                                "speed": "Speed_Code",
-                                "module_type": "Module_Type",
-                                "tech": "Tech_Name",
-                                "package_density": "PKG_Density",
-                                "module_density": "Product_Density",
-                                "family": "Product_Family",
-                                "module_config": "Module_Config",
-                                "organization": "Organization",
-                                "device_group": "Product_Group_ID"
-                            }
-                            db_field = device_field_map.get(prop.lower(), prop)
-                            actual_value = device_info.get(db_field)
-
-                            if actual_value not in target_values:
-                                dd_match = False
-                                break
-                        if not dd_match:
-                            continue
-
-                    # 检查dy属性匹配
-                    dy_properties = rule["material_properties"].get("dy", {})
-                    if dy_properties:
-                        dy_match = True
-                        for prop, target_values in dy_properties.items():
-                            if not target_values:
-                                continue
-
-                            # 处理hist_code的特殊逻辑：使用batch_no的最后四位
-                            if prop.lower() == "hist_code":
-                                # 获取batch_no并处理空值
-                                batch_no = wip_row.get("batch_no")
-                                if batch_no is None:
-                                    # 若batch_no为空，直接不匹配
-                                    dy_match = False
-                                    break
-
-                                # 转换为字符串并取最后四位（不足四位则取全部）
-                                batch_str = str(batch_no).strip()
-                                actual_value = batch_str[-4:] if len(batch_str) >= 4 else batch_str
-                            else:
-                                # 其他属性正常从wip_row获取值
-                                actual_value = wip_row.get(prop.lower())
-                                # 转换为字符串避免类型比较问题
-                                actual_value = str(actual_value).strip() if actual_value is not None else ""
-
-                            # 目标值统一转为字符串进行比较
-                            target_values_str = [str(tv).strip() for tv in target_values]
-
-                            if actual_value not in target_values_str:
-                                dy_match = False
-                                logger.debug(f"属性[{prop}]不匹配，实际值[{actual_value}]不在目标值[{target_values}]中")
-                                break
-                        if not dy_match:
-                            continue
-
-                    # 生成Process数据
-                    process_settings = rule["process_settings"]
-                    process_str = ";".join(process_settings["operList"]) + ";"
-                    bd_str = ";".join(process_settings["BDList"]) + ";"
-                    sc_str = ";".join(process_settings["SCList"]) + ";"
-                    full_lot_id = f"{lot_id}{sub_no}"
-
-                    process_record = {
-                        "Lot ID": full_lot_id,
-                        "Process": process_str,
-                        "S/C": sc_str,
-                        "BD_Type": bd_str,
-                        "Case Name": rule["id"]
-                    }
-                    process_data.append(process_record)
-
-            # 保存为Excel
-            if process_data:
-                df = pd.DataFrame(process_data)
+                matches.append(pd.DataFrame({
+                    "row": wip_data.index[mask],
+                    "rule": rule_index,
+                    "Lot ID": full_lot_ids[mask].values,
+                    "Process": rule.process_str,
+                    "S/C": rule.sc_str,
+                    "BD_Type": rule.bd_str,
+                    "Case Name": rule.id
+                }))
+
+            # 保存为Excel（记录顺序同逐行逐规则）
+            if matches:
+                df = pd.concat(matches, ignore_index=True)
+                df = df.sort_values(["row", "rule"], kind="mergesort").drop(columns=["row", "rule"])
                 for col in df.columns:
                     df[col] = df[col].astype(str).str.replace(" ", "")
                 df.to_excel(output_path, index=False)
-                logger.info(f"Process生成成功: {output_path}，共{len(process_data)}条记录")
+                logger.info(f"Process生成成功: {output_path}，共{len(df)}条记录")
                 return True
             else:
                 logger.warning("没有生成任何Process数据")
@@ -1,7 +1,32 @@
 import pymysql
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 
+# db_event_et中lot / 事件 / 时间的字段位置（同filterList）
+LOT_COL = 3
+EVENT_COL = 4
+TIME_COL = 6
+# Stop时长阈值（秒）
+STOP_THRESHOLD = 300
+# lot_id IN查询分块大小
+LOT_CHUNK_SIZE = 1000
+# 补跑模式：每天的设备分片数（日期 × 设备分片为一个任务）
+EQUIP_PARTITIONS = 4
+# 补跑进度：开始时登记为running，每天全部分片写入后置为done，重启时跳过已完成日期
+CHECKPOINT_TABLE = 'db_eventmonitor_checkpoint'
+CHECKPOINT_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+    event_date DATE NOT NULL,
+    status VARCHAR(8) NOT NULL DEFAULT 'running',
+    interval_cnt INT NOT NULL DEFAULT 0,
+    update_time DATETIME NOT NULL,
+    PRIMARY KEY (event_date)
+)
+"""
+
+
 # 处理数据库相关数据
 class DataAquirer:
     def __init__(self, host):
@@ -21,10 +46,14 @@ class DataAquirer:
         result = self.cursor.fetchone()
         return result[0]
 
-    # 根据最新的日期，获取当天所有的设备
-    def getEquip(self):
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+    # 根据最新的日期（或指定日期），获取当天所有的设备
+    def getEquip(self, date=None):
         sql = 'select distinct(EQUIP_Name) from db_event_et where `DATE` = %s'
-        self.cursor.execute(sql, self.maxDate)
+        self.cursor.execute(sql, date or self.maxDate)
         result = self.cursor.fetchall()
         # 提取设备List
         equipList = []
@@ -41,10 +70,25 @@ class DataAquirer:
         result = self.cursor.fetchall()
         return result
 
+    # 一次获取当天所有设备（或指定设备）的STOP/RUN事件
+    def getDayEvents(self, date=None, equips=None):
+        params = [date or self.maxDate]
+        equip_filter = ''
+        if equips:
+            equip_filter = f"and EQUIP_Name in ({', '.join(['%s'] * len(equips))}) "
+            params.extend(equips)
+        sql = ("select * from db_event_et "
+               "where `Date` = %s and Event2 in ('STOP', 'RUN') " + equip_filter +
+               "order by EQUIP_Name ASC, TRANSMISSION_TIME ASC")
+        self.cursor.execute(sql, params)
+        result = self.cursor.fetchall()
+        columns = [desc[0] for desc in self.cursor.description]
+        return pd.DataFrame(list(result), columns=columns)
+
     # 获取相比一监视日期前一天各个制品的收率
-    def getStandard(self):
-        # 求比self.maxDate前一天
-        searchDate = self.maxDate - timedelta(days=1)
+    def getStandard(self, date=None):
+        # 求比监视日期（默认self.maxDate）前一天
+        searchDate = (date or self.maxDate) - timedelta(days=1)
         sql = ("select product, sum(bin1_cnt)/sum(test_cnt) as p_yield from cmsalpha.db_primeyieldet dp "
                "where date_val =%s group by product ;")
         self.cursor.execute(sql, searchDate)
@@ -91,6 +135,171 @@ class DataAquirer:
             self.conn.commit()
 
 
+    # 建立进度表；首次建立时以db_eventmonitor_et已处理到的日期作为初始水位
+    # （STOP_TIME可能跨过零点，取其前一天，重复处理的日期按upsert写入不影响结果）
+    def initCheckpoint(self):
+        self.cursor.execute(CHECKPOINT_DDL)
+        self.cursor.execute(f"select count(*) from {CHECKPOINT_TABLE}")
+        if self.cursor.fetchone()[0]:
+            return
+        self.cursor.execute('select max(date(STOP_TIME)) from db_eventmonitor_et')
+        lastDate = self.cursor.fetchone()[0]
+        if lastDate:
+            self.cursor.execute(
+                f"insert into {CHECKPOINT_TABLE} (`event_date`, `status`, `update_time`) "
+                "values (%s, 'done', now())", lastDate - timedelta(days=1))
+        self.conn.commit()
+
+    # 补跑日期：初始水位（进度表最早日期）之后所有没有进度记录的日期，加上已登记但未完成的日期；
+    # 日常模式只记录当天，中间遗漏的日期没有记录，仍会被选中
+    # 新日期先登记为running，中途失败或中断的日期下次运行仍会被选中
+    def getPendingDates(self):
+        self.initCheckpoint()
+        sql = ("select distinct `Date` from db_event_et "
+               f"where (`Date` not in (select event_date from {CHECKPOINT_TABLE}) "
+               f"and `Date` > (select coalesce(min(event_date), '1000-01-01') from {CHECKPOINT_TABLE})) "
+               f"or `Date` in (select event_date from {CHECKPOINT_TABLE} where status <> 'done') "
+               "order by `Date` ASC")
+        self.cursor.execute(sql)
+        dates = [row[0] for row in self.cursor.fetchall()]
+        if dates:
+            self.cursor.executemany(
+                f"insert ignore into {CHECKPOINT_TABLE} (`event_date`, `status`, `update_time`) "
+                "values (%s, 'running', now())", dates)
+            self.conn.commit()
+        return dates
+
+    # 记录某天已处理完成
+    def saveCheckpoint(self, date, count):
+        self.initCheckpoint()
+        sql = (f"insert into {CHECKPOINT_TABLE} (`event_date`, `status`, `interval_cnt`, `update_time`) "
+               "values (%s, 'done', %s, now()) "
+               "on duplicate key update `status` = 'done', `interval_cnt` = values(`interval_cnt`), "
+               "`update_time` = now()")
+        self.cursor.execute(sql, (date, count))
+        self.conn.commit()
+
+    # 一次（分块IN）获取所有lot的收率，同一lot取第一条（同importer的fetchone）
+    def getLotYields(self, lots):
+        lots = [lot for lot in dict.fromkeys(lots) if lot]
+        rows = []
+        for i in range(0, len(lots), LOT_CHUNK_SIZE):
+            chunk = lots[i:i + LOT_CHUNK_SIZE]
+            sql = ("select `lot_id`, `product`, `yield`, `test_cnt` from db_primeyieldet "
+                   f"where lot_id in ({', '.join(['%s'] * len(chunk))})")
+            self.cursor.execute(sql, chunk)
+            rows.extend(self.cursor.fetchall())
+        df = pd.DataFrame(list(rows), columns=['lot', 'product', 'yield', 'in_qty'])
+        return df.drop_duplicates(subset='lot', keep='first')
+
+    # 批量补充收率/基准并一次事务写入
+    def importBatch(self, intervals, standard):
+        if intervals.empty:
+            return 0
+        enriched = enrich_intervals(intervals, self.getLotYields(intervals['lot'].tolist()), standard)
+        columns = ['equip', 'lot', 'stop', 'run', 'val', 'yield', 'in_qty', 'standard', 'mark']
+        data = enriched[columns].astype(object).where(enriched[columns].notna(), None)
+        # stop/run/val转为原生datetime/timedelta（pymysql对pandas类型按字符串转义，time_val格式不正确）
+        rows = [(*row[:2], stop, run, val, *row[5:]) for row, stop, run, val in zip(
+            data.itertuples(index=False, name=None), enriched['stop'].dt.to_pydatetime(),
+            enriched['run'].dt.to_pydatetime(), enriched['val'].dt.to_pytimedelta())]
+        sql = ("""
+                    insert into db_eventmonitor_et 
+                    (`EQUIP_Name`, `lot_no`, `STOP_TIME`, `RUN_TIME`, `time_val`, `yield`,`in_qty`, `standard`, `mark`) 
+                    values (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    on duplicate key update 
+                        `RUN_TIME` = values(`RUN_TIME`), 
+                        `time_val` = values(`time_val`), 
+                        `lot_no` = values(`lot_no`), 
+                        `yield` = values(`yield`),
+                        `in_qty` = values(`in_qty`),
+                        `standard` = values(`standard`),
+                        `mark` = values(`mark`);
+                """)
+        try:
+            # executemany合并为多行insert，一次提交
+            self.cursor.executemany(sql, rows)
+            self.conn.commit()
+        except pymysql.MySQLError:
+            self.conn.rollback()
+            raise
+        return len(rows)
+
+
+# 批量补充收率：lot收率关联 + 制品基准字典
+def enrich_intervals(intervals, lot_yields, standard):
+    """
+    与importer逐行逻辑一致：有制品且存在基准时standard = 基准收率*100，收率低于基准时mark = 1
+    :param standard: getStandard结果 [(product, p_yield), ...]
+    """
+    standards = {}
+    for product, p_yield in standard:
+        standards.setdefault(product, p_yield)
+    df = intervals.merge(lot_yields, on='lot', how='left')
+    base = df['product'].map(lambda product: standards.get(product) if product else None)
+    df['standard'] = pd.to_numeric(base, errors='coerce') * 100
+    df['mark'] = (pd.to_numeric(df['yield'], errors='coerce') < df['standard']).astype(int)
+    return df
+
+
+# 补跑任务：某天一组设备的事件配对并写入（每个任务单独连接）
+def process_partition(host, date, equips, standard):
+    aquirer = DataAquirer(host)
+    try:
+        intervals = extract_intervals(aquirer.getDayEvents(date, equips))
+        return aquirer.importBatch(intervals, standard)
+    finally:
+        aquirer.close()
+
+
+# 补跑模式：按 日期 × 设备分片 提交线程池，某天全部分片成功后记录进度
+def catch_up(host, workers=4, partitions=EQUIP_PARTITIONS):
+    """
+    :return: dict, {date: 写入的stop记录数}（仅包含全部分片成功的日期）
+    """
+    aquirer = DataAquirer(host)
+    try:
+        dates = aquirer.getPendingDates()
+        if not dates:
+            print('no pending dates')
+            return {}
+        # 基准收率按日期在主连接上预先查询，任务间共享
+        plans = {}
+        for date in dates:
+            equips = aquirer.getEquip(date)
+            parts = [equips[i::partitions] for i in range(partitions) if equips[i::partitions]]
+            plans[date] = (aquirer.getStandard(date), parts)
+
+        remaining = {date: len(parts) for date, (_, parts) in plans.items()}
+        counts = {date: 0 for date in dates}
+        failed = set()
+        done = {}
+        # 没有设备的日期直接记录进度
+        for date in dates:
+            if not remaining[date]:
+                aquirer.saveCheckpoint(date, 0)
+                done[date] = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process_partition, host, date, equips, standard): date
+                       for date, (standard, parts) in plans.items() for equips in parts}
+            for future in as_completed(futures):
+                date = futures[future]
+                try:
+                    counts[date] += future.result()
+                except Exception as e:
+                    # 失败的日期保持running，下次运行重新处理（写入为upsert，可重复执行）
+                    failed.add(date)
+                    print(f"{date}: partition failed: {e}")
+                remaining[date] -= 1
+                if remaining[date] == 0 and date not in failed:
+                    aquirer.saveCheckpoint(date, counts[date])
+                    done[date] = counts[date]
+                    print(f"{date}: {counts[date]} stop intervals imported")
+        return done
+    finally:
+        aquirer.close()
+
+
 # 梳理每个设备党日的Stop-Run时间
 def filterList(lists):
     currentList = []
@@ -127,7 +336,55 @@ def filterList(lists):
     return resultList
 
 
-def main():
+# 向量化梳理所有设备当日的Stop-Run时间（结果与逐设备filterList一致）
+def extract_intervals(events, threshold=STOP_THRESHOLD):
+    """
+    :param events: DataFrame, db_event_et的STOP/RUN事件（全部设备）
+    :return: DataFrame, 列 equip / lot / stop / run / val
+    """
+    columns = ['equip', 'lot', 'stop', 'run', 'val']
+    if events.empty:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame({
+        'equip': events['EQUIP_Name'].values,
+        'lot': events.iloc[:, LOT_COL].values,
+        'event': events.iloc[:, EVENT_COL].values,
+        'time': pd.to_datetime(events.iloc[:, TIME_COL].values),
+    })
+    df = df.sort_values(['equip', 'time'], kind='mergesort').reset_index(drop=True)
+    equip = df.groupby('equip', sort=False)
+    is_stop = df['event'].eq('STOP')
+    is_run = df['event'].eq('RUN')
+
+    # 每个事件之前最近一次RUN的时间和lot
+    df['last_run'] = df['time'].where(is_run).groupby(df['equip']).ffill()
+    df['last_lot'] = df['lot'].where(is_run).groupby(df['equip']).ffill()
+    df['last_run'] = df.groupby('equip')['last_run'].shift(1)
+    df['last_lot'] = df.groupby('equip')['last_lot'].shift(1)
+
+    # 记录起点STOP：设备第一个STOP；紧跟RUN之后的STOP；
+    # 第一个STOP之前已有RUN时，第二个STOP也会结束第一条记录
+    stop_rank = is_stop.groupby(df['equip']).cumsum()
+    run_before_first = (is_run & (stop_rank == 0)).groupby(df['equip']).transform('any')
+    prev_event = equip['event'].shift(1)
+    boundary = is_stop & ((stop_rank == 1) | prev_event.eq('RUN') | ((stop_rank == 2) & run_before_first))
+
+    # 每个起点结束上一条记录：stop为上一起点时间，run/lot为本起点之前最后一次RUN
+    starts = df[boundary].copy()
+    starts['stop'] = starts.groupby('equip')['time'].shift(1)
+    result = starts[starts['stop'].notna()]
+    result = pd.DataFrame({
+        'equip': result['equip'].values,
+        'lot': result['last_lot'].values,
+        'stop': result['stop'].values,
+        'run': result['last_run'].values,
+    })
+    result['val'] = result['run'] - result['stop']
+    # 只保留超时5分钟的记录（同filterList，按timedelta.seconds判断）
+    return result[result['val'].dt.seconds > threshold].reset_index(drop=True)
+
+
+def main(mode='daily'):
     host_prod = {
         'host': '172.27.154.57',
         'usr': 'remoteuser',
@@ -140,16 +397,19 @@ def main():
         'pwd': 'password',
         'db': 'cmsalpha',
     }
+    # range：补跑上次监视之后遗漏的所有日期
+    if mode == 'range':
+        catch_up(host_test)
+        return
     myDataAquirer = DataAquirer(host_test)
-    equipList = myDataAquirer.getEquip()
     standardYield = myDataAquirer.getStandard()
     print(standardYield)
-    for equip in equipList:
-        print(equip)
-        rows = myDataAquirer.getRecord(equip)
-        list = filterList(rows)
-        # 将equip，List写入数据库
-        myDataAquirer.importer(equip,list, standardYield)
+    # 一次获取当天全部事件并向量化配对
+    intervals = extract_intervals(myDataAquirer.getDayEvents())
+    # 批量补充收率并一次写入数据库
+    count = myDataAquirer.importBatch(intervals, standardYield)
+    myDataAquirer.saveCheckpoint(myDataAquirer.maxDate, count)
+    print(f"{myDataAquirer.maxDate}: {count} stop intervals imported")
 
 
 
@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 from scipy import stats
 from datetime import datetime
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # 数据库连接配置
 db_config = {
@@ -13,6 +14,14 @@ db_config = {
     'database': 'cmsalpha'
 }
 
+# 分组键：产品属性 + 工序 + 设备型号 + 测试台 + 程序
+GROUP_KEYS = ['Product_Mode', 'Tech_Name', 'Die_Density', 'Product_Density', 'Module_Type',
+              'oper', 'model', 'm_table', 'pgm']
+# 正态性检验最少样本数
+NORMALITY_MIN_SIZE = 8
+# lot_id参数绑定分块大小
+LOT_CHUNK_SIZE = 1000
+
 def get_lot_ids():
     # 连接到数据库
     connection = pymysql.connect(**db_config)
@@ -43,119 +52,110 @@ def get_lot_ids():
 
     return lot_ids, max_workdt
 
-def analyze_test_time(lot_ids):
-    # 连接到数据库
-    connection = pymysql.connect(**db_config)
-    cursor = connection.cursor()
+def fetch_test_scatter(connection, lot_ids, chunk_size=LOT_CHUNK_SIZE):
+    """按lot_id分块参数绑定查询测试时间（不再拼接IN字符串）"""
+    frames = []
+    for i in range(0, len(lot_ids), chunk_size):
+        chunk = list(lot_ids[i:i + chunk_size])
+        placeholders = ', '.join(['%s'] * len(chunk))
+        query = f"""
+        SELECT 
+            dd.Product_Mode,
+            dd.Tech_Name,
+            dd.Die_Density,
+            dd.Product_Density,
+            dd.Module_Type,
+            dts.oper,
+            dts.model,
+            SUBSTRING(dts.table_id, 1, 5) AS m_table,
+            dts.pgm,
+            dts.serial_no,
+            dts.test_time
+        FROM 
+            cmsalpha.db_test_scatter dts
+        JOIN 
+            modulemte.db_deviceinfo dd ON dts.device = dd.Device 
+        WHERE  
+            dts.lot_id IN ({placeholders}) 
+            AND dts.oper IN ('5600','5700', '5710','5780')
+            AND dts.result = 'P';
+        """
+        frames.append(pd.read_sql(query, connection, params=chunk))
+    if not frames:
+        return pd.DataFrame(columns=GROUP_KEYS + ['serial_no', 'test_time'])
+    return pd.concat(frames, ignore_index=True)
 
-    lot_id_str = ','.join([f"'{lot_id}'" for lot_id in lot_ids])
-
-    query = f"""
-    SELECT 
-        dd.Product_Mode,
-        dd.Tech_Name,
-        dd.Die_Density,
-        dd.Product_Density,
-        dd.Module_Type,
-        dts.oper,
-        dts.model,
-        SUBSTRING(dts.table_id, 1, 5) AS m_table,
-        dts.pgm,
-        dts.serial_no,
-        dts.test_time
-    FROM 
-        cmsalpha.db_test_scatter dts
-    JOIN 
-        modulemte.db_deviceinfo dd ON dts.device = dd.Device 
-    WHERE  
-        dts.lot_id IN ({lot_id_str}) 
-        AND dts.oper IN ('5600','5700', '5710','5780')
-        AND dts.result = 'P';
-    """
 
-    df = pd.read_sql(query, connection)
-
-    # 逐个产品类别和工序进行分析
-    product_groups = df.groupby(['Product_Mode', 'Tech_Name', 'Die_Density',
-                                 'Product_Density', 'Module_Type', 'oper', 'model', 'm_table', 'pgm'])
-
-    results = []
-
-    for (product_mode, tech_name, die_density, product_density, module_type, oper, model, m_table, pgm), group in product_groups:
-        print(f"Analyzing {product_mode} {tech_name} {die_density} {product_density} {module_type} {oper} {model} {m_table} {pgm}")
-
-        # 统计描述
-        try:
-            desc = group['test_time'].describe().to_dict()
-            min_val = desc.get('min', None)
-            max_val = desc.get('max', None)
-            q1 = desc.get('25%', None)
-            q2 = desc.get('50%', None)
-            q3 = desc.get('75%', None)
-            mean_val = desc.get('mean', None)
-            stddev_val = desc.get('std', None)
-            if pd.isna(stddev_val): stddev_val = None
-        except Exception as e:
-            print(f"Error in describe: {e}")
-            min_val = max_val = q1 = q2 = q3 = mean_val = stddev_val = None
-
-        # 正态性检验
-        normality = {}
-        try:
-            if len(group) >= 8:
-                k2, p = stats.normaltest(group['test_time'])
-                normality[m_table] = p
-            else:
-                normality[m_table] = -1  # 或者其他合适的默认值
-        except Exception as e:
-            print(f"Error in normaltest: {e}")
-            normality[m_table] = -1
-
-        # CPK计算
-        def calculate_cpk(series, lsl, usl):
-            mean = series.mean()
-            std = series.std()
-            if std == 0:
-                return -1
-            cpk = min((usl - mean) / (3 * std), (mean - lsl) / (3 * std))
-            return cpk
-
-        try:
-            lsl = min_val if min_val is not None else 0
-            usl = max_val if max_val is not None else 1
-            cpk = calculate_cpk(group['test_time'], lsl, usl)
-            if np.isnan(cpk):
-                cpk = -1
-        except Exception as e:
-            print(f"Error in CPK calculation: {e}")
-            cpk = -1
-
-        results.append({
-            'Product_Mode': product_mode,
-            'Tech_Name': tech_name,
-            'Die_Density': die_density,
-            'Product_Density': product_density,
-            'Module_Type': module_type,
-            'oper': oper,
-            'model': model,
-            'm_table': m_table,
-            'pgm': pgm,
-            'avg_test_time': mean_val,
-            'stddev_test_time': stddev_val,
-            'min': min_val,
-            'max': max_val,
-            'quater1': q1,
-            'quater2': q2,
-            'quater3': q3,
-            'cpk': cpk,
-            'normality_p_value': normality[m_table],
-            'sample_size': group['m_table'].value_counts().to_dict().get(m_table, 0)
-        })
+def _normaltest_p(values):
+    try:
+        return stats.normaltest(values)[1]
+    except Exception as e:
+        print(f"Error in normaltest: {e}")
+        return -1
 
-    # 关闭数据库连接
-    connection.close()
 
-    return results
+def normality_p_values(arrays, workers=0):
+    """对样本数足够的分组做正态性检验，workers>1时使用进程池"""
+    if workers > 1 and len(arrays) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_normaltest_p, arrays, chunksize=max(1, len(arrays) // (workers * 4))))
+    return [_normaltest_p(values) for values in arrays]
+
+
+def calculate_group_stats(df, keys=GROUP_KEYS, normality_workers=0):
+    """
+    所有分组一次计算：四分位、均值、标准差、CPK（以min/max为规格限），仅样本数>=8的分组做正态性检验
+    :return: DataFrame, 每个分组一行，列同save_results_to_db所需字段
+    """
+    grouped = df.groupby(keys)['test_time']
+    result = grouped.agg(sample_size='count', avg_test_time='mean', stddev_test_time='std',
+                         min='min', max='max')
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    result['quater1'] = quartiles[0.25]
+    result['quater2'] = quartiles[0.5]
+    result['quater3'] = quartiles[0.75]
+
+    # CPK：min((USL-mean)/3σ, (mean-LSL)/3σ)，σ为0或无法计算时为-1
+    mean = result['avg_test_time'].values
+    std = result['stddev_test_time'].values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cpk = np.minimum((result['max'].values - mean) / (3 * std), (mean - result['min'].values) / (3 * std))
+    result['cpk'] = np.where((std == 0) | np.isnan(cpk), -1, cpk)
+
+    # 正态性检验：样本不足的分组为-1
+    result['normality_p_value'] = -1.0
+    need_test = (result['sample_size'] >= NORMALITY_MIN_SIZE).values
+    if need_test.any():
+        indices = grouped.indices
+        values = df['test_time'].values
+        arrays = [values[indices[key]] for key in result.index[need_test]]
+        result.loc[need_test, 'normality_p_value'] = normality_p_values(arrays, normality_workers)
+
+    result = result.reset_index()
+    # 标准差无法计算（单样本）时为None
+    result['stddev_test_time'] = result['stddev_test_time'].astype(object).where(
+        result['stddev_test_time'].notna(), None)
+    return result
+
+
+def analyze_test_time(lot_ids, normality_workers=0):
+    # 连接到数据库
+    connection = pymysql.connect(**db_config)
+    try:
+        df = fetch_test_scatter(connection, lot_ids)
+    finally:
+        # 关闭数据库连接
+        connection.close()
+
+    # 无lot或无合格记录时没有可统计的分组
+    if df.empty:
+        print("No test records to analyze")
+        return []
+
+    # 所有产品类别和工序一次统计
+    result = calculate_group_stats(df, normality_workers=normality_workers)
+    print(f"Analyzed {len(result)} groups from {len(df)} test records")
+    return result.to_dict('records')
 
 def save_results_to_db(results, workdt):
     # 连接到数据库
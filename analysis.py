@@ -140,6 +140,43 @@ class Data:
         # 返回处理后的数据以及相关性分析结果
         return processed_data, chi2_stat, p_val, dof, expected
 
+    def getMultiFactorData(self, table, factors, eventQty, caseQty, conditionField, condition):
+        """
+        一次扫描按全部因素组合分组，内存中按各因素上卷后逐个做卡方检验
+        :return: (各因素结果 {factor: (processed_data, chi2_stat, p_val, dof, expected)}, 按P值升序的因素列表)
+        """
+        con = self.connect_to_database('cmsalpha')
+        try:
+            group_fields = ', '.join(factors)
+            sql = f"""SELECT {group_fields}, SUM({eventQty}) AS inQty, SUM({caseQty}) AS outQty
+                     FROM {table}
+                     WHERE {conditionField} = %s
+                     GROUP BY {group_fields};"""
+            result = self.execute_sql(con, sql, (condition,))
+        finally:
+            con.close()
+
+        factor_results = {}
+        for i, factor in enumerate(factors):
+            processed_data = {}
+            for row in result:
+                data = processed_data.setdefault(row[i], {'in_qty': 0, 'out_qty': 0})
+                data['in_qty'] += int(row[-2])
+                data['out_qty'] += int(row[-1])
+            for data in processed_data.values():
+                data['new_yield'] = data['out_qty'] / data['in_qty'] if data['in_qty'] else 0.0
+            # 卡方独立性检验（与getOneFactorData相同的列联表）
+            contingency_table = [[data['in_qty'], data['out_qty']] for data in processed_data.values()]
+            try:
+                chi2_stat, p_val, dof, expected = stats.chi2_contingency(contingency_table)
+            except ValueError:
+                # 只有一个水平或存在0期望频数时无法检验
+                chi2_stat, p_val, dof, expected = float('nan'), float('nan'), 0, None
+            factor_results[factor] = (processed_data, chi2_stat, p_val, dof, expected)
+        # 按P值升序排列（无法检验的排在最后）
+        ranking = sorted(factors, key=lambda f: (factor_results[f][2] != factor_results[f][2], factor_results[f][2]))
+        return factor_results, ranking
+
 
 def get_watch_issue(host):
     host['database'] = 'modulemte'
@@ -170,7 +207,8 @@ def log_factor_analysis(a, factor_name, searchDate, custom_logger, DB):
     - custom_logger: 自定义日志记录器，用于输出日志信息。
     - DB: 目标数据库
     """
-    if DB == 'db_yielddetail':
+    # db_yield_cube为db_yielddetail的日别预聚合（analysis/yield_cube.py），字段一致
+    if DB in ('db_yielddetail', 'db_yield_cube'):
         in_field = 'in_qty'
         out_field = 'out_qty'
         condition_field = 'workdt'
@@ -184,6 +222,37 @@ def log_factor_analysis(a, factor_name, searchDate, custom_logger, DB):
     custom_logger.log_info(f'{factor_name}别期望：{expected}')
 
 
+def log_multi_factor_analysis(a, factor_names, searchDate, custom_logger, DB):
+    """
+    一次查询分析全部因素，按P值排序输出（参数同log_factor_analysis，factor_names为因素列表）
+    """
+    if DB in ('db_yielddetail', 'db_yield_cube'):
+        in_field = 'in_qty'
+        out_field = 'out_qty'
+        condition_field = 'workdt'
+    if DB == 'db_yield_cube':
+        # 良率立方体由yield_cube夜间刷新，未执行时当天无数据（P值为nan），先提示
+        con = a.connect_to_database('cmsalpha')
+        try:
+            latest = a.execute_sql(con, "SELECT MAX(workdt) FROM db_yield_cube", ())[0][0]
+        finally:
+            con.close()
+        if latest is None or latest < searchDate:
+            custom_logger.log_info(f'良率立方体数据截至{latest}，早于分析日期{searchDate}，请先执行yield_cube刷新')
+    factor_results, ranking = a.getMultiFactorData(DB, factor_names, in_field, out_field,
+                                                   condition_field, searchDate)
+    for factor_name in factor_names:
+        data, chi2_stat, p_val, dof, expected = factor_results[factor_name]
+        judge = ''
+        if float(p_val) <= 0.05:
+            judge = '*'
+        custom_logger.log_info(f'{factor_name}别P值：{p_val}{judge}')
+        custom_logger.log_info(f'{factor_name}别数据：{data}')
+        custom_logger.log_info(f'{factor_name}别期望：{expected}')
+    custom_logger.log_info('因素P值排序：' + ', '.join(f'{f}({factor_results[f][2]})' for f in ranking))
+    return ranking
+
+
 # 标记watch_dog表中analysis字段为已分析
 def mark_issue(host, time, id):
     con = pymysql.connect(host=host['host'], user=host['user'], password=host['password'], database='modulemte')
@@ -264,8 +333,7 @@ def main():
             elif issue_info['watch_id'] == 9:
                 # 以下是使用定义好的函数的示例
                 factor_names = ['oper_old', 'device_cmf7', 'grade', 'Device']
-                for factor_name in factor_names:
-                    log_factor_analysis(a, factor_name, searchDate, custom_logger, 'db_yielddetail')
+                log_multi_factor_analysis(a, factor_names, searchDate, custom_logger, 'db_yield_cube')
         # 向数据库Watch列表中标记该事项已完成分析
         mark_issue(local_host, issue_info['time'], issue_info['watch_id'])
 
@@ -8,65 +8,129 @@ import logging
 import datetime
 import ast
 import scipy.stats as stats
-import Daily_Yield_Analysis as dya
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db_engine import get_engine
 
 
-def main():
+# 离群筛选结果表
+OUTLIER_TABLE = 'cmsalpha.db_testtime_outlier'
+# 产品/工序键（同db_testtime_analysis）
+GROUP_KEYS = ['product_mode', 'tech_name', 'die_density', 'product_density', 'module_type', 'oper']
+SUMMARY_COLUMNS = ['workdt'] + GROUP_KEYS + ['model', 'm_table', 'pgm', 'avg_test_time', 'stddev_test_time',
+                                              'min', 'max', 'quater1', 'quater2', 'quater3', 'sample_size']
+# Tukey系数、稳健z-score阈值
+TUKEY_K = 1.5
+ROBUST_Z_THRESHOLD = 3.5
+
+OUTLIER_DDL = f"""
+CREATE TABLE IF NOT EXISTS {OUTLIER_TABLE} (
+    workdt CHAR(8) NOT NULL,
+    product_mode VARCHAR(32) NOT NULL,
+    tech_name VARCHAR(32) NOT NULL,
+    die_density VARCHAR(16) NOT NULL,
+    product_density VARCHAR(16) NOT NULL,
+    module_type VARCHAR(16) NOT NULL,
+    oper VARCHAR(16) NOT NULL,
+    m_table VARCHAR(16) NOT NULL,
+    equip_prefix VARCHAR(16) NULL,
+    model VARCHAR(32) NULL,
+    pgm VARCHAR(64) NULL,
+    quater2 DOUBLE NULL,
+    lower_bound DOUBLE NULL,
+    upper_bound DOUBLE NULL,
+    robust_z DOUBLE NULL,
+    tukey_flag TINYINT(1) NOT NULL DEFAULT 0,
+    robust_flag TINYINT(1) NOT NULL DEFAULT 0,
+    update_time DATETIME NOT NULL,
+    PRIMARY KEY (workdt, product_mode, tech_name, die_density, product_density, module_type, oper, m_table)
+)
+"""
+
+
+def load_summaries(engine, start, end):
+    """读取日期范围内的测试时间汇总（db_testtime_analysis）"""
+    query = text(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM db_testtime_analysis "
+                 f"WHERE workdt BETWEEN :start AND :end")
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn, params={'start': start, 'end': end})
+    return df
+
+
+def screen_outliers(df, k=TUKEY_K, z_threshold=ROBUST_Z_THRESHOLD):
+    """
+    向量化离群筛选（整个日期范围一次计算）
+    1. Tukey：组内min/max超出 [Q1 - k*IQR, Q3 + k*IQR]
+    2. 稳健z-score：同一天、同产品工序、同设备前缀的测试台之间比较中位测试时间，
+       z = 0.6745 * (x - median) / MAD，MAD为0时 z = (x - median) / (1.2533 * MeanAD)
+    :return: DataFrame, 增加equip_prefix/lower_bound/upper_bound/robust_z/tukey_flag/robust_flag列
+    """
+    df = df.copy()
+    df['equip_prefix'] = df['m_table'].str.extract(r'^([A-Z]+[0-9]+)', expand=False)
+    for col in ['min', 'max', 'quater1', 'quater2', 'quater3']:
+        df[col] = df[col].astype(float)
+
+    iqr = df['quater3'] - df['quater1']
+    df['lower_bound'] = df['quater1'] - k * iqr
+    df['upper_bound'] = df['quater3'] + k * iqr
+    df['tukey_flag'] = ((df['min'] < df['lower_bound']) | (df['max'] > df['upper_bound'])).astype(int)
+
+    peer_keys = ['workdt'] + GROUP_KEYS + ['equip_prefix']
+    peers = df.groupby(peer_keys, dropna=False)['quater2']
+    median = peers.transform('median')
+    deviation = (df['quater2'] - median).abs()
+    peer_deviation = deviation.groupby([df[key] for key in peer_keys], dropna=False)
+    mad = peer_deviation.transform('median')
+    # 半数以上测试台相同时MAD为0，改用平均绝对偏差：scale = 1.2533 * mean|x - median|
+    mean_ad = peer_deviation.transform('mean')
+    scale = np.where(mad > 0, mad / 0.6745, 1.2533 * mean_ad)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['robust_z'] = np.where(scale > 0, (df['quater2'] - median) / scale, 0.0)
+    df['robust_flag'] = (np.abs(df['robust_z']) > z_threshold).astype(int)
+    return df
+
+
+def write_outliers(engine, flagged):
+    """筛出的组一次事务批量写入结果表"""
+    columns = ['workdt'] + GROUP_KEYS + ['m_table', 'equip_prefix', 'model', 'pgm', 'quater2', 'lower_bound',
+                                         'upper_bound', 'robust_z', 'tukey_flag', 'robust_flag']
+    if flagged.empty:
+        return 0
+    data = flagged[columns].astype(object).where(flagged[columns].notna(), None).to_dict('records')
+    update_clause = ', '.join(f"{col} = VALUES({col})" for col in columns[8:])
+    with engine.begin() as conn:
+        conn.execute(text(OUTLIER_DDL))
+        conn.execute(text(f"INSERT INTO {OUTLIER_TABLE} ({', '.join(columns)}, update_time) "
+                          f"VALUES ({', '.join(':' + col for col in columns)}, NOW()) "
+                          f"ON DUPLICATE KEY UPDATE {update_clause}, update_time = NOW()"), data)
+    return len(data)
+
+
+def main(start=None, end=None):
     host = {
         'host': 'localhost',
         'user': 'remoteuser',
         'password': 'password',
         'database': 'cmsalpha',
     }
+    # 默认筛选昨天，可指定日期范围回溯历史
     workdt = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y%m%d')
-    dateStandard = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-    dateStandard_dt = datetime.datetime.strptime(dateStandard, '%Y-%m-%d')
-    searchStartTime = dateStandard_dt + datetime.timedelta(hours=7)
-    searchEndTime = searchStartTime + datetime.timedelta(days=1)
-    searchStartTime_str = searchStartTime.strftime('%Y-%m-%d %H:%M:%S')
-    searchEndTime_str = searchEndTime.strftime('%Y-%m-%d %H:%M:%S')
-
-    mydb = dya.DBInfo(host)
-    operList = ['5600','5710','5700','5780']
-    equipList = mydb.get_list(
-        'db_testtime_analysis',
-        'm_table',
-        'workdt',
-        workdt,
-        workdt,
-    )
-    equipList = extract_prefixes(equipList)
-    column = ['product_mode','tech_name','die_density','product_density',
-              'module_type','oper','model','m_table','stddev_test_time',
-              'min','max','quater1','quater2','quater3']
-    condition =  ['workdt = ' + workdt]
-    records = mydb.execute_query(
-        'db_testtime_analysis',
-        columns=column,
-        conditions=condition,
-        order_by='m_table asc'
-    )
-    # 保存满足条件的记录
-    filtered_records = []
-
-    # 遍历每一条记录
-    for record in records:
-        # 获取 stddev_test_time, min, max 列的值
-        stddev_test_time = record[8]
-        min_val = record[9]
-        max_val = record[10]
-        Q1 = record[11]
-        Q2 = record[12]
-        Q3 = record[13]
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-
-        # 判断是否有离群点
-        if min_val<lower_bound or max_val>upper_bound:
-            filtered_records.append(record)
-    for item in filtered_records:
+    start = start or workdt
+    end = end or workdt
+
+    engine = get_engine(host)
+    df = load_summaries(engine, start, end)
+    if df.empty:
+        print(f"{start}~{end} 无测试时间汇总数据")
+        return None
+    screened = screen_outliers(df)
+    flagged = screened[(screened['tukey_flag'] == 1) | (screened['robust_flag'] == 1)]
+    count = write_outliers(engine, flagged)
+    print(f"{start}~{end} 共 {len(screened)} 组，离群 {count} 组")
+    for item in flagged.itertuples(index=False):
         print(item)
+    return flagged
 
 
 def extract_prefixes(equip_list):
@@ -10,6 +10,7 @@ import ast
 import scipy.stats as stats
 from scipy.stats import shapiro
 import numpy as np
+from kpi_stats import get_kpi_service
 
 
 class DataSource:
@@ -71,7 +72,7 @@ def cumYield(workdt, data):
     KPI_Value = data.KPIValue(workdt, 'c_yield')
     print(KPI_Value)
 
-def mainKPI(kpiList, workdt, data):
+def mainKPI(kpiList, workdt, data, service=None):
     for kpi in kpiList:
         print(f"【当前分析的指标是{kpi}】")
         KPI_Value = data.KPIValue(workdt, kpi)
@@ -81,15 +82,12 @@ def mainKPI(kpiList, workdt, data):
         print(f"正态性：{is_normal}， sigma：{sigma}， 最小值：{min_name}")
     # workdt前一天日期
     workdtEnd = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y%m%d')
-    # retest rate指标查询
-    retest_formula = f"(1 - sum({'retest_cnt'})/sum({'test_cnt'})) * 100"
-    retest = data.query_metric('test_cnt', 'retest_cnt', 'db_et_retest', workdtEnd, retest_formula, 'date_val')
-    print(retest)
-
-    # DC指标查询
-    dcfa_formula = f"sum({'dcfa_qty'})/sum({'in_qty'}) * 1000000"
-    dcfa = data.query_metric('dcfa_qty', 'in_qty', 'db_dcfa', workdtEnd, dcfa_formula, 'workdt')
-    print(dcfa)
+    # 日别KPI及近30天统计（KPI统计服务）
+    service = service or get_kpi_service({'host': data.host, 'user': data.user,
+                                          'password': data.password, 'database': data.database})
+    for kpi in ['retest', 'dcfa']:
+        desc = service.describe(kpi, workdtEnd, window=30)
+        print(f"{kpi}：{desc['value']}， 近30天均值：{desc['mean']}， z-score：{desc['zscore']}")
 
 def main():
     hostLocal = {
@@ -10,6 +10,11 @@ import ast
 import scipy.stats as stats
 from scipy.stats import shapiro
 import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from kpi_stats import get_kpi_service
+from db_engine import get_engine
+from yield_cube import check_cube_fresh
 
 
 class DBInfo:
@@ -67,10 +72,82 @@ class DBInfo:
         cur.close()
 
 
+    def new_connection(self):
+        """并发查询时每个线程使用独立连接（pymysql连接不可跨线程共用）"""
+        return pymysql.connect(host=self.host, user=self.user, password=self.password, database=self.database)
+
     def close(self):
         self.con.close()
 
 
+# ET设备别KPI定义：指标 -> (表, 时间字段, 时间范围类型, 设备字段, 聚合表达式, 附加条件)
+# 时间范围类型：'workdt' 为YYYYMMDD，'date_val' 为YYYY-MM-DD
+ET_KPI_METRICS = {
+    'c_yield': ('db_yield_cube', 'workdt', 'workdt', 'main_equip_id',
+                "sum(out_qty)/sum(in_qty) * 100", ("oper_old = '5600'",)),
+    'p_yield': ('db_primeyieldet', 'date_val', 'date_val', 'equip_id',
+                "sum(bin1_cnt)/sum(test_cnt)*100", ()),
+    'qty': ('db_yield_cube', 'workdt', 'workdt', 'main_equip_id',
+            "sum(in_qty)", ("oper_old = '5600'",)),
+    'retest': ('db_et_retest', 'date_val', 'workdt', 'equip_id',
+               "sum(retest_cnt)/sum(test_cnt)*100", ()),
+    'dcfa': ('db_dcfa', 'workdt', 'workdt', 'equip_id',
+             "sum(dcfa_qty)/sum(in_qty)*1000000", ()),
+}
+
+
+class KPIExtractor:
+    """KPI提取：同表同条件的指标合并为一次查询，不同表并发查询，按设备外连接"""
+
+    def __init__(self, db, metrics=None, workers=4):
+        self.db = db
+        self.metrics = metrics or ET_KPI_METRICS
+        self.workers = workers
+
+    def plan(self, metric_names):
+        """(表, 时间字段, 时间范围类型, 设备字段, 附加条件) -> 指标列表"""
+        queries = {}
+        for name in metric_names:
+            table, time_field, range_type, equip_field, expression, conditions = self.metrics[name]
+            queries.setdefault((table, time_field, range_type, equip_field, conditions), []).append(name)
+        return queries
+
+    def _fetch(self, query_key, metric_names, ranges, connection):
+        table, time_field, range_type, equip_field, conditions = query_key
+        columns = [f"{self.metrics[name][4]} AS {name}" for name in metric_names]
+        where = [f"{time_field} BETWEEN %s AND %s", *conditions]
+        sql = (f"SELECT {equip_field} AS equip, {', '.join(columns)} FROM {table} "
+               f"WHERE {' AND '.join(where)} GROUP BY {equip_field} ORDER BY {equip_field} ASC")
+        with connection.cursor() as cur:
+            cur.execute(sql, ranges[range_type])
+            rows = cur.fetchall()
+        df = pd.DataFrame(list(rows), columns=['equip'] + metric_names).set_index('equip')
+        return df.astype(float)
+
+    def _fetch_own_connection(self, query_key, metric_names, ranges):
+        connection = self.db.new_connection()
+        try:
+            return self._fetch(query_key, metric_names, ranges, connection)
+        finally:
+            connection.close()
+
+    def extract(self, ranges, metric_names=None):
+        """
+        :param ranges: dict, {'workdt': (start, end), 'date_val': (start, end)}
+        :return: DataFrame, 索引为equip，列为各指标（缺失为NaN）
+        """
+        metric_names = list(metric_names or self.metrics)
+        queries = self.plan(metric_names)
+        if self.workers > 1 and len(queries) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(queries))) as executor:
+                futures = [executor.submit(self._fetch_own_connection, key, names, ranges)
+                           for key, names in queries.items()]
+                frames = [future.result() for future in futures]
+        else:
+            frames = [self._fetch(key, names, ranges, self.db.con) for key, names in queries.items()]
+        return pd.concat(frames, axis=1, join='outer').sort_index()[metric_names]
+
+
 class Analyzer:
     def __init__(self, db):
         self.db = db
@@ -80,7 +157,8 @@ class Analyzer:
             f"workdt BETWEEN '{searchStart}' AND '{searchEnd}'",
             "oper_old = '5600'"
         ]
-        return self.db.execute_query('db_yielddetail', columns, conditions, group_by, order_by)
+        # 日别良率立方体（yield_cube.py）与db_yielddetail字段一致，预聚合后无需扫描明细
+        return self.db.execute_query('db_yield_cube', columns, conditions, group_by, order_by)
 
     def prime_by_equip(self, searchStart, searchEnd, columns, group_by, order_by):
         conditions = [
@@ -143,6 +221,11 @@ class Analyzer:
         combined_data = combine_data(ETcumYield_byEquip, ETPrimeYield_byEquip, ETqty_byEquip,ETRetestRate_byEquip, DCFA_byEquip)
         return combined_data
 
+    def ETKPIFrame(self, workdtStart, workdtEnd, dateValStart, dateValEnd, workers=4):
+        """ET设备别KPI（同ETRawData，5个指标合并为4次查询并发执行），返回DataFrame"""
+        ranges = {'workdt': (workdtStart, workdtEnd), 'date_val': (dateValStart, dateValEnd)}
+        return KPIExtractor(self.db, workers=workers).extract(ranges)
+
 def combine_data(yield_data, prime_yield_data,qty_data, retest_data, dcfa_data):
     combined_data = {}
     for equip, c_yield in yield_data:
@@ -199,6 +282,33 @@ def combine_data(yield_data, prime_yield_data,qty_data, retest_data, dcfa_data):
             }
     return combined_data
 
+def describe_frame(df, workdt):
+    """
+    所有指标一次计算：正态性、max-min、标准差、(max-min)/std、最小/最大值及对应设备
+    :param df: DataFrame, 索引为设备，列为指标
+    """
+    values = df.astype(float)
+    _, p_values = shapiro(values.values, axis=0, nan_policy='omit')
+    max_values = values.max()
+    min_values = values.min()
+    tolerance = max_values - min_values
+    std_dev = values.std(ddof=1)  # ddof=1 用于样本标准差
+    sigma = tolerance / std_dev
+    summary = pd.DataFrame({
+        'workdt': workdt,
+        'data_type': values.columns,
+        'normal': (p_values > 0.05).astype(int),
+        'tolerence': tolerance.round(2).values,
+        'stdv': std_dev.round(2).values,
+        'sigma': sigma.round(2).values,
+        'min_value': min_values.round(2).values,
+        'min_name': values.idxmin().values,
+        'max_value': max_values.round(2).values,
+        'max_name': values.idxmax().values,
+    })
+    return summary.to_dict('records')
+
+
 def describe_data(data, workdt):
     c_yields = {device: float(item['c_yield']) for device, item in data.items()}
     p_yields = {device: float(item['p_yield']) for device, item in data.items()}
@@ -256,12 +366,19 @@ def main():
         dateValStart = (datetime.datetime.now() - datetime.timedelta(days=3)).strftime('%Y-%m-%d')
         mydb = DBInfo(host)
         myAnalyzer = Analyzer(mydb)
-        etData = myAnalyzer.ETRawData(workdtStart, workdtEnd, dateValStart, dateValEnd)
-        etData.pop('2MTV01', None)
+        # c_yield读取良率立方体，夜间刷新未执行时提示
+        check_cube_fresh(get_engine(host), workdtEnd)
+        etData = myAnalyzer.ETKPIFrame(workdtStart, workdtEnd, dateValStart, dateValEnd)
+        etData = etData.drop(index='2MTV01', errors='ignore')
         # 对数据进行分析
-        data_form = describe_data(etData, workdt)
+        data_form = describe_frame(etData, workdt)
         mydb.insert_data('db_kpi_describe', data_form)
         print(data_form)
+        # 日别KPI序列增量刷新（KPI_Static_FA / Daily_analysis共用）
+        kpi_service = get_kpi_service(host)
+        kpi_service.refresh(end=workdtEnd)
+        for kpi in ['c_yield', 'p_yield', 'retest', 'dcfa']:
+            print(kpi_service.describe(kpi, workdtEnd))
     except Exception as e:
         logging.error("Error occurred", exc_info=True)
     finally:
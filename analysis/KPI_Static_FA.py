@@ -1,42 +1,41 @@
 import sys
-import numpy as np
 import sqlalchemy
-from sqlalchemy import create_engine, text
-import pandas as pd
+from sqlalchemy import text
+from db_engine import get_engine
+from kpi_stats import get_kpi_service, KPI_DEFINITIONS
 import matplotlib.pyplot as plt
 
 
 # 获取KPI指数信息: 最近一天的workdt, sigma值
 def get_kpi_info(engine, kpi):
-    query = text(f"SELECT workdt, sigma FROM db_kpi_describe "
-                 f"WHERE data_type = '{kpi}' "
-                 f"ORDER BY workdt DESC "
-                 f"LIMIT 1;")
+    query = text("SELECT workdt, sigma FROM db_kpi_describe "
+                 "WHERE data_type = :kpi "
+                 "ORDER BY workdt DESC "
+                 "LIMIT 1;")
     with engine.connect() as connection:
-        result = connection.execute(query).fetchone()
+        result = connection.execute(query, {'kpi': kpi}).fetchone()
     return result if result else None
 
 
-# 分析KPI相关指标
-def analyze_kpi(engine, kpi, workdt):
-    # 计算workdt：格式YYYYMMDD，前30天的wokrdt
-    workdt = pd.to_datetime(workdt, format='%Y%m%d')
-    start_date = workdt - pd.Timedelta(days=30)
-    start_date = start_date.strftime('%Y%m%d')
-    end_date = workdt.strftime('%Y%m%d')
-    if kpi == 'c_yield':
-        # 从db_yielddetail中获取cum yield指标
-        query = text(f"SELECT workdt, SUM(in_qty) AS s_in, SUM(out_qty) AS s_out, "
-                     f"ROUND(SUM(out_qty)/SUM(in_qty)*100,2) AS {kpi} "
-                     f"FROM db_yielddetail "
-                     f"WHERE workdt BETWEEN '{start_date}' AND '{end_date}' "
-                     f"GROUP BY workdt;")
-        with engine.connect() as connection:
-            df = pd.read_sql(query, connection)
-        # 对KPI指标进行统计学分析
-        stats = df[kpi].describe()
-        z_scores = np.abs(stats.zscore(df[kpi]))
-        pass
+# 分析KPI相关指标：前30天日别序列的滚动统计及异常日
+def analyze_kpi(service, kpi, workdt, window=30, threshold=3.0):
+    if kpi not in KPI_DEFINITIONS:
+        print(f"{kpi}不在KPI统计服务中，无法分析。")
+        return None
+    workdt = str(workdt).replace('-', '')
+    # 对KPI指标进行统计学分析
+    desc = service.describe(kpi, workdt, window=window)
+    print(f"{kpi}近{window}天统计: 均值={desc['mean']}, 标准差={desc['std']}, "
+          f"当日值={desc['value']}, z-score={desc['zscore']}, sigma={desc['sigma']}")
+    outliers = service.outliers(kpi, workdt, window=window, threshold=threshold)
+    if outliers.empty:
+        print(f"{kpi}近{window}天无|z|>{threshold}的异常日。")
+    else:
+        for day, row in outliers.iterrows():
+            print(f"异常日 {day}: {kpi}={row['value']:.2f}, z-score={row['zscore']:.2f}")
+    return outliers
+
+
 # 主函数
 def main(mode):
     if mode == 'test':
@@ -45,7 +44,8 @@ def main(mode):
     else:
         dbAddress = '172.27.154.57'
     # 创建数据库连接
-    engine = create_engine(f'mysql+pymysql://remoteuser:password@{dbAddress}/cmsalpha')
+    engine = get_engine(f'mysql+pymysql://remoteuser:password@{dbAddress}/cmsalpha')
+    service = get_kpi_service(f'mysql+pymysql://remoteuser:password@{dbAddress}/cmsalpha')
     kpiList = ['c_yield']
     # 设置中文字体
     plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
@@ -60,7 +60,7 @@ def main(mode):
             print(f"最近一天的workdt: {workdt}, sigma值: {sigma}")
             if sigma <= 3.7:
                 print(f"{kpi}的sigma值低于3.5，需进行分析。")
-                analyze_kpi(engine, kpi, workdt)
+                analyze_kpi(service, kpi, workdt)
             else:
                 print(f"{kpi}的sigma值高于3.5，无需进行分析。")
         else:
@@ -1,7 +1,9 @@
 import pandas as pd
+import numpy as np
 import sqlalchemy
 import datetime
 from sqlalchemy import text
+from db_engine import get_engine
 
 # 获取当前日期，以YYYYMMDD格式展示
 def nowWorkdt():
@@ -74,196 +76,130 @@ def writeLotCheck(engine, df):
         return False
 
 
-# 逐行比对PDA
-def checkPDA(engine):
-    query = text("""
-        SELECT dl.fab, dl.oper, dl.grade, dl.owner, dl.device,
-               dd.Product_Mode, dd.Module_Type, dd.Product_Density, 
-               dd.Die_Density, dd.Tech_Name 
-        FROM db_lotcheck dl
-        JOIN modulemte.db_deviceinfo dd ON dl.device = dd.Device
-        WHERE pda_check is NULL
-        GROUP BY fab, oper, grade, owner, Product_Mode, Module_Type, 
-                 Tech_Name, Die_Density, Module_Density
-    """)
-
-    with engine.connect() as conn:
-        pdaCondition = pd.read_sql(query, conn)
+# PDA匹配字段：lot属性 + 产品属性（db_pda中的列名映射为db_deviceinfo列名）
+PDA_KEYS = ['fab', 'oper', 'grade', 'owner', 'Product_Mode', 'Module_Type',
+            'Tech_Name', 'Die_Density', 'Product_Density']
+PDA_COLUMNS = {
+    'prodtype': 'Product_Mode',
+    'module_type': 'Module_Type',
+    'tech': 'Tech_Name',
+    'pkg_density': 'Die_Density',
+    'module_density': 'Product_Density',
+}
 
-    pdaCondition['low_yield_reverse'] = None
-    pdaCondition['ext_low_yield_reverse'] = None
 
-    for index, row in pdaCondition.iterrows():
-        params = {
-            'mode': row['Product_Mode'],
-            'fab': row['fab'],
-            'oper': row['oper'],
-            'grade': row['grade'],
-            'owner': row['owner'],
-            'type': row['Module_Type'],
-            'tech': row['Tech_Name'],
-            'pkg': row['Die_Density'],
-            'density': row['Product_Density']
-        }
-
-        # 优先完全匹配
-        query = text("""
-            SELECT low_yield_reverse, ext_low_yield_reverse 
-            FROM db_pda 
-            WHERE prodtype = :mode
-              AND fab = :fab
-              AND oper = :oper
-              AND grade = :grade
-              AND owner = :owner
-              AND module_type = :type
-              AND tech = :tech
-              AND pkg_density = :pkg
-              AND module_density = :density
-            LIMIT 1
-        """)
-
-        with engine.connect() as conn:
-            pda = pd.read_sql(query, conn, params=params)
-
-        if pda.empty:
-            # 尝试owner为空的查询
-            query = text("""
-                SELECT low_yield_reverse, ext_low_yield_reverse 
-                FROM db_pda 
-                WHERE prodtype = :mode
-                  AND fab = :fab
-                  AND oper = :oper
-                  AND grade = :grade
-                  AND (owner IS NULL OR owner = '')
-                  AND module_type = :type
-                  AND tech = :tech
-                  AND pkg_density = :pkg
-                  AND module_density = :density
-                LIMIT 1
-            """)
-            with engine.connect() as conn:
-                pda = pd.read_sql(query, conn, params=params)
-
-        if not pda.empty:
-            pdaCondition.at[index, 'low_yield_reverse'] = pda.iloc[0]['low_yield_reverse']
-            pdaCondition.at[index, 'ext_low_yield_reverse'] = pda.iloc[0]['ext_low_yield_reverse']
+def _normalize_keys(df, keys):
+    """匹配键统一为去空格大写字符串（与MySQL默认排序规则的等值比较一致）"""
+    df = df.copy()
+    for key in keys:
+        df[key] = df[key].where(df[key].isna(), df[key].astype(str).str.strip().str.upper())
+    return df
 
-    return pdaCondition
 
-# 获取Lotcheck表中所有待查数据
+# 一次加载PDA基准：完全匹配索引 + owner通配索引
+def loadPDA(engine):
+    query = text("""
+        SELECT prodtype, fab, oper, grade, owner, module_type, tech, pkg_density, module_density,
+               low_yield_reverse, ext_low_yield_reverse
+        FROM db_pda
+    """)
+    with engine.connect() as conn:
+        pda = pd.read_sql(query, conn)
+    pda = pda.rename(columns=PDA_COLUMNS)
+    wildcard = pda['owner'].isna() | (pda['owner'].astype(str).str.strip() == '')
+    keys_no_owner = [key for key in PDA_KEYS if key != 'owner']
+
+    # 完全匹配（含owner），同一键取第一条（同原LIMIT 1）
+    exact = _normalize_keys(pda[~wildcard], PDA_KEYS).dropna(subset=PDA_KEYS)
+    exact = exact.drop_duplicates(subset=PDA_KEYS).set_index(PDA_KEYS)
+    # owner为空的基准作为通配
+    any_owner = _normalize_keys(pda[wildcard], keys_no_owner).dropna(subset=keys_no_owner)
+    any_owner = any_owner.drop_duplicates(subset=keys_no_owner).set_index(keys_no_owner)
+    thresholds = ['low_yield_reverse', 'ext_low_yield_reverse']
+    return exact[thresholds], any_owner[thresholds]
+
+
+# 获取Lotcheck表中所有待查数据（一次关联设备信息）
 def getCheckLot(engine):
     query = text("""
-            SELECT workdt, device, fab, oper, grade, owner, 
-                   lot, transtime, yield 
-            FROM db_lotcheck 
-            WHERE pda_check IS NULL
+            SELECT dl.workdt, dl.device, dl.fab, dl.oper, dl.grade, dl.owner,
+                   dl.lot, dl.transtime, dl.yield,
+                   dd.Product_Mode, dd.Tech_Name, dd.Die_Density,
+                   dd.Product_Density, dd.Module_Type
+            FROM db_lotcheck dl
+            JOIN modulemte.db_deviceinfo dd ON dl.device = dd.Device
+            WHERE dl.pda_check IS NULL
         """)
 
     with engine.connect() as conn:
         df = pd.read_sql(query, conn)
 
-    return df
-
-# 对比Lot list与PDA
-def comparePDA(engine, df, pda):
-    # 使用单个连接处理所有操作
+    # db_deviceinfo中Device不唯一，同一lot只保留第一条设备信息（同原逐lot查询取第一条），
+    # 避免同一(lot, oper, transtime)得到不同判定
+    return df.drop_duplicates(subset=['lot', 'oper', 'transtime'], keep='first').reset_index(drop=True)
+
+
+# 对比Lot list与PDA（整体关联，先完全匹配，再owner通配）
+def matchPDA(df, pda):
+    exact, any_owner = pda
+    keys_no_owner = [key for key in PDA_KEYS if key != 'owner']
+    lots = _normalize_keys(df, PDA_KEYS)
+    matched = lots.join(exact, on=PDA_KEYS)
+    fallback = lots.join(any_owner, on=keys_no_owner)
+    has_exact = matched['low_yield_reverse'].notna()
+    for col in ['low_yield_reverse', 'ext_low_yield_reverse']:
+        matched[col] = matched[col].where(has_exact, fallback[col])
+
+    matched = matched[matched['low_yield_reverse'].notna()]
+    # 0: 正常；1: 低良率；2: 极低良率
+    yield_ = matched['yield'].astype(float)
+    result = np.select([yield_ >= matched['low_yield_reverse'].astype(float),
+                        yield_ > matched['ext_low_yield_reverse'].astype(float)], [0, 1], 2)
+    return pd.DataFrame({'lot': df.loc[matched.index, 'lot'], 'oper': df.loc[matched.index, 'oper'],
+                         'transtime': df.loc[matched.index, 'transtime'], 'pda_check': result})
+
+
+# 批量回写判定结果：临时表 + UPDATE ... JOIN
+def writePDACheck(engine, result):
+    if result.empty:
+        print("No lot matched PDA.")
+        return True
     with engine.connect() as conn:
-        with conn.begin():  # 开启事务
-            for index, row in df.iterrows():
-                # 参数化查询设备信息
-                device_query = text("""
-                    SELECT Product_Mode, Tech_Name, Die_Density, 
-                           Product_Density, Module_Type 
-                    FROM modulemte.db_deviceinfo 
-                    WHERE device = :device
-                """)
-                res = pd.read_sql(
-                    device_query,
-                    conn,
-                    params={'device': row['device']}
-                )
-
-                if len(res) == 0:
-                    continue
-
-                # 获取设备属性（避免使用type作为变量名）
-                device_attrs = {
-                    'mode': res['Product_Mode'].iloc[0],
-                    'tech': res['Tech_Name'].iloc[0],
-                    'pkg': res['Die_Density'].iloc[0],
-                    'density': res['Product_Density'].iloc[0],
-                    'module_type': res['Module_Type'].iloc[0]
-                }
-
-                # 构建匹配条件
-                match_conditions = [
-                    ('fab', row['fab']),
-                    ('oper', row['oper']),
-                    ('grade', row['grade']),
-                    ('owner', row['owner']),
-                    ('Product_Mode', device_attrs['mode']),
-                    ('Module_Type', device_attrs['module_type']),
-                    ('Tech_Name', device_attrs['tech']),
-                    ('Die_Density', device_attrs['pkg']),
-                    ('Product_Density', device_attrs['density'])
-                ]
-
-                # 首次匹配（包含owner）
-                mask = True
-                for col, val in match_conditions:
-                    if col in pda.columns:
-                        mask &= (pda[col] == val)
-                match = pda[mask]
-
-                # 二次匹配（不包含owner）
-                if len(match) == 0:
-                    mask = True
-                    for col, val in match_conditions:
-                        if col in pda.columns and col != 'owner':
-                            mask &= (pda[col] == val)
-                    match = pda[mask]
-
-                # 计算结果
-                if len(match) > 0:
-                    threshold = match.iloc[0]  # 取第一条匹配记录
-                    if row['yield'] >= threshold['low_yield_reverse']:
-                        result = 0
-                    elif row['yield'] > threshold['ext_low_yield_reverse']:
-                        result = 1
-                    else:
-                        result = 2
-
-                    # 参数化更新
-                    update_query = text("""
-                        UPDATE db_lotcheck
-                        SET pda_check = :result
-                        WHERE lot = :lot
-                        AND oper = :oper
-                        AND transtime = :transtime
-                    """)
-                    conn.execute(
-                        update_query,
-                        {
-                            'result': result,
-                            'lot': row['lot'],
-                            'oper': row['oper'],
-                            'transtime': row['transtime']
-                        }
-                    )
+        with conn.begin():
+            # 键字段类型取自db_lotcheck本身，避免截断或类型转换导致匹配不上
+            conn.execute(text("DROP TEMPORARY TABLE IF EXISTS tmp_pda_check"))
+            conn.execute(text("""
+                CREATE TEMPORARY TABLE tmp_pda_check (pda_check TINYINT NOT NULL)
+                SELECT lot, oper, transtime FROM db_lotcheck LIMIT 0
+            """))
+            # 普通INSERT：异常数据直接报错，不静默忽略
+            conn.execute(
+                text("INSERT INTO tmp_pda_check (lot, oper, transtime, pda_check) "
+                     "VALUES (:lot, :oper, :transtime, :pda_check)"),
+                result.to_dict('records')
+            )
+            conn.execute(text("""
+                UPDATE db_lotcheck dl
+                JOIN tmp_pda_check t
+                  ON dl.lot = t.lot AND dl.oper = t.oper AND dl.transtime = t.transtime
+                SET dl.pda_check = t.pda_check
+            """))
+            conn.execute(text("DROP TEMPORARY TABLE tmp_pda_check"))
+    print(f"{len(result)} lots updated in db_lotcheck.")
     return True
 
 
 def main(mode):
     # 数据库配置
     if mode == 'test':
-        engine = sqlalchemy.create_engine(
+        engine = get_engine(
             f"mysql+pymysql://"
             f"{'remoteuser'}:"
             f"{'password'}@"
             f"{'localhost'}:{3306}/{'cmsalpha'}"
         )
     else:
-        engine = sqlalchemy.create_engine(
+        engine = get_engine(
             f"mysql+pymysql://"
             f"{'remoteuser'}:"
             f"{'password'}@"
@@ -277,12 +213,12 @@ def main(mode):
     df = getLotList(engine, latestWorkdt, workdt)
     # 将待查lot存入数据库
     writeLotCheck(engine, df)
-    # 获取所有待确认lot
+    # 获取所有待确认lot（含设备信息）
     df = getCheckLot(engine)
-    # 获取lot所属的所有产品的PDA基准
-    pda = checkPDA(engine)
-    # 逐个lot对比PDA
-    comparePDA(engine, df, pda)
+    # 一次加载PDA基准
+    pda = loadPDA(engine)
+    # 整体匹配PDA并批量回写
+    writePDACheck(engine, matchPDA(df, pda))
 
 
 if __name__ == '__main__':
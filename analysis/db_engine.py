@@ -0,0 +1,65 @@
+import threading
+from sqlalchemy import create_engine, event
+
+
+# 连接串 -> Engine，同一进程内所有分析脚本共用连接池
+_ENGINES = {}
+_LOCK = threading.Lock()
+# 本次运行创建的Engine数、物理连接数（TCP connect）、连接池借出次数
+ENGINE_STATS = {'engines': 0, 'connections': 0, 'checkouts': 0}
+
+
+def conn_str(db_config):
+    """db_config缺省端口/字符集时使用默认值"""
+    return (
+        f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
+        f"{db_config['host']}:{db_config.get('port', 3306)}/{db_config.get('database') or 'cmsalpha'}?"
+        f"charset={db_config.get('charset', 'utf8mb4')}"
+    )
+
+
+def _count(key):
+    def listener(*args):
+        with _LOCK:
+            ENGINE_STATS[key] += 1
+    return listener
+
+
+def get_engine(url, pool_size=5, max_overflow=10, pool_recycle=3600):
+    """
+    按连接串缓存Engine（带连接池），重复调用不再新建Engine和TCP连接
+    :param url: str, 连接串，或db_config字典
+    :return: sqlalchemy Engine
+    """
+    if isinstance(url, dict):
+        url = conn_str(url)
+    with _LOCK:
+        engine = _ENGINES.get(url)
+        if engine is None:
+            engine = create_engine(url, pool_size=pool_size, max_overflow=max_overflow,
+                                   pool_recycle=pool_recycle, pool_pre_ping=True)
+            event.listen(engine, 'connect', _count('connections'))
+            event.listen(engine, 'checkout', _count('checkouts'))
+            _ENGINES[url] = engine
+            ENGINE_STATS['engines'] += 1
+    return engine
+
+
+def engine_stats():
+    """返回统计快照，如 {'engines': 1, 'connections': 2, 'checkouts': 37}"""
+    with _LOCK:
+        return dict(ENGINE_STATS)
+
+
+def reset_engine_stats():
+    with _LOCK:
+        for key in ENGINE_STATS:
+            ENGINE_STATS[key] = 0
+
+
+def dispose_engines():
+    """进程结束前关闭所有连接池"""
+    with _LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
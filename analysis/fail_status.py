@@ -1,5 +1,4 @@
 import pandas as pd
-import numpy as np
 import pymysql
 from datetime import datetime, timedelta
 import calendar
@@ -13,6 +12,7 @@ from decimal import Decimal
 from pptx.util import Pt
 import shutil
 import os
+from yield_cube import YieldCube
 
 
 
@@ -39,99 +39,69 @@ def fetch_data_from_db(connection, query):
 
 def process_data_from_db(db_config, month_str):
     """Process data from the database and compute the required metrics."""
-    first_day, last_day = get_first_and_last_day_of_month(month_str)
-    try:
-        # Connect to the database using pymysql
-        connection = pymysql.connect(
-            host=db_config['host'],
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['database'],
-            port=db_config['port'],
-            charset=db_config['charset']
-        )
+    return process_months_from_db(db_config, month_str, month_str)
 
-        # Query to fetch required data
-        query = f"""
-        SELECT 
-            device,
-            oper_old, 
-            SUM(in_qty) AS m_In, 
-            SUM(out_qty) AS m_Out 
-        FROM 
-            cmsalpha.db_yielddetail 
-        WHERE 
-            workdt BETWEEN '{first_day}' AND '{last_day}'
-        GROUP BY 
-            device, oper_old
-        """
-        # Fetch data
-        data = fetch_data_from_db(connection, query)
-
-        # Pivot table for calculations
-        pivot_df = data.pivot_table(index='device', columns='oper_old', values=['m_In', 'm_Out'], aggfunc='sum')
+def process_months_from_db(db_config, start_month, end_month):
+    """
+    Compute the metrics of every month in [start_month, end_month] with one grouped query.
+    :param start_month: str, first month in YYYYMM format.
+    :param end_month: str, last month in YYYYMM format.
+    :return: DataFrame, one row per month with the same columns as process_data_from_db.
+    """
+    first_day = get_first_and_last_day_of_month(start_month)[0]
+    last_day = get_first_and_last_day_of_month(end_month)[1]
+    try:
+        # 从良率立方体一次读取所有月份
+        data = YieldCube(db_config).query(['device', 'oper_old'], first_day, last_day, period='month')
+        data = data.rename(columns={'dt': 'workmt', 'in_qty': 'm_In', 'out_qty': 'm_Out'})
+        if data.empty:
+            return None
+
+        # Pivot table for calculations: 行为 (月份, device)
+        pivot_df = data.pivot_table(index=['workmt', 'device'], columns='oper_old', values=['m_In', 'm_Out'],
+                                    aggfunc='sum')
         pivot_df = pivot_df.fillna(0)
         valid_operators = ['5700', '5710', '5780']
-        for operator in valid_operators:
-            if operator not in pivot_df.columns.get_level_values(1):  # Check if the operator exists in columns
-                pivot_df[('m_In', operator)] = np.nan  # Add missing operator column with NaN values
-                pivot_df[('m_Out', operator)] = np.nan  # Add missing operator column with NaN values
-
-        # Calculate Yield
-        yield_df = pivot_df['m_Out'] / pivot_df['m_In']
-        def calculate_yield(row):
-            valid_values = row[row != 0].dropna()
-            if len(valid_values) > 0:
-                return valid_values.prod()  # Multiply all valid values together
-            else:
-                return np.nan  # If no valid values, return NaN
-
-        # Apply the function to calculate the Yield for each row
-        yield_df['Yield_5700_5710_5780'] = yield_df[valid_operators].apply(calculate_yield, axis=1)
-        input_df = pivot_df['m_In'][['5700', '5710', '5780']].max(axis=1)
-        input_ttl = input_df.sum()
-
-        # Calculate weight
-        weight_df = input_df / input_ttl
-        weight_yield = yield_df['Yield_5700_5710_5780'] * weight_df
-
-        # Calculate AT yield and output
-        AT_Yield = weight_yield.sum()
+        m_in = pivot_df['m_In'].reindex(columns=sorted(set(pivot_df['m_In'].columns) | set(valid_operators)))
+        m_out = pivot_df['m_Out'].reindex(columns=m_in.columns)
+
+        # device 良率: 各工序非0良率之积
+        yield_df = m_out[valid_operators] / m_in[valid_operators]
+        device_yield = yield_df.where(yield_df != 0).prod(axis=1, min_count=1)
+        input_df = m_in[valid_operators].max(axis=1)
+        input_ttl = input_df.groupby(level='workmt').sum()
+
+        # 按月加权计算 AT yield and output
+        weight_df = input_df / input_ttl.reindex(input_df.index.get_level_values('workmt')).values
+        AT_Yield = (device_yield * weight_df).groupby(level='workmt').sum()
         AT_out = input_ttl * AT_Yield
 
         # Calculate ET yield and output
-        ET_in = pivot_df['m_In'].get('5600', pd.Series()).sum()
-        ET_out = pivot_df['m_Out'].get('5600', pd.Series()).sum()
-        ET_yield = ET_out / ET_in if ET_in != 0 else np.nan
+        ET_in = m_in['5600'].groupby(level='workmt').sum() if '5600' in m_in else input_ttl * 0
+        ET_out = m_out['5600'].groupby(level='workmt').sum() if '5600' in m_out else input_ttl * 0
+        ET_yield = (ET_out / ET_in).where(ET_in != 0)
 
         # Adjust yields
         TTL_Yield = 1 - ET_yield * AT_Yield
         ET_yield = 1 - ET_yield
         AT_Yield = 1 - AT_Yield
 
-        # Summarize results
         result = pd.DataFrame({
-            'Month': [month_str],  # Add month_str as a new column
-            'TTL_Yield': [round(TTL_Yield * 100, 2)],
-            'ET_in': [round(ET_in, 0)],
-            'ET_out': [round(ET_out, 0)],
-            'ET_yield': [round(ET_yield * 100, 2)],
-            'AT_in': [round(input_ttl, 0)],
-            'AT_out': [round(AT_out, 0)],
-            'AT_yield': [round(AT_Yield * 100, 2)]
+            'Month': input_ttl.index,
+            'TTL_Yield': (TTL_Yield * 100).round(2).values,
+            'ET_in': ET_in.round(0).values,
+            'ET_out': ET_out.round(0).values,
+            'ET_yield': (ET_yield * 100).round(2).values,
+            'AT_in': input_ttl.round(0).values,
+            'AT_out': AT_out.round(0).values,
+            'AT_yield': (AT_Yield * 100).round(2).values
         })
-
         return result
 
     except Exception as e:
         print(f"Error processing data: {e}")
         return None
 
-    finally:
-        # Close the connection after use
-        if connection:
-            connection.close()
-
 def get_max_month(db_config):
     """Fetch the maximum month from the database."""
     connection = None  # Ensure connection is initialized
@@ -221,6 +191,47 @@ def Insert_data(result_df, db_config):
         if connection:
             connection.close()
 
+def Insert_data_bulk(result_df, db_config):
+    """Upsert all rows of result_df in one executemany and one commit."""
+    connection = None
+    try:
+        # Connect to the database using pymysql
+        connection = pymysql.connect(
+            host=db_config['host'],
+            user=db_config['user'],
+            password=db_config['password'],
+            database=db_config['database'],
+            port=db_config['port'],
+            charset=db_config['charset']
+        )
+        columns = ['TTL_Yield', 'ET_in', 'ET_out', 'ET_yield', 'AT_in', 'AT_out', 'AT_yield']
+        # Replace NaN values with None (for SQL NULL)
+        values = result_df[columns].astype(object).where(result_df[columns].notna(), None)
+        rows = [(str(month).zfill(6), *row) for month, row in zip(result_df['Month'], values.itertuples(index=False))]
+        sql = """
+        INSERT INTO db_fail_status (workmt, ttl_fail, et_in, et_out, et_fail, at_in, at_out, at_fail)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            ttl_fail = VALUES(ttl_fail),
+            et_in = VALUES(et_in),
+            et_out = VALUES(et_out),
+            et_fail = VALUES(et_fail),
+            at_in = VALUES(at_in),
+            at_out = VALUES(at_out),
+            at_fail = VALUES(at_fail);
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+        connection.commit()
+        print(f"{len(rows)} rows inserted or updated successfully.")
+
+    except pymysql.MySQLError as e:
+        print(f"Error inserting or updating data: {e}")
+
+    finally:
+        if connection:
+            connection.close()
+
 def generate_report_data(db_config, current_date):
     """Generate report data from db_fail_status using pymysql."""
     try:
@@ -548,30 +559,24 @@ def main(mode):
     # max_month = '202411'
     # 比较 end_month 和 max_month，并逐月执行
     if end_month > max_month:
-        # 从 max_month 的下一个月份开始
-        current_month = increment_month(int(max_month))
-
-        while current_month <= int(end_month):
-            month_str = str(current_month)
-            # print(month_str)
-            result_df = process_data_from_db(db_config, month_str)
-            if result_df is not None:
-                print(f"Results for {month_str}:")
-                print(result_df)
-                # 将结果写入数据库
-                Insert_data(result_df, db_config)
-
-            # 生成报表数据
-            result = generate_report_data(db_config, current_date)
-            print("Report data:", result)
-            # 写入PPT
-            list_shapes_in_slide(reportDir, 0)
-            write_to_ppt(result, reportDir)
-            # 复制文件到指定位置
-            report_month = datetime.now().strftime('%Y%m')
-            copy_and_save_report(reportDir, target_base_dir, report_month)
-            # 增加月份
-            current_month = increment_month(int(current_month))
+        # 从 max_month 的下一个月份开始, 所有缺失月份一次计算并写入
+        start_month = str(increment_month(int(max_month)))
+        result_df = process_months_from_db(db_config, start_month, end_month)
+        if result_df is not None:
+            print(f"Results for {start_month}-{end_month}:")
+            print(result_df)
+            # 将结果写入数据库
+            Insert_data_bulk(result_df, db_config)
+
+        # 生成报表数据
+        result = generate_report_data(db_config, current_date)
+        print("Report data:", result)
+        # 写入PPT
+        list_shapes_in_slide(reportDir, 0)
+        write_to_ppt(result, reportDir)
+        # 复制文件到指定位置
+        report_month = datetime.now().strftime('%Y%m')
+        copy_and_save_report(reportDir, target_base_dir, report_month)
     else:
         print("No new months to process.")
 
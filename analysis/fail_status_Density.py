@@ -1,5 +1,4 @@
 import pandas as pd
-import numpy as np
 import pymysql
 from datetime import datetime, timedelta
 import calendar
@@ -13,8 +12,13 @@ from decimal import Decimal
 from pptx.util import Pt
 import shutil
 import os
+from yield_cube import YieldCube
 
 
+# 报告中的产品及顺序，位置即PPT中对应图表的chart_index
+REPORT_PRODUCTS = [('SD', '4GB'), ('SD', '8GB'), ('SD', '16GB'),
+                   ('RD', '16GB'), ('RD', '32GB'), ('RD', '64GB')]
+
 
 def get_first_and_last_day_of_month(month_str):
     """
@@ -39,101 +43,60 @@ def fetch_data_from_db(connection, query):
 
 def process_data_from_db(db_config, month_str):
     """Process data from the database and compute the required metrics."""
-    first_day, last_day = get_first_and_last_day_of_month(month_str)
-    try:
-        # Connect to the database using pymysql
-        connection = pymysql.connect(
-            host=db_config['host'],
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['database'],
-            port=db_config['port'],
-            charset=db_config['charset']
-        )
+    return process_months_from_db(db_config, month_str, month_str)
 
-        # Query to fetch required data
-        query = f"""
-        SELECT 
-            dy.modtype,
-            dd.Product_density,
-            dy.oper_old, 
-            SUM(dy.in_qty) AS m_In, 
-            SUM(dy.out_qty) AS m_Out
-        FROM 
-            cmsalpha.db_yielddetail dy
-        JOIN modulemte.db_deviceinfo dd on dy.device = dd.Device
-        WHERE 
-            workdt BETWEEN '{first_day}' AND '{last_day}' AND
-            dy.oper_old in ('5600', '5700', '5710', '5780')
-        GROUP BY 
-            dy.modtype, dd.Product_density, oper_old
-        """
-        # Fetch data
-        data = fetch_data_from_db(connection, query)
-
-        # Pivot table后处理列名
-        pivot_df = data.pivot_table(index=['modtype', 'Product_density'], columns='oper_old', values=['m_In', 'm_Out'],
-                                    aggfunc='sum')
-
-        # 扁平化多级列名
-        pivot_df.columns = [f"{metric}_{oper}" for metric, oper in pivot_df.columns]
-        pivot_df = pivot_df.fillna(0)
-
-        # 计算5600指标（ET测试）
-        pivot_df['IN_5600'] = pivot_df['m_In_5600']
-        pivot_df['OUT_5600'] = pivot_df['m_Out_5600']
-        pivot_df['Fail rate_5600'] = round((1 - (pivot_df['OUT_5600'] / pivot_df['IN_5600'])) * 100, 2)
-        pivot_df.loc[pivot_df['IN_5600'] == 0, 'Fail rate_5600'] = np.nan  # 处理除零情况
-
-        # 计算5710-5700-5780指标（AT测试）
-        pivot_df['IN_5710_5700_5780'] = pivot_df['m_In_5700'] + pivot_df['m_In_5710'] + pivot_df['m_In_5780']
-        pivot_df['OUT_5710_5700_5780'] = pivot_df['m_Out_5700'] + pivot_df['m_Out_5710'] + pivot_df['m_Out_5780']
-        pivot_df['Fail rate_5710_5700_5780'] = round((1 - (pivot_df['OUT_5710_5700_5780'] /
-                                                           pivot_df['IN_5710_5700_5780'])) * 100, 2)
-        pivot_df.loc[pivot_df['IN_5710_5700_5780'] == 0, 'Fail rate_5710_5700_5780'] = np.nan
-
-        # Summarize results
-        result = pivot_df[[
-            'IN_5600', 'OUT_5600', 'Fail rate_5600',
-            'IN_5710_5700_5780', 'OUT_5710_5700_5780', 'Fail rate_5710_5700_5780'
-        ]].reset_index()
-
-        # 添加workmt字段并重命名列
-        result['workmt'] = month_str  # 新增月份字段
-        result = result.rename(columns={
-            'Product_density': 'density',
-            'IN_5600': 'et_in',
-            'OUT_5600': 'et_out',
-            'Fail rate_5600': 'et_fail',
-            'IN_5710_5700_5780': 'at_in',
-            'OUT_5710_5700_5780': 'at_out',
-            'Fail rate_5710_5700_5780': 'at_fail'
-        })
-
-        # 计算总不良率（ET和AT不良率的乘积）
+def process_months_from_db(db_config, start_month, end_month):
+    """
+    Compute the density metrics of every month in [start_month, end_month] with one grouped query.
+    :param start_month: str, first month in YYYYMM format.
+    :param end_month: str, last month in YYYYMM format.
+    :return: DataFrame, same columns as process_data_from_db, one row per month/modtype/density.
+    """
+    first_day = get_first_and_last_day_of_month(start_month)[0]
+    last_day = get_first_and_last_day_of_month(end_month)[1]
+    try:
+        # 从良率立方体一次读取所有月份
+        data = YieldCube(db_config).query(['modtype', 'Product_density', 'oper_old'], first_day, last_day,
+                                          conditions=[('oper_old', 'IN', ['5600', '5700', '5710', '5780'])],
+                                          period='month')
+        data = data.rename(columns={'dt': 'workmt', 'in_qty': 'm_In', 'out_qty': 'm_Out'})
+        if data.empty:
+            return None
+
+        # 一次透视, 缺失工序补0
+        pivot_df = data.pivot_table(index=['workmt', 'modtype', 'Product_density'], columns='oper_old',
+                                    values=['m_In', 'm_Out'], aggfunc='sum')
+        opers = ['5600', '5700', '5710', '5780']
+        m_in = pivot_df['m_In'].reindex(columns=opers).fillna(0)
+        m_out = pivot_df['m_Out'].reindex(columns=opers).fillna(0)
+
+        result = pd.DataFrame(index=pivot_df.index)
+        # 5600指标（ET测试）
+        result['et_in'] = m_in['5600']
+        result['et_out'] = m_out['5600']
+        result['et_fail'] = (1 - result['et_out'] / result['et_in']).mul(100).round(2).where(result['et_in'] != 0)
+        # 5710-5700-5780指标（AT测试）
+        result['at_in'] = m_in[['5700', '5710', '5780']].sum(axis=1)
+        result['at_out'] = m_out[['5700', '5710', '5780']].sum(axis=1)
+        result['at_fail'] = (1 - result['at_out'] / result['at_in']).mul(100).round(2).where(result['at_in'] != 0)
+
+        result = result.reset_index().rename(columns={'Product_density': 'density'})
         result[['et_in', 'et_out', 'at_in', 'at_out', 'et_fail', 'at_fail']] = (
             result[['et_in', 'et_out', 'at_in', 'at_out', 'et_fail', 'at_fail']].fillna(0))
-        result['ttl_fail'] = (1 - (1 - result['et_fail']) * (1 - result['at_fail']))
-        result['ttl_fail'] = result['ttl_fail'].round(2)
+        result['ttl_fail'] = (1 - (1 - result['et_fail']) * (1 - result['at_fail'])).round(2)
 
         # 选择最终输出列
-        result = result[[
+        return result[[
             'workmt', 'modtype', 'density',
             'ttl_fail',
             'et_in', 'et_out', 'et_fail',
             'at_in', 'at_out', 'at_fail'
         ]]
-        return result
 
     except Exception as e:
         print(f"Error processing data: {e}")
         return None
 
-    finally:
-        # Close the connection after use
-        if connection:
-            connection.close()
-
 def get_max_month(db_config):
     """Fetch the maximum month from the database."""
     connection = None  # Ensure connection is initialized
@@ -225,6 +188,48 @@ def Insert_data(result_df, db_config):
         if connection:
             connection.close()
 
+def Insert_data_bulk(result_df, db_config):
+    """Upsert all rows of result_df in one executemany and one commit."""
+    connection = None
+    try:
+        # Connect to the database using pymysql
+        connection = pymysql.connect(
+            host=db_config['host'],
+            user=db_config['user'],
+            password=db_config['password'],
+            database=db_config['database'],
+            port=db_config['port'],
+            charset=db_config['charset']
+        )
+        columns = ['modtype', 'density', 'ttl_fail', 'et_in', 'et_out', 'et_fail', 'at_in', 'at_out', 'at_fail']
+        # Replace NaN values with None (for SQL NULL)
+        values = result_df[columns].astype(object).where(result_df[columns].notna(), None)
+        rows = [(str(workmt).zfill(6), *row)
+                for workmt, row in zip(result_df['workmt'], values.itertuples(index=False))]
+        sql = """
+        INSERT INTO db_fail_status_density (workmt, modtype, modDensity, ttl_fail, et_in, et_out, et_fail, at_in, at_out, at_fail)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            ttl_fail = VALUES(ttl_fail),
+            et_in = VALUES(et_in),
+            et_out = VALUES(et_out),
+            et_fail = VALUES(et_fail),
+            at_in = VALUES(at_in),
+            at_out = VALUES(at_out),
+            at_fail = VALUES(at_fail);
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+        connection.commit()
+        print(f"{len(rows)} rows inserted or updated successfully.")
+
+    except pymysql.MySQLError as e:
+        print(f"Error inserting or updating data: {e}")
+
+    finally:
+        if connection:
+            connection.close()
+
 def generate_report_failStatus(db_config, current_date, product):
     """Generate report data from db_fail_status using pymysql."""
     try:
@@ -609,7 +614,22 @@ def update_chart_in_ppt(ppt_file, result, chart_slide_index, chart_index):
     """
     # Load the presentation
     prs = Presentation(ppt_file)
+    apply_chart_update(prs, result, chart_slide_index, chart_index)
 
+    # Save the updated presentation
+    updated_file = ppt_file
+    prs.save(updated_file)
+    print(f"Updated chart data saved to {updated_file}")
+
+
+def apply_chart_update(prs, result, chart_slide_index, chart_index):
+    """
+    Replace chart data of an already opened presentation in memory.
+    :param prs: Presentation, the opened presentation.
+    :param result: pandas DataFrame, result data for the chart.
+    :param chart_slide_index: int, index of the slide containing the chart.
+    :param chart_index: int, index of the chart within the slide.
+    """
     # Access the slide containing the chart
     slide = prs.slides[chart_slide_index]
 
@@ -647,11 +667,6 @@ def update_chart_in_ppt(ppt_file, result, chart_slide_index, chart_index):
     # Replace the existing data with the new chart_data
     chart.replace_data(chart_data)
 
-    # Save the updated presentation
-    updated_file = ppt_file
-    prs.save(updated_file)
-    print(f"Updated chart data saved to {updated_file}")
-
 
 def update_table_in_ppt(ppt_file, data, table_slide_index=0, table_index=2):
     """
@@ -664,7 +679,20 @@ def update_table_in_ppt(ppt_file, data, table_slide_index=0, table_index=2):
     """
     # Load the presentation
     prs = Presentation(ppt_file)
+    apply_table_update(prs, data, table_slide_index, table_index)
+
+    prs.save(ppt_file)
+    print(f"Updated table saved to {ppt_file}")
 
+
+def apply_table_update(prs, data, table_slide_index=0, table_index=2):
+    """
+    Update table data of an already opened presentation in memory (transposed format).
+    :param prs: Presentation, the opened presentation.
+    :param data: pandas DataFrame, report data to be written into the table.
+    :param table_slide_index: int, index of the slide containing the table.
+    :param table_index: int, index of the table within the slide.
+    """
     # Access the slide containing the table
     slide = prs.slides[table_slide_index]
 
@@ -743,17 +771,12 @@ def update_table_in_ppt(ppt_file, data, table_slide_index=0, table_index=2):
             except IndexError:
                 print(f"表格尺寸不足，需要至少 {row_idx + 1} 行 {col_idx + 1} 列")
 
-    prs.save(ppt_file)
-    print(f"Updated table saved to {ppt_file}")
-
 def write_to_ppt(result, reportDir, product, sheet):
     if result is None:
         print("No report data available to write to PPT.")
         return
     # 根据product在products列表中的位置确定chart_index
-    products = [('SD', '4GB'), ('SD', '8GB'), ('SD', '16GB'),
-                ('RD', '16GB'), ('RD', '32GB'), ('RD', '64GB')]
-    chart_index = products.index(product)
+    chart_index = REPORT_PRODUCTS.index(product)
     # Update table in slide 0, table index 0
     # update_table_in_ppt(reportDir, filtered_data, table_slide_index=sheet, table_index=2)
 
@@ -761,6 +784,39 @@ def write_to_ppt(result, reportDir, product, sheet):
     update_chart_in_ppt(reportDir, result, chart_slide_index=sheet, chart_index=chart_index)
 
 
+class PPT_Report_Builder():
+    """
+    Open the report deck once, apply all chart/table updates in memory,
+    then save and copy the file a single time.
+    """
+    products = REPORT_PRODUCTS
+
+    def __init__(self, ppt_file):
+        self.ppt_file = ppt_file
+        self.prs = Presentation(ppt_file)
+
+    def add_product(self, result, product, sheet):
+        """Same as write_to_ppt, but without reloading/saving the deck."""
+        if result is None:
+            print("No report data available to write to PPT.")
+            return
+        apply_chart_update(self.prs, result, chart_slide_index=sheet, chart_index=self.products.index(product))
+
+    def add_table(self, data, table_slide_index=0, table_index=2):
+        apply_table_update(self.prs, data, table_slide_index, table_index)
+
+    def save(self, target_dir=None, report_month=None):
+        """
+        Save the deck once and optionally copy it to target_dir/report_month.
+        :param target_dir: str, base directory of the report archive.
+        :param report_month: str, YYYYMM folder name.
+        """
+        self.prs.save(self.ppt_file)
+        print(f"Updated report saved to {self.ppt_file}")
+        if target_dir is not None:
+            copy_and_save_report(self.ppt_file, target_dir, report_month)
+
+
 def list_shapes_in_slide(ppt_file, slide_index):
     """List all shapes and their types in a slide."""
     prs = Presentation(ppt_file)
@@ -802,8 +858,6 @@ def main(mode):
     pptSVType = ['RD']
     pcDensity = ['4GB', '8GB', '16GB']
     svDensity = ['16GB', '32GB', '64GB']
-    products = [('SD','4GB'), ('SD','8GB'),('SD','16GB'),
-               ('RD','16GB'), ('RD','32GB'),('RD','64GB')]
     # 确定数据库配置
     if mode == 'test':
         db_config = {
@@ -847,36 +901,32 @@ def main(mode):
 
     # 比较 end_month 和 max_month，并逐月执行
     if end_month > max_month:
-        # 从 max_month 的下一个月份开始
-        current_month = increment_month(int(max_month))
-        # 计算db_fail_status_density中需要的数值所有产品各个月份的结果
-        while current_month <= int(end_month):
-            month_str = str(current_month)
-            result_df = process_data_from_db(db_config, month_str)
-            if result_df is not None:
-                print(f"Results for {month_str}:")
-                print(result_df)
-                # 将结果写入数据库
-                Insert_data(result_df, db_config)
-            current_month = increment_month(int(current_month))
-
+        # 从 max_month 的下一个月份开始, 所有缺失月份一次计算并写入db_fail_status_density
+        start_month = str(increment_month(int(max_month)))
+        result_df = process_months_from_db(db_config, start_month, end_month)
+        if result_df is not None:
+            print(f"Results for {start_month}-{end_month}:")
+            print(result_df)
+            # 将结果写入数据库
+            Insert_data_bulk(result_df, db_config)
 
     else:
         print("No new months to process.")
-    for product in products:
+    # 报告只打开一次, 所有产品的图表在内存中更新后统一保存、复制
+    builder = PPT_Report_Builder(reportDir)
+    for product in PPT_Report_Builder.products:
         print(product)
         # 生成报表数据
         result = generate_report_failStatus(db_config, current_date, product)
         result = generate_target_year(db_config, result, product)
         print("Report data:", result)
-        write_to_ppt(result, reportDir, product, 1)
+        builder.add_product(result, product, 1)
         print("Write Complete")
-        # # 写入PPT
-        # list_shapes_in_slide(reportDir, 0)
-        # # 复制文件到指定位置
-        report_month = datetime.now().strftime('%Y%m')
-        copy_and_save_report(reportDir, target_base_dir, report_month)
-        # 增加月份
+    # # 写入PPT
+    # list_shapes_in_slide(reportDir, 0)
+    # 复制文件到指定位置
+    report_month = datetime.now().strftime('%Y%m')
+    builder.save(target_base_dir, report_month)
 
 
 # Main function to execute processing
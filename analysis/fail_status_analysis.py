@@ -1,12 +1,14 @@
 from datetime import datetime, timedelta
 import dateutil.relativedelta
 import pandas as pd
-from sqlalchemy import create_engine, text
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 import numpy as np
 from scipy import stats
+from concurrent.futures import ThreadPoolExecutor
+from yield_cube import YieldCube
+from db_engine import engine_stats, reset_engine_stats
 
 
 # 配置日志记录器
@@ -55,6 +57,35 @@ def setup_logger(
     return logger
 
 
+class LogBuffer(logging.Handler):
+    """缓存日志记录，并发执行结束后按顺序回放到主日志器，避免各工序日志交错"""
+
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def replay(self, logger):
+        for record in self.records:
+            logger.handle(record)
+        self.records = []
+
+
+def setup_oper_logger(parent_logger, oper):
+    """
+    为单个工序创建独立日志器（ProductionAnalysis.<oper>），日志先写入缓存
+    :return: (logger, LogBuffer)
+    """
+    logger = logging.getLogger(f"{parent_logger.name}.{oper}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    buffer = LogBuffer()
+    logger.handlers = [buffer]
+    return logger, buffer
+
+
 # 产品类：包括产品基本属性及状态
 class Product:
     """产品类，封装产品属性及所有相关分析方法"""
@@ -94,54 +125,19 @@ class Product:
         self.logger.info(f"\n===== 开始分析 {self} 的占比趋势 =====")
         try:
             # 1. 查询工序每月总投入量
-            total_in_query = text("""
-                select substring(workdt, 1, 6) as dt, sum(in_qty) as total_in_qty 
-                from cmsalpha.db_yielddetail 
-                where oper_old = :oper and workdt between :start and :end 
-                group by dt order by dt asc;
-            """)
-            conn_str = self._get_conn_str()
-            with create_engine(conn_str).connect() as conn:
-                total_in_df = pd.read_sql(
-                    total_in_query.bindparams(oper=oper, start=dt_semiYear, end=yesterday),
-                    conn
-                )
+            cube = self._cube()
+            total_in_df = cube.query([], dt_semiYear, yesterday,
+                                     conditions=[('oper_old', '=', oper)], period='month')
+            total_in_df = total_in_df.rename(columns={'in_qty': 'total_in_qty'})[['dt', 'total_in_qty']]
 
             if total_in_df.empty:
                 self.logger.warning(f"工序 {oper} 无总产量数据，无法计算占比")
                 return None
 
             # 2. 查询当前产品的每月投入量
-            product_in_query = text("""
-                select substring(workdt, 1, 6) as dt, sum(in_qty) as product_in_qty 
-                from cmsalpha.db_yielddetail dy
-                join modulemte.db_deviceinfo dd on dy.device = dd.Device
-                where dy.oper_old = :oper 
-                    and dy.workdt between :start and :end 
-                    and dd.Product_Mode = :pm 
-                    and dd.Tech_Name = :tn 
-                    and dd.Die_Density = :dd 
-                    and dd.Product_Density = :pd 
-                    and dd.Module_Type = :mt 
-                    and dy.grade = :g 
-                group by dt order by dt asc;
-            """)
-
-            with create_engine(conn_str).connect() as conn:
-                product_in_df = pd.read_sql(
-                    product_in_query.bindparams(
-                        oper=oper,
-                        start=dt_semiYear,
-                        end=yesterday,
-                        pm=self.product_mode,
-                        tn=self.tech_name,
-                        dd=self.die_density,
-                        pd=self.product_density,
-                        mt=self.module_type,
-                        g=self.grade
-                    ),
-                    conn
-                )
+            product_in_df = cube.query([], dt_semiYear, yesterday,
+                                       conditions=self._conditions(oper), period='month')
+            product_in_df = product_in_df.rename(columns={'in_qty': 'product_in_qty'})[['dt', 'product_in_qty']]
 
             # 3. 计算占比及趋势
             merge_df = pd.merge(total_in_df, product_in_df, on='dt', how='left').fillna(0)
@@ -191,37 +187,9 @@ class Product:
         self.logger.info(f"\n===== 开始分析 {self} 的不良率趋势 =====")
         try:
             # 1. 查询产品半年度数据
-            query = text("""
-                select substring(workdt, 1, 6) as dt, sum(in_qty) as sum_in, sum(out_qty) as sum_out
-                from cmsalpha.db_yielddetail dy
-                join modulemte.db_deviceinfo dd on dy.device = dd.Device
-                where dy.oper_old = :oper 
-                    and dy.workdt between :start_dt and :end_dt 
-                    and dd.Product_Mode = :pm 
-                    and dd.Tech_Name = :tn 
-                    and dd.Die_Density = :dd 
-                    and dd.Product_Density = :pd 
-                    and dd.Module_Type = :mt 
-                    and dy.grade = :g 
-                group by dt order by dt asc;
-            """)
-
-            conn_str = self._get_conn_str()
-            with create_engine(conn_str).connect() as conn:
-                monthly_df = pd.read_sql(
-                    query.bindparams(
-                        oper=oper,
-                        start_dt=dt_semiYear,
-                        end_dt=yesterday,
-                        pm=self.product_mode,
-                        tn=self.tech_name,
-                        dd=self.die_density,
-                        pd=self.product_density,
-                        mt=self.module_type,
-                        g=self.grade
-                    ),
-                    conn
-                )
+            monthly_df = self._cube().query([], dt_semiYear, yesterday,
+                                            conditions=self._conditions(oper), period='month')
+            monthly_df = monthly_df.rename(columns={'in_qty': 'sum_in', 'out_qty': 'sum_out'})
 
             if monthly_df.empty:
                 self.logger.warning(f"{self} 无半年度数据")
@@ -290,45 +258,17 @@ class Product:
         """
         self.logger.info(f"\n===== 开始分析 {self} 在工序 {oper} 于 {workdt} 的设备差异 =====")
         try:
-            # 1. 构建参数化SQL查询（与analyze_fail_rate保持一致的风格）
-            query = text("""
-                select 
-                    dy.main_equip_id as 设备名,
-                    sum(dy.in_qty) as 总投入,
-                    sum(dy.in_qty) - sum(dy.out_qty) as 不良数,
-                    sum(dy.out_qty) as 合格数
-                from cmsalpha.db_yielddetail dy 
-                join modulemte.db_deviceinfo dd on dy.device = dd.Device 
-                where 
-                    dy.oper_old = :oper 
-                    and dy.workdt = :workdt 
-                    and dd.Product_Mode = :pm 
-                    and dd.Tech_Name = :tn 
-                    and dd.Die_Density = :dd 
-                    and dd.Product_Density = :pd 
-                    and dd.Module_Type = :mt 
-                    and dy.grade = :g 
-                group by dy.main_equip_id
-                having sum(dy.in_qty) > 0  # 排除无投入的设备
-                order by 设备名 asc;
-            """)
-
-            # 2. 复用数据库连接逻辑（与现有方法一致）
-            conn_str = self._get_conn_str()
-            with create_engine(conn_str).connect() as conn:
-                equip_df = pd.read_sql(
-                    query.bindparams(
-                        oper=oper,
-                        workdt=workdt,
-                        pm=self.product_mode,
-                        tn=self.tech_name,
-                        dd=self.die_density,
-                        pd=self.product_density,
-                        mt=self.module_type,
-                        g=self.grade
-                    ),
-                    conn
-                )
+            # 1. 从良率立方体查询设备别投入/产出
+            equip_df = self._cube().query(['main_equip_id'], workdt, workdt, conditions=self._conditions(oper))
+
+            # 2. 排除无投入的设备，整理为原有列格式
+            equip_df = equip_df[equip_df['in_qty'] > 0]
+            equip_df = pd.DataFrame({
+                '设备名': equip_df['main_equip_id'],
+                '总投入': equip_df['in_qty'],
+                '不良数': equip_df['in_qty'] - equip_df['out_qty'],
+                '合格数': equip_df['out_qty']
+            }).sort_values('设备名').reset_index(drop=True)
 
             # 3. 数据校验（与现有方法的空数据处理逻辑一致）
             if equip_df.empty:
@@ -386,40 +326,279 @@ class Product:
             self.logger.error(f"{self} 设备差异分析出错: {str(e)}", exc_info=True)
             return None
 
-    # 辅助方法：生成数据库连接字符串
+    # 辅助方法：良率立方体及产品筛选条件
     # ------------------------------
-    def _get_conn_str(self):
-        """封装连接字符串生成逻辑，避免重复代码"""
-        return (
-            f"mysql+pymysql://{self.db_config['user']}:{self.db_config['password']}@"
-            f"{self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}?"
-            f"charset={self.db_config['charset']}"
-        )
+    def _cube(self):
+        """封装立方体创建逻辑，避免重复代码"""
+        return YieldCube(self.db_config, self.logger)
+
+    def _conditions(self, oper):
+        """当前产品在指定工序的筛选条件"""
+        return [
+            ('oper_old', '=', oper),
+            ('Product_Mode', '=', self.product_mode),
+            ('Tech_Name', '=', self.tech_name),
+            ('Die_Density', '=', self.die_density),
+            ('Product_Density', '=', self.product_density),
+            ('Module_Type', '=', self.module_type),
+            ('grade', '=', self.grade),
+        ]
+
+
+# 产品属性（主要不良产品的识别维度）
+PRODUCT_ATTRS = ['Product_Mode', 'Tech_Name', 'Die_Density', 'Product_Density', 'Module_Type', 'grade']
+
+
+def _masked_linregress(y, valid):
+    """
+    按行对有效点做一元线性回归（x为各行有效点的序号1..n），等价于逐行stats.linregress
+    :return: (slope, intercept, r_value, p_value, n)，均为按行数组
+    """
+    valid = valid & ~np.isnan(y)
+    n = valid.sum(axis=1)
+    x = np.where(valid, np.cumsum(valid, axis=1), 0).astype(float)
+    y = np.where(valid, y, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = x.sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dx = np.where(valid, x - x_mean[:, None], 0.0)
+        dy = np.where(valid, y - y_mean[:, None], 0.0)
+        sxx = (dx ** 2).sum(axis=1)
+        syy = (dy ** 2).sum(axis=1)
+        sxy = (dx * dy).sum(axis=1)
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        r_value = np.where((sxx == 0) | (syy == 0), 0.0, sxy / np.sqrt(sxx * syy))
+        r_value = np.clip(r_value, -1.0, 1.0)
+        dof = n - 2
+        t_value = r_value * np.sqrt(dof / ((1.0 - r_value) * (1.0 + r_value) + 1e-20))
+        p_value = 2 * stats.t.sf(np.abs(t_value), np.maximum(dof, 1))
+    return slope, intercept, r_value, p_value, n
+
+
+class ProductBatch:
+    """批量产品分析：同一工序的所有主要不良产品共用分组查询，趋势及设备差异按产品向量化计算"""
+
+    def __init__(self, vital_df, db_config, logger):
+        # 1. 产品列表（与Product.product_id格式一致）
+        self.products = vital_df[PRODUCT_ATTRS].drop_duplicates().reset_index(drop=True)
+        self.products['product_id'] = self.products[PRODUCT_ATTRS].apply(
+            lambda row: " ".join(f"{value}" for value in row), axis=1)
+
+        # 2. 外部依赖（数据库配置、日志器）
+        self.db_config = db_config
+        self.logger = logger
+
+        # 3. 分析结果存储（DataFrame，每个产品一行）
+        self.proportion_result = None
+        self.failrate_result = None
+        self.equip_diff_result = None
+        self._monthly = {}  # (oper, start, end) -> 产品月别数据
+
+    def __str__(self):
+        return f"ProductBatch[{len(self.products)} products]"
+
+    def _cube(self):
+        return YieldCube(self.db_config, self.logger)
+
+    def _product_data(self, dims, start, end, oper, period=None):
+        """一次查询所有产品，只保留本批次产品"""
+        df = self._cube().query(PRODUCT_ATTRS + dims, start, end, conditions=[('oper_old', '=', oper)],
+                                period=period, device_info=True)
+        return self.products.merge(df, on=PRODUCT_ATTRS, how='inner')
+
+    def _product_monthly(self, oper, start, end):
+        key = (oper, start, end)
+        if key not in self._monthly:
+            self._monthly[key] = self._product_data([], start, end, oper, period='month')
+        return self._monthly[key]
+
+    def _pivot(self, df, value, columns=None):
+        """(产品 × 月份) 矩阵，行顺序与self.products一致"""
+        pivot = df.pivot_table(index='product_id', columns='dt', values=value, aggfunc='sum')
+        return pivot.reindex(index=self.products['product_id'], columns=columns)
+
+    # ------------------------------
+    # 批量占比趋势分析
+    # ------------------------------
+    def analyze_proportion(self, oper, dt_semiYear, yesterday, trend_threshold=0.01):
+        """所有产品的每月占比趋势（同Product.analyze_proportion）"""
+        self.logger.info(f"\n===== 开始批量分析 {self} 的占比趋势 =====")
+        try:
+            total_in_df = self._cube().query([], dt_semiYear, yesterday,
+                                             conditions=[('oper_old', '=', oper)], period='month')
+            if total_in_df.empty:
+                self.logger.warning(f"工序 {oper} 无总产量数据，无法计算占比")
+                return None
+
+            months = total_in_df['dt'].tolist()
+            total_in = total_in_df['in_qty'].values
+            product_in = self._pivot(self._product_monthly(oper, dt_semiYear, yesterday),
+                                     'in_qty', months).fillna(0).values
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.where(total_in > 0, product_in / total_in * 100, 0)
+
+            # 趋势判断（月份数对所有产品相同）
+            result = self.products[['product_id']].copy()
+            if len(months) >= 2:
+                slope = _masked_linregress(ratio, np.ones(ratio.shape, dtype=bool))[0]
+                result['slope'] = slope
+                result['trend'] = np.select([slope > trend_threshold, slope < -trend_threshold],
+                                            ["逐渐增加", "逐渐降低"], "稳定")
+            else:
+                result['slope'] = None
+                result['trend'] = "数据不足（<2个月）"
+            result['monthly_ratio'] = [dict(zip(months, row)) for row in ratio]
+            self.proportion_result = result
+
+            for row in result.itertuples(index=False):
+                self.logger.info(f"Product[{row.product_id}] 占比趋势：{row.trend}")
+            return self.proportion_result
+
+        except Exception as e:
+            self.logger.error(f"{self} 占比分析出错: {str(e)}", exc_info=True)
+            return None
+
+    # ------------------------------
+    # 批量不良率趋势分析
+    # ------------------------------
+    def analyze_fail_rate(self, oper, dt_semiYear, yesterday,
+                          stability_threshold=0.5, significance_level=0.05):
+        """所有产品的半年度不良率趋势（同Product.analyze_fail_rate）"""
+        self.logger.info(f"\n===== 开始批量分析 {self} 的不良率趋势 =====")
+        try:
+            monthly_df = self._product_monthly(oper, dt_semiYear, yesterday)
+            if monthly_df.empty:
+                self.logger.warning(f"{self} 无半年度数据")
+                return None
+
+            months = sorted(monthly_df['dt'].unique())
+            sum_in = self._pivot(monthly_df, 'in_qty', months).values
+            sum_out = self._pivot(monthly_df, 'out_qty', months).values
+            valid = ~np.isnan(sum_in)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fail_rate = np.where(sum_in > 0, (1 - sum_out / sum_in) * 100, 0)
+            fail_rate = np.where(valid, fail_rate, np.nan)
+            slope, intercept, r_value, p_value, n = _masked_linregress(fail_rate, valid)
+
+            # 趋势判断（有效月份<3的产品数据不足）
+            enough = n >= 3
+            significant = p_value < significance_level
+            trend = np.select(
+                [~enough, significant & (slope > stability_threshold),
+                 significant & (slope < -stability_threshold), significant],
+                ["数据不足（<3个月）", "恶化", "改善", "稳定"], "稳定（趋势不显著）")
+
+            # 考核指标
+            first_idx = np.argmax(valid, axis=1)
+            last_idx = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+            rows = np.arange(len(fail_rate))
+            first = fail_rate[rows, first_idx]
+            last = fail_rate[rows, last_idx]
+            filled = np.where(valid, fail_rate, -np.inf)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_fail = np.nanmean(np.where(valid, fail_rate, np.nan), axis=1)
+                change = np.where(first != 0, (last - first) / first * 100, np.nan)
+
+            result = self.products[['product_id']].copy()
+            result['trend'] = trend
+            result['months'] = n
+            result['avg_fail'] = np.where(enough, np.round(mean_fail, 4), np.nan)
+            result['max_fail'] = np.where(enough, np.round(filled.max(axis=1), 4), np.nan)
+            result['max_month'] = np.where(enough, np.array(months, dtype=object)[filled.argmax(axis=1)], None)
+            result['slope'] = np.where(enough, np.round(slope, 4), np.nan)
+            result['p_value'] = np.where(enough, p_value, np.nan)
+            result['change'] = np.where(enough, np.round(change, 2), np.nan)
+            result['conclusion'] = [
+                f"Product[{pid}] 不良率趋势：{t}" + (f"，平均不良率 {avg}%" if ok else "")
+                for pid, t, avg, ok in zip(result['product_id'], trend, result['avg_fail'], enough)
+            ]
+            self.failrate_result = result
+
+            for conclusion in result['conclusion']:
+                self.logger.info(conclusion)
+            return self.failrate_result
+
+        except Exception as e:
+            self.logger.error(f"{self} 不良率分析出错: {str(e)}", exc_info=True)
+            return None
+
+    # ------------------------------
+    # 批量设备差异分析
+    # ------------------------------
+    def analyze_equip_diff(self, workdt, oper, alpha=0.05):
+        """所有产品在特定工序的设备间不良率卡方检验（同Product.analyze_equip_diff）"""
+        self.logger.info(f"\n===== 开始批量分析 {self} 在工序 {oper} 于 {workdt} 的设备差异 =====")
+        try:
+            equip_df = self._product_data(['main_equip_id'], workdt, workdt, oper)
+            equip_df = equip_df[equip_df['in_qty'] > 0].copy()
+            if equip_df.empty:
+                self.logger.warning(f"{self} 在工序 {oper} 于 {workdt} 无设备生产数据")
+                return None
+
+            # 卡方检验：各产品的 (设备 × [不良, 合格]) 列联表
+            equip_df['fail_qty'] = equip_df['in_qty'] - equip_df['out_qty']
+            equip_df['fail_rate'] = (equip_df['fail_qty'] / equip_df['in_qty'] * 100).round(4)
+            group = equip_df.groupby('product_id')
+            total = group['in_qty'].transform('sum')
+            dof = group['in_qty'].transform('size') - 1
+            chi2_terms = 0
+            for observed, column_total in [(equip_df['fail_qty'], group['fail_qty'].transform('sum')),
+                                           (equip_df['out_qty'], group['out_qty'].transform('sum'))]:
+                expected = equip_df['in_qty'] * column_total / total
+                diff = (observed - expected).abs()
+                # 自由度为1时使用Yates连续性校正（与chi2_contingency一致）
+                diff = np.where(dof == 1, np.maximum(diff - 0.5, 0), diff)
+                chi2_terms = chi2_terms + np.where(expected > 0, diff ** 2 / expected, np.nan)
+            equip_df['chi2_term'] = chi2_terms
+
+            summary = equip_df.groupby('product_id').agg(
+                equip_count=('main_equip_id', 'size'),
+                chi2=('chi2_term', lambda x: x.sum(min_count=len(x))),
+            )
+            summary['dof'] = summary['equip_count'] - 1
+            summary['p_value'] = stats.chi2.sf(summary['chi2'], summary['dof'].clip(lower=1))
+            summary['significant'] = summary['p_value'] < alpha
+            worst = equip_df.loc[equip_df.groupby('product_id')['fail_rate'].idxmax(),
+                                 ['product_id', 'main_equip_id', 'fail_rate']].set_index('product_id')
+            summary = summary.join(worst.rename(columns={'main_equip_id': 'worst_equip',
+                                                         'fail_rate': 'worst_fail_rate'}))
+            result = self.products[['product_id']].merge(summary.reset_index(), on='product_id', how='left')
+
+            conclusions = []
+            for row in result.itertuples(index=False):
+                if pd.isna(row.equip_count) or row.equip_count < 2:
+                    conclusion = f"Product[{row.product_id}] 设备数量不足，无法进行差异分析"
+                elif pd.isna(row.chi2):
+                    conclusion = f"Product[{row.product_id}] 期望频数存在0，无法进行卡方检验"
+                elif row.significant:
+                    conclusion = (f"Product[{row.product_id}] 在工序 {oper} 的设备间不良率存在显著差异"
+                                  f"（卡方值={row.chi2:.4f}，p值={row.p_value:.4f}，自由度={int(row.dof)}），"
+                                  f"表现最差设备为 {row.worst_equip}（不良率 {row.worst_fail_rate}%）")
+                else:
+                    conclusion = (f"Product[{row.product_id}] 在工序 {oper} 的设备间不良率无显著差异"
+                                  f"（卡方值={row.chi2:.4f}，p值={row.p_value:.4f}，自由度={int(row.dof)}）")
+                conclusions.append(conclusion)
+                self.logger.info(conclusion)
+            result['conclusion'] = conclusions
+            self.equip_diff_result = result
+            return self.equip_diff_result
+
+        except Exception as e:
+            self.logger.error(f"{self} 设备差异分析出错: {str(e)}", exc_info=True)
+            return None
 
 
 # 获取Daily Fail Status
 def get_fail_ttl(db_config, workdt, operList, logger):
-    # 从db_failstatus中获取fail status指标
-    query = text("""
-            select oper_old, 
-                   (1 - sum(out_qty) / sum(in_qty)) * 100 as fail 
-            from cmsalpha.db_yielddetail dy 
-            where workdt = :work_date and oper_old in :operList
-            group by oper_old;
-        """)
+    # 从良率立方体中获取fail status指标
     try:
         logger.info(f"开始查询日期为 {workdt} 的Fail Status")
 
-        # 构建数据库连接字符串
-        conn_str = (
-            f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
-            f"{db_config['host']}:{db_config['port']}/{db_config['database']}?"
-            f"charset={db_config['charset']}"
-        )
-
-        with create_engine(conn_str).connect() as conn:
-            # 执行参数化查询，传入workdt参数
-            df = pd.read_sql(query.bindparams(work_date=workdt, operList=tuple(operList)), conn)
+        df = YieldCube(db_config, logger).query(['oper_old'], workdt, workdt,
+                                                conditions=[('oper_old', 'IN', list(operList))])
+        df['fail'] = ((1 - df['out_qty'] / df['in_qty']) * 100).where(df['in_qty'] != 0)
+        df = df[['oper_old', 'fail']]
 
         logger.info(f"查询成功，返回 {len(df)} 条记录")
         # 记录数据详情（可以根据需要调整日志级别或是否记录）
@@ -449,23 +628,6 @@ def get_fail_oper(db_config, oper, dt_semiYear, yesterday, logger):
     返回:
         DataFrame: 包含月份(dt)和Fail Status(fail)的数据
     """
-    # 完全参数化的SQL查询，所有变量均使用占位符
-    query = text("""
-        select 
-            substring(workdt, 1, 6) as dt,  -- 提取年月部分(如202502)
-            sum(in_qty) as in_qty,
-            (1 - sum(out_qty) / sum(in_qty)) * 100 as fail 
-        from 
-            cmsalpha.db_yielddetail dy 
-        where 
-            workdt between :start_date and :end_date  -- 日期范围参数
-            and oper_old = :operation  -- 工程代码参数
-        group by 
-            dt 
-        order by 
-            dt asc;
-    """)
-
     try:
         # 验证输入参数格式
         if not all([
@@ -478,23 +640,11 @@ def get_fail_oper(db_config, oper, dt_semiYear, yesterday, logger):
 
         logger.info(f"执行参数化查询 - 工程: {oper}, 日期范围: {dt_semiYear} 至 {yesterday}")
 
-        # 构建数据库连接字符串
-        conn_str = (
-            f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
-            f"{db_config['host']}:{db_config['port']}/{db_config['database']}?"
-            f"charset={db_config['charset']}"
-        )
-
-        with create_engine(conn_str).connect() as conn:
-            # 绑定参数并执行查询
-            df = pd.read_sql(
-                query.bindparams(
-                    start_date=dt_semiYear,  # 绑定起始日期参数
-                    end_date=yesterday,  # 绑定结束日期参数
-                    operation=oper  # 绑定工程代码参数
-                ),
-                conn
-            )
+        # 从良率立方体按月汇总
+        df = YieldCube(db_config, logger).query([], dt_semiYear, yesterday,
+                                                conditions=[('oper_old', '=', oper)], period='month')
+        df['fail'] = ((1 - df['out_qty'] / df['in_qty']) * 100).where(df['in_qty'] != 0)
+        df = df[['dt', 'in_qty', 'fail']]
 
         record_count = len(df)
         if record_count > 0:
@@ -663,44 +813,12 @@ def analyze_abnormal_oper(db_config, oper, workdt, logger):
     try:
         logger.info(f"开始分析异常工序 {oper} 在 {workdt} 的详细不良原因（基于加权不良率）")
 
-        # 1. 执行详细SQL查询（保留原始字段）
-        query = text("""
-            select 
-                dd.Product_Mode, 
-                dd.Tech_Name, 
-                dd.Die_Density, 
-                dd.Product_Density, 
-                dd.Module_Type, 
-                dy.grade, 
-                sum(in_qty) as in_qty,
-                sum(out_qty) as out_qty,
-                (1 - sum(out_qty)/sum(in_qty)) * 100 as fail  -- 原始不良率（百分比）
-            from 
-                cmsalpha.db_yielddetail dy 
-            join 
-                modulemte.db_deviceinfo dd on dy.device = dd.Device 
-            where 
-                dy.workdt = :work_date 
-                and dy.oper_old = :operation 
-            group by 
-                dd.Product_Mode, dd.Tech_Name, dd.Die_Density, 
-                dd.Product_Density, dd.Module_Type, dy.grade
-            order by 
-                in_qty desc;
-        """)
-
-        # 构建数据库连接
-        conn_str = (
-            f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
-            f"{db_config['host']}:{db_config['port']}/{db_config['database']}?"
-            f"charset={db_config['charset']}"
-        )
-
-        with create_engine(conn_str).connect() as conn:
-            df = pd.read_sql(
-                query.bindparams(work_date=workdt, operation=oper),
-                conn
-            )
+        # 1. 从良率立方体查询产品别数据（保留原始字段）
+        product_attrs = ['Product_Mode', 'Tech_Name', 'Die_Density', 'Product_Density', 'Module_Type', 'grade']
+        df = YieldCube(db_config, logger).query(product_attrs, workdt, workdt,
+                                                conditions=[('oper_old', '=', oper)], device_info=True)
+        df['fail'] = ((1 - df['out_qty'] / df['in_qty']) * 100).where(df['in_qty'] != 0)  # 原始不良率（百分比）
+        df = df.sort_values('in_qty', ascending=False).reset_index(drop=True)
 
         if df.empty:
             logger.warning(f"未查询到工序 {oper} 在 {workdt} 的详细产品数据")
@@ -759,8 +877,105 @@ def analyze_abnormal_oper(db_config, oper, workdt, logger):
         return (pd.DataFrame(), pd.DataFrame())
 
 
+# 单工序分析流程（控制限判定 → 主要不良产品 → 产品分析）
+def analyze_oper(db_config, oper, df_ttl, dt_semiYear, yesterday, logger, batch=True):
+    """
+    单个工序的完整分析流程，各工序之间相互独立，可并发执行
+
+    返回:
+        dict: {'oper', 'result'(控制限判定), 'vital_df', 'products'(ProductBatch或Product列表)}
+    """
+    products = None
+    vital_df = pd.DataFrame()
+    result = {'oper': oper, 'status': '无法判定', 'message': '分析未完成'}
+    try:
+        # 2.1 获取半年度数据
+        df_oper = get_fail_oper(db_config, oper, dt_semiYear, yesterday, logger)
+        # 2.2计算控制限
+        p_bar, LCL, UCL = calculate_control_limits(df_oper, logger)
+        # Step3. 与当日数据比较
+        logger.info("Step3: 分析历史数据UCL，LCL并与日别数据比较")
+        result = compare_with_control_limits(df_ttl, oper, LCL, UCL, logger)
+        # Step4. 分析异常工序
+        if result['status'] != '正常':
+            logger.info("Step4: 确定主要不良产品")
+            full_df, vital_df = analyze_abnormal_oper(
+                db_config=db_config,
+                oper=oper,
+                workdt=yesterday,  # 异常日期
+                logger=logger
+            )
+            # Step5. 针对主要不良产品分析产品占比变化（排查产品结构变化导致的）
+            if not vital_df.empty and batch:
+                # 批量模式：所有主要不良产品共用查询，向量化计算
+                product_batch = ProductBatch(vital_df=vital_df, db_config=db_config, logger=logger)
+                logger.info("Step5: 分析产品占比变化趋势")
+                product_batch.analyze_proportion(
+                    oper=oper,
+                    dt_semiYear=dt_semiYear,
+                    yesterday=yesterday,
+                    trend_threshold=0.02
+                )
+                logger.info("Step6: 分析产品半年度不良率趋势")
+                product_batch.analyze_fail_rate(
+                    oper=oper,
+                    dt_semiYear=dt_semiYear,
+                    yesterday=yesterday,
+                    stability_threshold=0.3
+                )
+                logger.info("Step7: 分析产品在该工序设备别不良率")
+                product_batch.analyze_equip_diff(workdt=yesterday, oper=oper)
+                products = product_batch
+            elif not vital_df.empty:
+                product_attrs = PRODUCT_ATTRS
+                products = []
+                # 遍历每个主要不良产品，创建Product对象并执行分析
+                for _, product_row in vital_df.iterrows():
+                    product_info = {attr: product_row[attr] for attr in product_attrs}
+                    # 实例化产品对象（封装属性和依赖）
+                    product = Product(
+                        product_info=product_info,
+                        db_config=db_config,
+                        logger=logger
+                    )
+                    products.append(product)
+                    logger.info(f"\n----- 开始处理 {product} -----")
+
+                    # 调用对象方法执行分析（无需传递产品属性参数）
+                    # Step5：占比趋势分析
+                    logger.info("Step5: 分析产品占比变化趋势")
+                    product.analyze_proportion(
+                        oper=oper,
+                        dt_semiYear=dt_semiYear,
+                        yesterday=yesterday,
+                        trend_threshold=0.02
+                    )
+
+                    # Step6：不良率趋势分析
+                    logger.info("Step6: 分析产品半年度不良率趋势")
+                    product.analyze_fail_rate(
+                        oper=oper,
+                        dt_semiYear=dt_semiYear,
+                        yesterday=yesterday,
+                        stability_threshold=0.3
+                    )
+                    # Step7: 分析产品在该工序设备别不良率
+                    logger.info("Step7: 分析产品在该工序设备别不良率")
+                    product.analyze_equip_diff(workdt=yesterday, oper=oper)
+
+                    logger.info(f"----- {product} 分析完成 -----\n")
+            else:
+                logger.warning(f"工序 [{oper}] 无主要不良产品，跳过产品分析")
+        else:
+            logger.info(f"===== 工序 [{oper}] 无需分析 =====\n")
+        logger.info(f"===== 工序 [{oper}] 处理完成 =====\n")  # 工序结束符
+    except Exception as e:
+        logger.error(f"工序 [{oper}] 分析出错: {str(e)}", exc_info=True)
+    return {'oper': oper, 'result': result, 'vital_df': vital_df, 'products': products}
+
+
 # 主函数
-def main(mode):
+def main(mode, batch=True, workers=4):
     # 初始化日志记录器
     log_path = "C:/Users/Tengjun Zhao/Desktop"
     log_name = datetime.today().strftime('%Y%m%d')
@@ -795,6 +1010,7 @@ def main(mode):
             )
             logger.info("使用生产环境数据库(172.27.154.57)")
         logger.info("程序开始运行")
+        reset_engine_stats()
         # 作业时间计算
         yesterday_date = datetime.now() - timedelta(days=1)
         yesterday = yesterday_date.strftime('%Y%m%d')
@@ -814,70 +1030,26 @@ def main(mode):
         if not df_ttl.empty:
             logger.info(f"成功获取每日Fail Status，共 {len(df_ttl)} 个工程")
             logger.info(f"各工程半年度Fail Status情况")
-            results = []
-            for oper in operList:
-                # 2.1 获取半年度数据
-                df_oper = get_fail_oper(db_config, oper, dt_semiYear, yesterday, logger)
-                # 2.2计算控制限
-                p_bar, LCL, UCL = calculate_control_limits(df_oper, logger)
-                # Step3. 与当日数据比较
-                logger.info("Step3: 分析历史数据UCL，LCL并与日别数据比较")
-                result = compare_with_control_limits(df_ttl, oper, LCL, UCL, logger)
-                results.append(result)
-                # Step4. 分析异常工序
-                if result['status'] != '正常':
-                    logger.info("Step4: 确定主要不良产品")
-                    full_df, vital_df = analyze_abnormal_oper(
-                        db_config=db_config,
-                        oper=oper,
-                        workdt=yesterday,  # 异常日期
-                        logger=logger
-                    )
-                    # Step5. 针对主要不良产品分析产品占比变化（排查产品结构变化导致的）
-                    if not vital_df.empty:
-                        product_attrs = ['Product_Mode', 'Tech_Name', 'Die_Density',
-                                         'Product_Density', 'Module_Type', 'grade']
-                        # 遍历每个主要不良产品，创建Product对象并执行分析
-                        for _, product_row in vital_df.iterrows():
-                            product_info = {attr: product_row[attr] for attr in product_attrs}
-                            # 实例化产品对象（封装属性和依赖）
-                            product = Product(
-                                product_info=product_info,
-                                db_config=db_config,
-                                logger=logger
-                            )
-                            logger.info(f"\n----- 开始处理 {product} -----")
-
-                            # 调用对象方法执行分析（无需传递产品属性参数）
-                            # Step5：占比趋势分析
-                            logger.info("Step5: 分析产品占比变化趋势")
-                            product.analyze_proportion(
-                                oper=oper,
-                                dt_semiYear=dt_semiYear,
-                                yesterday=yesterday,
-                                trend_threshold=0.02
-                            )
-
-                            # Step6：不良率趋势分析
-                            logger.info("Step6: 分析产品半年度不良率趋势")
-                            product.analyze_fail_rate(
-                                oper=oper,
-                                dt_semiYear=dt_semiYear,
-                                yesterday=yesterday,
-                                stability_threshold=0.3
-                            )
-                            # Step7: 分析产品在该工序设备别不良率
-                            logger.info("Step7: 分析产品在该工序设备别不良率")
-                            product.analyze_equip_diff(workdt=yesterday, oper=oper)
-
-                            logger.info(f"----- {product} 分析完成 -----\n")
-                    else:
-                        logger.warning(f"工序 [{oper}] 无主要不良产品，跳过产品分析")
-                else:
-                    logger.info(f"===== 工序 [{oper}] 无需分析 =====\n")
-                logger.info(f"===== 工序 [{oper}] 处理完成 =====\n")  # 工序结束符
+            oper_args = dict(db_config=db_config, df_ttl=df_ttl, dt_semiYear=dt_semiYear,
+                             yesterday=yesterday, batch=batch)
+            if workers > 1:
+                # 并发模式：各工序使用独立日志器，结束后按operList顺序回放日志、合并结果
+                oper_loggers = {oper: setup_oper_logger(logger, oper) for oper in operList}
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(analyze_oper, oper=oper, logger=oper_loggers[oper][0], **oper_args)
+                               for oper in operList]
+                    oper_results = [future.result() for future in futures]
+                for oper in operList:
+                    oper_loggers[oper][1].replay(logger)
+            else:
+                oper_results = [analyze_oper(oper=oper, logger=logger, **oper_args) for oper in operList]
+            results = [oper_result['result'] for oper_result in oper_results]
+            logger.info("各工序判定结果汇总:")
+            for result in results:
+                logger.info(f"  工序 {result['oper']}: {result['status']} - {result['message']}")
         else:
             logger.warning("未获取到任何每日Fail Status")
+        logger.info(f"数据库连接统计: {engine_stats()}")
         logger.info("程序运行结束")
 
     except Exception as e:
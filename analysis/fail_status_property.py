@@ -1,7 +1,6 @@
 from datetime import datetime, timedelta
 import dateutil.relativedelta
 import pandas as pd
-from sqlalchemy import create_engine, text
 import os
 import logging
 from logging.handlers import RotatingFileHandler
@@ -9,114 +8,190 @@ import numpy as np
 from scipy import stats
 # 引用fail_status_analysis的logger方法
 from fail_status_analysis import setup_logger
+from yield_cube import YieldCube
+from db_engine import engine_stats, reset_engine_stats
 
 from datetime import datetime
 
 
+# 工序划分
+ET_OPER = '5600'
+AT_OPERS = ['5710', '5700', '5780']
+ALL_OPERS = [ET_OPER] + AT_OPERS
+FAIL_STATS_COLUMNS = ['et_fail', 'at_fail', 'ttl_fail']
+
+
+class PeriodOperIndex:
+    """(period, oper) 位置索引：同一批产品共用一个索引对象，产品只保存数组"""
+    __slots__ = ('periods', 'opers', 'period_pos', 'oper_pos')
+
+    def __init__(self, periods=(), opers=()):
+        self.periods = list(periods)
+        self.opers = list(opers)
+        self.period_pos = {period: i for i, period in enumerate(self.periods)}
+        self.oper_pos = {oper: i for i, oper in enumerate(self.opers)}
+
+    @property
+    def shape(self):
+        return len(self.periods), len(self.opers)
+
+    def locate(self, period, oper):
+        """返回 (period位置, oper位置)，不存在时返回None"""
+        i = self.period_pos.get(period)
+        j = self.oper_pos.get(oper)
+        return None if i is None or j is None else (i, j)
+
+    def extended(self, period, oper):
+        """返回包含period/oper的新索引（共享索引不可原地修改）"""
+        periods = self.periods + ([period] if period not in self.period_pos else [])
+        opers = self.opers + ([oper] if oper not in self.oper_pos else [])
+        return PeriodOperIndex(periods, opers)
+
+
+def calculate_fail_rate(in_qty, out_qty):
+    """fail率（%，两位小数）；in为0时为0，无数据（NaN）保持NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fail = np.where(in_qty > 0, np.round((in_qty - out_qty) / in_qty * 100, 2), 0.0)
+    return np.where(np.isnan(in_qty), np.nan, fail)
+
+
+def calculate_fail_stats(fail, index):
+    """
+    按最后一维（oper）计算fail统计：et fail（5600）、at fail（5710+5700+5780）、ttl fail（全部工序）
+    :param fail: ndarray, 形状 (..., period, oper)，无数据为NaN
+    :param index: PeriodOperIndex
+    :return: ndarray, 形状 (..., period, 3)，列顺序同FAIL_STATS_COLUMNS，无数据为NaN
+    """
+    def oper_sum(opers):
+        cols = [index.oper_pos[oper] for oper in opers if oper in index.oper_pos]
+        if not cols:
+            return np.full(fail.shape[:-1], np.nan)
+        sub = fail[..., cols]
+        return np.where(np.isnan(sub).all(axis=-1), np.nan, np.round(np.nansum(sub, axis=-1), 2))
+
+    et_fail = fail[..., index.oper_pos[ET_OPER]] if ET_OPER in index.oper_pos else np.full(fail.shape[:-1], np.nan)
+    return np.stack([et_fail, oper_sum(AT_OPERS), oper_sum(ALL_OPERS)], axis=-1)
+
+
+class PeriodOperData:
+    """单个产品一种周期（年度/月度）的数据：in/out/fail数组，形状 (period, oper)"""
+    __slots__ = ('index', 'in_qty', 'out_qty', 'fail', 'stats')
+
+    def __init__(self, index=None, in_qty=None, out_qty=None, fail=None, stats=None):
+        self.index = index if index is not None else PeriodOperIndex()
+        self.in_qty = in_qty if in_qty is not None else np.full(self.index.shape, np.nan)
+        self.out_qty = out_qty if out_qty is not None else np.full(self.index.shape, np.nan)
+        self.fail = fail if fail is not None else calculate_fail_rate(self.in_qty, self.out_qty)
+        self.stats = stats  # (period, 3)
+
+    def add(self, period, oper, in_qty, out_qty):
+        if self.index.locate(period, oper) is None:
+            # 扩展索引并补齐数组
+            index = self.index.extended(period, oper)
+            pad = ((0, index.shape[0] - self.index.shape[0]), (0, index.shape[1] - self.index.shape[1]))
+            self.in_qty = np.pad(self.in_qty, pad, constant_values=np.nan)
+            self.out_qty = np.pad(self.out_qty, pad, constant_values=np.nan)
+            self.fail = np.pad(self.fail, pad, constant_values=np.nan)
+            self.index = index
+        i, j = self.index.locate(period, oper)
+        self.in_qty[i, j] = in_qty
+        self.out_qty[i, j] = out_qty
+        self.fail[i, j] = calculate_fail_rate(np.float64(in_qty), np.float64(out_qty))
+
+    def calculate_fail_stats(self):
+        self.stats = calculate_fail_stats(self.fail, self.index)
+        return self.stats_frame()
+
+    def stats_frame(self):
+        """fail统计DataFrame（仅有数据的周期），索引period"""
+        if self.stats is None or not self.index.periods:
+            return pd.DataFrame(columns=['period'] + FAIL_STATS_COLUMNS).set_index('period')
+        has_data = ~np.isnan(self.in_qty).all(axis=1)
+        frame = pd.DataFrame(self.stats[has_data], columns=FAIL_STATS_COLUMNS,
+                             index=pd.Index(np.array(self.index.periods, dtype=object)[has_data], name='period'))
+        return frame.sort_index()
+
+    def get_stat(self, period, fail_type):
+        i = self.index.period_pos.get(period)
+        if self.stats is None or i is None:
+            return None
+        value = self.stats[i, FAIL_STATS_COLUMNS.index(fail_type)]
+        return None if np.isnan(value) else float(value)
+
+    def get_in(self, period, oper):
+        pos = self.index.locate(period, oper)
+        return 0 if pos is None or np.isnan(self.in_qty[pos]) else int(self.in_qty[pos])
+
+    def nested(self):
+        """嵌套字典形式 {period: {oper: {'in', 'out', 'fail'}}}"""
+        data = {}
+        for i, j in zip(*np.nonzero(~np.isnan(self.in_qty))):
+            data.setdefault(self.index.periods[i], {})[self.index.opers[j]] = {
+                'in': int(self.in_qty[i, j]), 'out': int(self.out_qty[i, j]), 'fail': float(self.fail[i, j])}
+        return data
+
+    def pivot(self):
+        """透视表：索引period，列 {oper}_in / {oper}_out / {oper}_fail"""
+        periods = ~np.isnan(self.in_qty).all(axis=1)
+        opers = ~np.isnan(self.in_qty).all(axis=0)
+        if not periods.any():
+            return pd.DataFrame()
+        columns = {}
+        for j in np.nonzero(opers)[0]:
+            oper = self.index.opers[j]
+            columns[f'{oper}_in'] = self.in_qty[periods, j]
+            columns[f'{oper}_out'] = self.out_qty[periods, j]
+            columns[f'{oper}_fail'] = self.fail[periods, j]
+        index = pd.Index(np.array(self.index.periods, dtype=object)[periods], name='period')
+        return pd.DataFrame(columns, index=index).sort_index()
+
+
 class ProductData:
-    """产品数据类，用于存储特定产品的属性及相关生产数据"""
+    """产品数据类，用于存储特定产品的属性及相关生产数据（数组存储，批量产品共用索引）"""
+    __slots__ = ('properties', 'annual', 'monthly')
 
-    def __init__(self, product_properties):
+    def __init__(self, product_properties, annual=None, monthly=None):
         self.properties = product_properties  # 允许空字典
-        self.annual_data = {}  # {年份: {oper: {'in': int, 'out': int, 'fail': float}}}
-        self.monthly_data = {}  # {年月: {oper: {'in': int, 'out': int, 'fail': float}}}
+        self.annual = annual if annual is not None else PeriodOperData()  # 年份 × oper
+        self.monthly = monthly if monthly is not None else PeriodOperData()  # 年月 × oper
 
     def add_annual_oper_data(self, year, oper, in_qty, out_qty):
         """添加年度操作数据"""
-        if year not in self.annual_data:
-            self.annual_data[year] = {}
-        fail_rate = round((in_qty - out_qty) / in_qty * 100, 2) if in_qty > 0 else 0.0
-        self.annual_data[year][oper] = {
-            'in': in_qty,
-            'out': out_qty,
-            'fail': fail_rate
-        }
+        self.annual.add(year, oper, in_qty, out_qty)
 
     def add_monthly_oper_data(self, year_month, oper, in_qty, out_qty):
         """添加月度操作数据"""
-        if year_month not in self.monthly_data:
-            self.monthly_data[year_month] = {}
-        fail_rate = round((in_qty - out_qty) / in_qty * 100, 2) if in_qty > 0 else 0.0
-        self.monthly_data[year_month][oper] = {
-            'in': in_qty,
-            'out': out_qty,
-            'fail': fail_rate
-        }
+        self.monthly.add(year_month, oper, in_qty, out_qty)
+
+    @property
+    def annual_data(self):
+        """嵌套字典形式 {年份: {oper: {'in', 'out', 'fail'}}}（兼容旧接口）"""
+        return self.annual.nested()
+
+    @property
+    def monthly_data(self):
+        """嵌套字典形式 {年月: {oper: {'in', 'out', 'fail'}}}（兼容旧接口）"""
+        return self.monthly.nested()
 
     def get_pivoted_annual_data(self):
         """将年度数据转换为透视表格式"""
-        return self._pivot_data(self.annual_data)
+        return self.annual.pivot()
 
     def get_pivoted_monthly_data(self):
         """将月度数据转换为透视表格式"""
-        return self._pivot_data(self.monthly_data)
-
-    def _pivot_data(self, data):
-        """将数据转换为透视表格式（支持空数据）"""
-        rows = []
-        for period, oper_data in data.items():
-            row = {'period': period}
-            for oper, values in oper_data.items():
-                row[f'{oper}_in'] = values['in']
-                row[f'{oper}_out'] = values['out']
-                row[f'{oper}_fail'] = values['fail']
-            rows.append(row)
-
-        return pd.DataFrame(rows).set_index('period').sort_index() if rows else pd.DataFrame()
+        return self.monthly.pivot()
 
     def calculate_annual_fail_stats(self):
         """计算年度fail数据统计：et fail、at fail、ttl fail"""
-        return self._calculate_fail_stats(self.annual_data)
+        return self.annual.calculate_fail_stats()
 
     def calculate_monthly_fail_stats(self):
         """计算月度fail数据统计：et fail、at fail、ttl fail"""
-        return self._calculate_fail_stats(self.monthly_data)
-
-    def _calculate_fail_stats(self, data):
-        """通用fail数据计算（支持空数据）"""
-        stats = []
-        et_oper = '5600'
-        at_opers = ['5710', '5700', '5780']
-        all_opers = [et_oper] + at_opers
-
-        for period, oper_data in data.items():
-            # 计算et fail（仅5600工序）
-            et_fail = oper_data[et_oper]['fail'] if et_oper in oper_data else None
-
-            # 计算at fail（5710、5700、5780工序总和）
-            at_sum = 0.0
-            at_count = 0
-            for oper in at_opers:
-                if oper in oper_data:
-                    at_sum += oper_data[oper]['fail']
-                    at_count += 1
-            at_fail = round(at_sum, 2) if at_count > 0 else None
-
-            # 计算ttl fail（所有指定工序总和）
-            ttl_sum = 0.0
-            ttl_count = 0
-            for oper in all_opers:
-                if oper in oper_data:
-                    ttl_sum += oper_data[oper]['fail']
-                    ttl_count += 1
-            ttl_fail = round(ttl_sum, 2) if ttl_count > 0 else None
-
-            # 存储统计结果到数据字典
-            oper_data['fail_stats'] = {
-                'et_fail': et_fail,
-                'at_fail': at_fail,
-                'ttl_fail': ttl_fail
-            }
-            stats.append({
-                'period': period,
-                'et_fail': et_fail,
-                'at_fail': at_fail,
-                'ttl_fail': ttl_fail
-            })
-
-        # 支持空统计结果
-        return pd.DataFrame(stats).set_index('period').sort_index() if stats else \
-            pd.DataFrame(columns=['period', 'et_fail', 'at_fail', 'ttl_fail'])
+        return self.monthly.calculate_fail_stats()
+
+    def get_fail_stat(self, period, fail_type, is_annual=True):
+        """获取指定周期的fail统计（无数据返回None）"""
+        return (self.annual if is_annual else self.monthly).get_stat(period, fail_type)
 
     def get_product_display_name(self):
         """获取产品显示名称（支持空属性，返回空字符串）"""
@@ -124,9 +199,7 @@ class ProductData:
 
     def get_5600_in_qty(self, period, is_annual=True):
         """获取指定周期5600工序的in数量（空值返回0）"""
-        data = self.annual_data if is_annual else self.monthly_data
-        oper_data = data.get(period, {})
-        return oper_data.get('5600', {}).get('in', 0)
+        return (self.annual if is_annual else self.monthly).get_in(period, ET_OPER)
 
     def __str__(self):
         """支持空属性的字符串表示"""
@@ -203,58 +276,23 @@ def get_property_list(db_config, start, end, devicePropertyList, lotPropertyList
         devicePropertyList = devicePropertyList if isinstance(devicePropertyList, list) else []
         lotPropertyList = lotPropertyList if isinstance(lotPropertyList, list) else []
 
-        # 构建查询字段（处理空列表：若均为空，用默认字段避免SQL错误）
-        device_fields = [f"dd.{field}" for field in devicePropertyList] if devicePropertyList else []
-        lot_fields = [f"dy.{field}" for field in lotPropertyList] if lotPropertyList else []
-        all_fields = device_fields + lot_fields
+        # 构建分组字段（处理空列表：若均为空，用默认字段）
+        all_fields = devicePropertyList + lotPropertyList
 
-        # 关键修复：若所有字段为空，设置默认字段（dy.device存在于JOIN后的表中）
+        # 若所有字段为空，设置默认字段device
         if not all_fields:
             if logger:
-                logger.warning("devicePropertyList和lotPropertyList均为空，使用默认字段'dy.device'查询")
-            all_fields = ["dy.device"]  # 默认字段确保SQL语法正确
-        select_fields = ", ".join(all_fields)
-
-        # 构建WHERE子句条件
-        where_clauses = [f"dy.workdt BETWEEN :start_dt AND :end_dt"]
-        params = {'start_dt': start, 'end_dt': end}
+                logger.warning("devicePropertyList和lotPropertyList均为空，使用默认字段'device'查询")
+            all_fields = ["device"]
 
-        # 处理额外条件（原逻辑保留，支持空条件）
-        condition_counter = 0
+        # 处理额外条件（表别名不再需要，立方体中字段唯一）
+        conditions = []
         if additional_conditions and isinstance(additional_conditions, list):
-            for table_alias, field, operator, values in additional_conditions:
-                if operator.upper() not in ['IN', '=', '!=', '>', '<', '>=', '<=']:
-                    raise ValueError(f"不支持的操作符: {operator}")
-
-                if operator.upper() == 'IN':
-                    placeholders = ", ".join([f":cond_{condition_counter}_{i}" for i in range(len(values))])
-                    where_clauses.append(f"{table_alias}.{field} {operator} ({placeholders})")
-                    for i, value in enumerate(values):
-                        params[f'cond_{condition_counter}_{i}'] = value
-                else:
-                    placeholder = f":cond_{condition_counter}"
-                    where_clauses.append(f"{table_alias}.{field} {operator} {placeholder}")
-                    params[placeholder[1:]] = values
-                condition_counter += 1
-
-        # 构建SQL（GROUP BY与SELECT字段一致，避免语法错误）
-        sql = f"""
-            SELECT {select_fields}
-            FROM cmsalpha.db_yielddetail dy
-            JOIN modulemte.db_deviceinfo dd ON dy.device = dd.Device
-            WHERE {' AND '.join(where_clauses)}
-            GROUP BY {select_fields}
-            ORDER BY {select_fields} ASC
-        """
-
-        # 执行查询
-        conn_str = (f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
-                    f"{db_config['host']}:{db_config['port']}/?charset={db_config['charset']}")
-        engine = create_engine(conn_str)
-
-        with engine.connect() as conn:
-            result = conn.execute(text(sql), params)
-            df = pd.DataFrame(result.fetchall(), columns=result.keys())
+            conditions = [(field, operator, values) for _, field, operator, values in additional_conditions]
+
+        # 从良率立方体查询（与原JOIN db_deviceinfo一致，仅统计有产品信息的device）
+        df = YieldCube(db_config, logger).query(all_fields, start, end, conditions=conditions, device_info=True)
+        df = df[all_fields]
 
         if logger:
             logger.info(f"属性列表查询成功，返回{len(df)}条记录")
@@ -280,81 +318,32 @@ def get_product_production_data(db_config, product, additional_conditions, time_
             logger.debug(f"产品 {product} 的device_property_list为空，所有属性按批次属性处理")
 
         # 时间范围逻辑（原逻辑保留）
+        last_month_last_day = datetime.now().replace(day=1) - timedelta(days=1)
+        end_date = last_month_last_day.strftime('%Y%m%d')
         if time_type == 'annual':
-            last_month_last_day = datetime.now().replace(day=1) - timedelta(days=1)
             current_year = datetime.now().year
-            years = [current_year - 2, current_year - 1, current_year]
-            start_date = f"{years[0]}0101"
-            end_date = last_month_last_day.strftime('%Y%m%d')
-            date_format = "SUBSTRING(dy.workdt, 1, 4)"
-            group_by = "dt, oper_old"
+            start_date = f"{current_year - 2}0101"
+            period = 'year'
         else:  # monthly
-            last_month_last_day = datetime.now().replace(day=1) - timedelta(days=1)
             start_date = (last_month_last_day - dateutil.relativedelta.relativedelta(months=11))
             start_date = start_date.replace(day=1).strftime('%Y%m%d')
-            end_date = last_month_last_day.strftime('%Y%m%d')
-            date_format = "SUBSTRING(dy.workdt, 1, 6)"
-            group_by = "dt, oper_old"
-
-        # 构建WHERE条件（支持空产品属性）
-        where_conditions = [f"dy.workdt BETWEEN :start_date AND :end_date"]
-        params = {"start_date": start_date, "end_date": end_date}
+            period = 'month'
 
-        # 处理空产品属性（不添加属性过滤条件）
+        # 产品属性作为筛选条件（空属性时不添加）
+        conditions = []
         if not product.properties:
             if logger:
                 logger.debug(f"产品 {product} 的properties为空，不添加属性过滤条件")
         else:
-            # 添加属性过滤（空device列表时，所有属性按批次处理）
-            for prop_name, prop_value in product.properties.items():
-                if prop_name in device_property_list:
-                    prop_placeholder = f":dd_{prop_name}"
-                    where_conditions.append(f"dd.{prop_name} = {prop_placeholder}")
-                else:
-                    prop_placeholder = f":dy_{prop_name}"
-                    where_conditions.append(f"dy.{prop_name} = {prop_placeholder}")
-                params[prop_placeholder[1:]] = prop_value  # 绑定参数（统一处理，避免遗漏）
-
-        # 处理额外条件（原逻辑保留）
-        condition_counter = 0
+            conditions += [(prop_name, '=', prop_value) for prop_name, prop_value in product.properties.items()]
+
+        # 处理额外条件（原逻辑保留，表别名不再需要）
         if additional_conditions and isinstance(additional_conditions, list):
-            for table_alias, field, operator, values in additional_conditions:
-                if operator.upper() not in ['IN', '=', '!=', '>', '<', '>=', '<=']:
-                    raise ValueError(f"不支持的操作符: {operator}")
-
-                if operator.upper() == 'IN':
-                    placeholders = ", ".join([f":cond_{condition_counter}_{i}" for i in range(len(values))])
-                    where_conditions.append(f"{table_alias}.{field} {operator} ({placeholders})")
-                    for i, value in enumerate(values):
-                        params[f'cond_{condition_counter}_{i}'] = value
-                else:
-                    placeholder = f":cond_{condition_counter}"
-                    where_conditions.append(f"{table_alias}.{field} {operator} {placeholder}")
-                    params[placeholder[1:]] = values
-                condition_counter += 1
-
-        # 构建SQL
-        sql = f"""
-            SELECT 
-                {date_format} as dt, 
-                dy.oper_old, 
-                SUM(in_qty) as in_qty, 
-                SUM(out_qty) as out_qty
-            FROM cmsalpha.db_yielddetail dy
-            JOIN modulemte.db_deviceinfo dd ON dy.device = dd.Device
-            WHERE {' AND '.join(where_conditions)}
-            GROUP BY {group_by}
-            ORDER BY dt ASC
-        """
-
-        # 执行查询
-        conn_str = (f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
-                    f"{db_config['host']}:{db_config['port']}/?charset={db_config['charset']}")
-        engine = create_engine(conn_str)
-
-        with engine.connect() as conn:
-            result = conn.execute(text(sql), params)
-            df = pd.DataFrame(result.fetchall(), columns=result.keys())
+            conditions += [(field, operator, values) for _, field, operator, values in additional_conditions]
+
+        # 从良率立方体查询
+        df = YieldCube(db_config, logger).query(['oper_old'], start_date, end_date, conditions=conditions,
+                                                period=period, device_info=True)
 
         # 计算故障率（支持空DataFrame）
         if not df.empty:
@@ -415,15 +404,125 @@ def populate_product_data(db_config, product_instances, additional_conditions, d
                 logger.debug(f"产品 {product} 无月度生产数据")
 
 
+# 批量获取所有产品的生产数据（一次分组查询）
+def get_bulk_production_data(db_config, property_fields, additional_conditions, time_type, logger=None):
+    """
+    一次查询所有产品的年度/月度工序数据
+    :return: DataFrame, 索引为 property_fields + [period, oper]，列为 in/out/fail
+    """
+    last_month_last_day = datetime.now().replace(day=1) - timedelta(days=1)
+    end_date = last_month_last_day.strftime('%Y%m%d')
+    if time_type == 'annual':
+        start_date = f"{datetime.now().year - 2}0101"
+        period = 'year'
+    else:  # monthly
+        start_date = (last_month_last_day - dateutil.relativedelta.relativedelta(months=11))
+        start_date = start_date.replace(day=1).strftime('%Y%m%d')
+        period = 'month'
+
+    conditions = []
+    if additional_conditions and isinstance(additional_conditions, list):
+        conditions = [(field, operator, values) for _, field, operator, values in additional_conditions]
+
+    df = YieldCube(db_config, logger).query(property_fields + ['oper_old'], start_date, end_date,
+                                            conditions=conditions, period=period, device_info=True)
+    if df.empty:
+        index = pd.MultiIndex.from_arrays([[]] * (len(property_fields) + 2),
+                                          names=property_fields + ['period', 'oper'])
+        return pd.DataFrame(columns=['in', 'out', 'fail'], index=index)
+
+    df = df.rename(columns={'dt': 'period', 'oper_old': 'oper', 'in_qty': 'in', 'out_qty': 'out'})
+    if time_type == 'annual':
+        df['period'] = df['period'].astype(int)
+    df['in'] = df['in'].astype('int64')
+    df['out'] = df['out'].astype('int64')
+    # 计算故障率（向量化）
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['fail'] = np.where(df['in'] > 0, ((df['in'] - df['out']) / df['in'] * 100).round(2), 0.0)
+    if logger:
+        logger.info(f"{time_type}数据批量查询成功，返回{len(df)}条记录")
+    return df.set_index(property_fields + ['period', 'oper']).sort_index()
+
+
+# 批量创建产品视图（替代逐产品查询）
+def create_product_views(db_config, property_df, device_property_list, lot_property_list,
+                         additional_conditions, logger=None):
+    """
+    年度、月度各一次分组查询，整体填充 (产品, period, oper) 数组并一次计算fail统计，
+    每个ProductData持有数组切片（视图）和共享的PeriodOperIndex
+    :return: list, ProductData实例列表（顺序与property_df一致）
+    """
+    device_property_list = device_property_list if isinstance(device_property_list, list) else []
+    lot_property_list = lot_property_list if isinstance(lot_property_list, list) else []
+    if property_df.empty:
+        if logger:
+            logger.warning("property_df为空，不创建任何ProductData实例")
+        return []
+
+    property_fields = [prop for prop in device_property_list + lot_property_list if prop in property_df.columns]
+    if not property_fields:
+        # 无产品属性：整体视为一个产品
+        return populate_product_data_single(db_config, additional_conditions, logger)
+
+    products = property_df[property_fields].reset_index(drop=True)
+    arrays = {}
+    for time_type in ['annual', 'monthly']:
+        frame = get_bulk_production_data(db_config, property_fields, additional_conditions, time_type, logger)
+        df = frame.reset_index().merge(products.assign(_pos=np.arange(len(products))),
+                                       on=property_fields, how='inner')
+        index = PeriodOperIndex(sorted(df['period'].unique()), sorted(df['oper'].unique()))
+        shape = (len(products),) + index.shape
+        in_qty = np.full(shape, np.nan)
+        out_qty = np.full(shape, np.nan)
+        rows = (df['_pos'].values,
+                df['period'].map(index.period_pos).values.astype(int),
+                df['oper'].map(index.oper_pos).values.astype(int))
+        in_qty[rows] = df['in'].values
+        out_qty[rows] = df['out'].values
+        fail = calculate_fail_rate(in_qty, out_qty)
+        arrays[time_type] = (index, in_qty, out_qty, fail, calculate_fail_stats(fail, index))
+
+    product_instances = []
+    for k, values in enumerate(products.itertuples(index=False, name=None)):
+        annual, monthly = (PeriodOperData(index, in_qty[k], out_qty[k], fail[k], stats_array[k])
+                           for index, in_qty, out_qty, fail, stats_array in (arrays['annual'], arrays['monthly']))
+        product_instances.append(ProductData(dict(zip(property_fields, values)), annual=annual, monthly=monthly))
+
+    if logger:
+        logger.info(f"批量创建{len(product_instances)}个ProductData实例")
+    return product_instances
+
+
+def populate_product_data_single(db_config, additional_conditions, logger=None):
+    """无产品属性时，按整体一个产品查询"""
+    product = ProductData({})
+    populate_product_data(db_config, [product], additional_conditions, [], logger)
+    product.calculate_annual_fail_stats()
+    product.calculate_monthly_fail_stats()
+    return [product]
+
+
 # 处理所有产品（支持空属性列表）
 def process_all_products(db_config, pc_property_df, sv_property_df,
                          device_property_list, lot_property_list,
-                         oper_list, additional_conditions_pc, additional_conditions_sv, logger=None):
+                         oper_list, additional_conditions_pc, additional_conditions_sv, logger=None, bulk=True):
     """处理所有PC和Server产品（支持空设备/批次属性列表）"""
     # 强制转为列表（避免None）
     device_property_list = device_property_list if isinstance(device_property_list, list) else []
     lot_property_list = lot_property_list if isinstance(lot_property_list, list) else []
 
+    if bulk:
+        # 批量路径：每类产品年度/月度各一次分组查询
+        if logger:
+            logger.info("开始批量处理PC产品...")
+        pc_products = create_product_views(db_config, pc_property_df, device_property_list, lot_property_list,
+                                           additional_conditions_pc, logger)
+        if logger:
+            logger.info("开始批量处理Server产品...")
+        sv_products = create_product_views(db_config, sv_property_df, device_property_list, lot_property_list,
+                                           additional_conditions_sv, logger)
+        return pc_products, sv_products
+
     # 创建PC产品实例
     if logger:
         logger.info("开始创建PC产品实例...")
@@ -488,13 +587,11 @@ def log_fail_tables(product_list, product_type, logger):
             row = [product.get_product_display_name()]
             # 年度数据（空值显示空字符串）
             for year in annual_periods:
-                year_data = product.annual_data.get(year, {})
-                fail_val = year_data.get('fail_stats', {}).get(fail_type)
+                fail_val = product.get_fail_stat(year, fail_type, is_annual=True)
                 row.append(f"{fail_val:.2f}" if fail_val is not None else "")
             # 月度数据（空值显示空字符串）
             for month in monthly_periods:
-                month_data = product.monthly_data.get(month, {})
-                fail_val = month_data.get('fail_stats', {}).get(fail_type)
+                fail_val = product.get_fail_stat(month, fail_type, is_annual=False)
                 row.append(f"{fail_val:.2f}" if fail_val is not None else "")
             table_data.append(row)
 
@@ -603,6 +700,7 @@ def main(mode):
             )
             logger.info("使用生产环境数据库(172.27.154.57)")
         logger.info("程序开始运行")
+        reset_engine_stats()
 
         # 时间范围定义（原逻辑保留）
         lastMonthLastDay = datetime.now().replace(day=1) - timedelta(days=1)
@@ -670,6 +768,7 @@ def main(mode):
         log_qty_table(pc_products, "PC", logger)
         log_qty_table(sv_products, "SV", logger)
 
+        logger.info(f"数据库连接统计: {engine_stats()}")
         logger.info("程序运行结束")
 
     except Exception as e:
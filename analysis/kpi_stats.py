@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import text
+from db_engine import get_engine
+from yield_cube import check_cube_fresh
+
+
+# 日别KPI序列表：每天每个KPI一行，夜间增量刷新
+KPI_TABLE = 'cmsalpha.db_kpi_daily'
+# 首次刷新时回溯的天数
+INITIAL_LOOKBACK_DAYS = 400
+# KPI定义：表, 日期字段, 分子, 分母, 系数, 附加条件（value = 分子/分母*系数）
+KPI_DEFINITIONS = {
+    'c_yield': ('cmsalpha.db_yield_cube', 'workdt', 'SUM(out_qty)', 'SUM(in_qty)', 100, ()),
+    'p_yield': ('cmsalpha.db_primeyieldet', 'date_val', 'SUM(bin1_cnt)', 'SUM(test_cnt)', 100, ()),
+    'retest': ('cmsalpha.db_et_retest', 'date_val', 'SUM(retest_cnt)', 'SUM(test_cnt)', 100, ()),
+    'dcfa': ('cmsalpha.db_dcfa', 'workdt', 'SUM(dcfa_qty)', 'SUM(in_qty)', 1000000, ()),
+}
+
+KPI_DDL = f"""
+CREATE TABLE IF NOT EXISTS {KPI_TABLE} (
+    workdt CHAR(8) NOT NULL,
+    kpi VARCHAR(32) NOT NULL,
+    numerator DOUBLE NULL,
+    denominator DOUBLE NULL,
+    value DOUBLE NULL,
+    update_time DATETIME NOT NULL,
+    PRIMARY KEY (kpi, workdt)
+)
+"""
+
+
+def rolling_stats(values, window, min_periods=2):
+    """
+    NumPy滚动统计（窗口以当前点结尾，含当前点），缺失值为NaN时忽略
+    :param values: 1维数组
+    :return: dict of ndarray: mean, std(ddof=1), min, max, zscore(当前点相对窗口), sigma((max-min)/std)
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    result = {key: np.full(n, np.nan) for key in ['mean', 'std', 'min', 'max', 'zscore', 'sigma']}
+    if n == 0:
+        return result
+    padded = np.concatenate([np.full(window - 1, np.nan), values])
+    windows = sliding_window_view(padded, window)
+    counts = (~np.isnan(windows)).sum(axis=1)
+    enough = counts >= max(min_periods, 2)
+    if not enough.any():
+        return result
+    w = windows[enough]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.nanmean(w, axis=1)
+        std = np.nanstd(w, axis=1, ddof=1)
+        w_min = np.nanmin(w, axis=1)
+        w_max = np.nanmax(w, axis=1)
+        result['mean'][enough] = mean
+        result['std'][enough] = std
+        result['min'][enough] = w_min
+        result['max'][enough] = w_max
+        result['zscore'][enough] = np.where(std > 0, (values[enough] - mean) / std, np.nan)
+        result['sigma'][enough] = np.where(std > 0, (w_max - w_min) / std, np.nan)
+    return result
+
+
+class KPIStatsService:
+    """KPI统计服务：维护日别KPI序列表，提供任意窗口的滚动均值/标准差/z-score/sigma，重复查询走LRU缓存"""
+
+    def __init__(self, db_config, cache_size=128, logger=None):
+        self.engine = get_engine(db_config)
+        self.logger = logger
+        self._load_series = lru_cache(maxsize=cache_size)(self._query_series)
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
+
+    def refresh(self, kpis=None, end=None):
+        """
+        增量刷新：各KPI从表中最大workdt（当天可能不完整，重新计算）刷新到end
+        :return: dict, {kpi: 刷新行数}
+        """
+        end = end or (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+        counts = {}
+        with self.engine.begin() as conn:
+            conn.execute(text(KPI_DDL))
+            for kpi in kpis or KPI_DEFINITIONS:
+                table, date_field, numerator, denominator, factor, conditions = KPI_DEFINITIONS[kpi]
+                if kpi == 'c_yield':
+                    # 立方体未刷新时c_yield会缺最近几天
+                    check_cube_fresh(self.engine, end, self.logger)
+                start = conn.execute(text(f"SELECT MAX(workdt) FROM {KPI_TABLE} WHERE kpi = :kpi"),
+                                     {'kpi': kpi}).scalar()
+                if start is None:
+                    start = (datetime.strptime(end, '%Y%m%d')
+                             - timedelta(days=INITIAL_LOOKBACK_DAYS)).strftime('%Y%m%d')
+                if start > end:
+                    counts[kpi] = 0
+                    continue
+                day = f"DATE_FORMAT({date_field}, '%Y%m%d')" if date_field == 'date_val' else date_field
+                where = [f"{date_field} BETWEEN :start AND :end", *conditions]
+                rows = conn.execute(text(f"""
+                    SELECT {day} AS workdt, {numerator} AS num, {denominator} AS den
+                    FROM {table}
+                    WHERE {' AND '.join(where)}
+                    GROUP BY {day}
+                """), {'start': self._bound(date_field, start), 'end': self._bound(date_field, end)}).fetchall()
+                data = [{'workdt': row[0], 'kpi': kpi,
+                         'numerator': None if row[1] is None else float(row[1]),
+                         'denominator': None if row[2] is None else float(row[2]),
+                         'value': float(row[1]) / float(row[2]) * factor if row[1] is not None and row[2] else None}
+                        for row in rows]
+                if data:
+                    conn.execute(text(f"""
+                        INSERT INTO {KPI_TABLE} (workdt, kpi, numerator, denominator, value, update_time)
+                        VALUES (:workdt, :kpi, :numerator, :denominator, :value, NOW())
+                        ON DUPLICATE KEY UPDATE numerator = VALUES(numerator), denominator = VALUES(denominator),
+                            value = VALUES(value), update_time = NOW()
+                    """), data)
+                counts[kpi] = len(data)
+        self._load_series.cache_clear()
+        self._log(f"KPI日别序列刷新完成（截至{end}）: {counts}")
+        return counts
+
+    @staticmethod
+    def _bound(date_field, workdt):
+        return f"{workdt[:4]}-{workdt[4:6]}-{workdt[6:]}" if date_field == 'date_val' else workdt
+
+    def _query_series(self, kpi, start, end):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT workdt, value FROM {KPI_TABLE}
+                WHERE kpi = :kpi AND workdt BETWEEN :start AND :end
+                ORDER BY workdt
+            """), {'kpi': kpi, 'start': start, 'end': end}).fetchall()
+        # 按日历日补齐，缺失日为NaN
+        days = pd.date_range(pd.to_datetime(start, format='%Y%m%d'), pd.to_datetime(end, format='%Y%m%d'))
+        series = pd.Series({row[0]: row[1] for row in rows}, dtype=float)
+        return series.reindex(days.strftime('%Y%m%d'))
+
+    def series(self, kpi, start, end):
+        """日别KPI序列（索引workdt），结果缓存，返回副本"""
+        return self._load_series(kpi, start, end).copy()
+
+    def rolling(self, kpi, end, window=30, periods=None):
+        """
+        滚动统计：以end结尾的periods天（默认window天），每天统计其前window天（含当天）
+        :return: DataFrame, 索引workdt，列 value/mean/std/min/max/zscore/sigma
+        """
+        periods = periods or window
+        end_date = pd.to_datetime(end, format='%Y%m%d')
+        start = (end_date - pd.Timedelta(days=periods + window - 2)).strftime('%Y%m%d')
+        series = self._load_series(kpi, start, end)
+        result = pd.DataFrame(rolling_stats(series.values, window), index=series.index)
+        result.insert(0, 'value', series.values)
+        return result.iloc[-periods:]
+
+    def describe(self, kpi, end, window=30):
+        """end当天相对前window天的统计，返回dict"""
+        row = self.rolling(kpi, end, window=window, periods=1).iloc[-1]
+        return {'kpi': kpi, 'workdt': end, 'window': window, **{k: (None if pd.isna(v) else float(v))
+                                                                 for k, v in row.items()}}
+
+    def outliers(self, kpi, end, window=30, threshold=3.0):
+        """窗口内|z-score|超过阈值的日期（z-score相对整个窗口计算）"""
+        series = self.rolling(kpi, end, window=window)['value']
+        values = series.values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_scores = (values - np.nanmean(values)) / np.nanstd(values, ddof=1)
+        frame = pd.DataFrame({'value': values, 'zscore': z_scores}, index=series.index)
+        return frame[np.abs(frame['zscore']) > threshold]
+
+
+# 进程内共享：同一数据库只创建一个服务（共用LRU缓存）
+_SERVICES = {}
+
+
+def get_kpi_service(db_config, logger=None):
+    key = db_config if isinstance(db_config, str) else tuple(sorted(db_config.items()))
+    if key not in _SERVICES:
+        _SERVICES[key] = KPIStatsService(db_config, logger=logger)
+    return _SERVICES[key]
+
+
+def main(mode):
+    db_config = {
+        'host': 'localhost' if mode == 'test' else '172.27.154.57',
+        'user': 'remoteuser',
+        'password': 'password',
+        'database': 'cmsalpha',
+        'charset': 'utf8mb4',
+        'port': 3306,
+    }
+    # 夜间任务：增量刷新到昨天
+    get_kpi_service(db_config).refresh()
+
+
+if __name__ == '__main__':
+    main('test')
@@ -0,0 +1,212 @@
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import text
+from db_engine import get_engine, engine_stats
+
+
+# 日别良率立方体: db_yielddetail 按 日期 × 工序 × 批次属性 × 设备 预聚合, 并冗余db_deviceinfo产品属性
+CUBE_TABLE = 'cmsalpha.db_yield_cube'
+# 批次维度（来自db_yielddetail）
+LOT_DIMENSIONS = ['workdt', 'oper_old', 'device', 'modtype', 'grade', 'device_cmf7', 'main_equip_id']
+# 产品属性维度（来自db_deviceinfo）
+DEVICE_DIMENSIONS = ['Product_Mode', 'Tech_Name', 'Die_Density', 'Product_Density', 'Module_Type']
+MEASURES = ['in_qty', 'out_qty']
+OPERATORS = ['IN', '=', '!=', '>', '<', '>=', '<=']
+# 周期 -> workdt截取长度
+PERIODS = {'day': 8, 'month': 6, 'year': 4}
+# 每次刷新重新聚合立方体最后一天之前的天数（db_yielddetail迟到或修正的数据）
+REFRESH_DAYS = 7
+
+CUBE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CUBE_TABLE} (
+    workdt CHAR(8) NOT NULL,
+    oper_old VARCHAR(16) NOT NULL,
+    device VARCHAR(64) NOT NULL,
+    modtype VARCHAR(16) NOT NULL DEFAULT '',
+    grade VARCHAR(16) NOT NULL DEFAULT '',
+    device_cmf7 VARCHAR(16) NOT NULL DEFAULT '',
+    main_equip_id VARCHAR(32) NOT NULL DEFAULT '',
+    in_deviceinfo TINYINT(1) NOT NULL DEFAULT 0,
+    Product_Mode VARCHAR(32) NULL,
+    Tech_Name VARCHAR(32) NULL,
+    Die_Density VARCHAR(16) NULL,
+    Product_Density VARCHAR(16) NULL,
+    Module_Type VARCHAR(16) NULL,
+    in_qty BIGINT NOT NULL DEFAULT 0,
+    out_qty BIGINT NOT NULL DEFAULT 0,
+    update_time DATETIME NOT NULL,
+    PRIMARY KEY (workdt, oper_old, device, modtype, grade, device_cmf7, main_equip_id),
+    KEY idx_oper_workdt (oper_old, workdt),
+    KEY idx_equip_workdt (main_equip_id, workdt)
+)
+"""
+
+
+def check_cube_fresh(engine, end, logger=None):
+    """
+    立方体最大workdt早于查询截止日期（不晚于昨天）时告警：夜间刷新未执行时各分析读到的是空或过期数据
+    :return: bool, 数据是否覆盖到截止日期
+    """
+    target = min(end, (datetime.now() - timedelta(days=1)).strftime('%Y%m%d'))
+    with engine.connect() as conn:
+        latest = conn.execute(text(f"SELECT MAX(workdt) FROM {CUBE_TABLE}")).scalar()
+    if latest is not None and latest >= target:
+        return True
+    msg = f"良率立方体数据截至{latest}，早于查询日期{target}，请先执行yield_cube刷新"
+    if logger:
+        logger.warning(msg)
+    else:
+        print(msg)
+    return False
+
+
+class YieldCube:
+    """良率立方体：夜间增量刷新，各分析脚本统一通过query读取，不再扫描db_yielddetail明细"""
+
+    def __init__(self, db_config, logger=None, refresh_days=REFRESH_DAYS):
+        self.db_config = db_config
+        self.logger = logger
+        self.refresh_days = refresh_days
+        self._fresh_checked = False
+        # 共用连接池，每次实例化不再新建Engine
+        self.engine = get_engine(db_config)
+        # 列名大小写不敏感（如Product_density）
+        self.dimensions = {dim.lower(): dim for dim in LOT_DIMENSIONS + DEVICE_DIMENSIONS}
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
+
+    def _dimension(self, name):
+        dim = self.dimensions.get(name.lower())
+        if dim is None:
+            raise ValueError(f"立方体不支持的维度: {name}")
+        return dim
+
+    def refresh(self, end=None):
+        """
+        增量刷新：从立方体最大workdt往前refresh_days天（最后一天可能只聚合了部分数据，
+        之前几天可能有迟到或修正的数据，均重新计算）刷新到end
+        :param end: str, 刷新截止日期YYYYMMDD，默认昨天
+        :return: int, 刷新的天数
+        """
+        end = end or (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+        with self.engine.begin() as conn:
+            conn.execute(text(CUBE_DDL))
+            start = conn.execute(text(f"SELECT MAX(workdt) FROM {CUBE_TABLE}")).scalar()
+            if start is not None:
+                start = (datetime.strptime(start, '%Y%m%d') - timedelta(days=self.refresh_days)).strftime('%Y%m%d')
+            else:
+                start = conn.execute(text("SELECT MIN(workdt) FROM cmsalpha.db_yielddetail")).scalar()
+        if start is None or start > end:
+            self._log("立方体无需刷新")
+            return 0
+
+        # 主键字段为NOT NULL，空值统一存为''
+        lot_fields = ", ".join(f"COALESCE(dy.{dim}, '')" for dim in LOT_DIMENSIONS[1:])
+        device_fields = ", ".join(f"dd.{dim}" for dim in DEVICE_DIMENSIONS)
+        # db_deviceinfo中Device不唯一，先按Device去重为一行，避免重复计数或主键冲突
+        device_info = ", ".join(f"MIN({dim}) AS {dim}" for dim in DEVICE_DIMENSIONS)
+        insert_sql = text(f"""
+            INSERT INTO {CUBE_TABLE} ({', '.join(LOT_DIMENSIONS + ['in_deviceinfo'] + DEVICE_DIMENSIONS + MEASURES)}, update_time)
+            SELECT dy.workdt, {lot_fields},
+                   MAX(dd.Device IS NOT NULL), {device_fields},
+                   SUM(dy.in_qty), SUM(dy.out_qty), NOW()
+            FROM cmsalpha.db_yielddetail dy
+            LEFT JOIN (SELECT Device, {device_info}
+                       FROM modulemte.db_deviceinfo GROUP BY Device) dd ON dy.device = dd.Device
+            WHERE dy.workdt = :workdt
+            GROUP BY dy.workdt, {lot_fields}, {device_fields}
+        """)
+        day = datetime.strptime(start, '%Y%m%d')
+        days = 0
+        while day.strftime('%Y%m%d') <= end:
+            workdt = day.strftime('%Y%m%d')
+            # 按天整体替换，保证重新聚合的日期没有残留行
+            with self.engine.begin() as conn:
+                conn.execute(text(f"DELETE FROM {CUBE_TABLE} WHERE workdt = :workdt"), {'workdt': workdt})
+                conn.execute(insert_sql, {'workdt': workdt})
+            days += 1
+            day += timedelta(days=1)
+        self._log(f"立方体刷新完成: {start} 至 {end}，共 {days} 天")
+        return days
+
+    def query(self, dims, start, end, conditions=None, period=None, device_info=None):
+        """
+        按维度汇总投入/产出
+        :param dims: list, 分组维度（LOT_DIMENSIONS / DEVICE_DIMENSIONS）
+        :param start: str, 开始日期YYYYMMDD
+        :param end: str, 结束日期YYYYMMDD
+        :param conditions: list of (field, operator, values)，operator见OPERATORS
+        :param period: 'day' / 'month' / 'year'，增加按周期截取的dt列
+        :param device_info: 是否仅统计db_deviceinfo中存在的device（与原JOIN一致），
+                            默认在维度或条件涉及产品属性时启用
+        :return: DataFrame, 列为 [dt] + dims + in_qty, out_qty
+        """
+        conditions = conditions or []
+        if not self._fresh_checked:
+            check_cube_fresh(self.engine, end, self.logger)
+            self._fresh_checked = True
+        select_fields = []
+        group_fields = []
+        if period is not None:
+            select_fields.append(f"SUBSTRING(workdt, 1, {PERIODS[period]}) AS dt")
+            group_fields.append("dt")
+        for name in dims:
+            dim = self._dimension(name)
+            # 刷新时空值存为''，读取时还原为NULL
+            column = f"NULLIF({dim}, '')" if dim in LOT_DIMENSIONS[3:] else dim
+            select_fields.append(f"{column} AS `{name}`")
+            group_fields.append(f"`{name}`")
+
+        where_clauses = ["workdt BETWEEN :start_dt AND :end_dt"]
+        params = {'start_dt': start, 'end_dt': end}
+        used_dims = {self._dimension(name) for name in dims}
+        for i, (field, operator, values) in enumerate(conditions):
+            dim = self._dimension(field)
+            used_dims.add(dim)
+            if operator.upper() not in OPERATORS:
+                raise ValueError(f"不支持的操作符: {operator}")
+            if operator.upper() == 'IN':
+                placeholders = ", ".join(f":cond_{i}_{j}" for j in range(len(values)))
+                where_clauses.append(f"{dim} IN ({placeholders})")
+                for j, value in enumerate(values):
+                    params[f'cond_{i}_{j}'] = value
+            else:
+                where_clauses.append(f"{dim} {operator} :cond_{i}")
+                params[f'cond_{i}'] = values
+        if device_info is None:
+            device_info = bool(used_dims & set(DEVICE_DIMENSIONS))
+        if device_info:
+            where_clauses.append("in_deviceinfo = 1")
+
+        select_fields += ["SUM(in_qty) AS in_qty", "SUM(out_qty) AS out_qty"]
+        sql = f"SELECT {', '.join(select_fields)} FROM {CUBE_TABLE} WHERE {' AND '.join(where_clauses)}"
+        if group_fields:
+            sql += f" GROUP BY {', '.join(group_fields)} ORDER BY {', '.join(group_fields)} ASC"
+        with self.engine.connect() as conn:
+            result = conn.execute(text(sql), params)
+            df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        if not df.empty:
+            df[MEASURES] = df[MEASURES].astype(float)
+        return df
+
+
+def main(mode):
+    db_config = {
+        'host': 'localhost' if mode == 'test' else '172.27.154.57',
+        'user': 'remoteuser',
+        'password': 'password',
+        'database': 'cmsalpha',
+        'charset': 'utf8mb4',
+        'port': 3306,
+    }
+    # 夜间任务：增量刷新到昨天
+    YieldCube(db_config).refresh()
+    print(f"数据库连接统计: {engine_stats()}")
+
+
+if __name__ == '__main__':
+    main('test')
@@ -1,35 +1,57 @@
+import time
 import pandas as pd
 import sqlalchemy
 from sqlalchemy import create_engine, text
 
 
+# 列名映射：source_column -> target_column（db_yielddetail -> db_etlog）
+COLUMN_MAPPING = {
+    'workdt': 'workdt',
+    'lot_id': 'lot_id',
+    'oper_old': 'oper',
+    'trans_time': 'trans_time',
+    'main_equip_id': 'equip',
+    'equip_model': 'model'
+}
+# 批量插入每块行数（method='multi'，一块一条多行INSERT）
+IMPORT_CHUNK_SIZE = 1000
+# 逐行重试仍失败的行写入该表（字段均为字符串，保证异常数据也能写入）
+REJECT_TABLE = 'db_etlog_reject'
+REJECT_DDL = f"""
+CREATE TABLE IF NOT EXISTS {REJECT_TABLE} (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    workdt VARCHAR(16) NULL,
+    lot_id VARCHAR(64) NULL,
+    oper VARCHAR(16) NULL,
+    trans_time VARCHAR(32) NULL,
+    equip VARCHAR(64) NULL,
+    model VARCHAR(64) NULL,
+    error TEXT NULL,
+    reject_time DATETIME NOT NULL,
+    PRIMARY KEY (id),
+    KEY idx_lot_id (lot_id)
+)
+"""
+
+
+# 服务端反连接：db_etLog最大workdt之后、db_etLog中尚不存在的5600 lot，只返回新lot
+# 所需索引见 check/etlog_indexes.sql
 def getLotList(engine):
-    maxWorkdtQuery = text("SELECT max(workdt) FROM db_etLog;")
-    with engine.connect() as connection:
-        maxWorkdt = connection.execute(maxWorkdtQuery).fetchone()
-    lotListQuery = text(f"SELECT workdt, lot_id, oper_old, trans_time, main_equip_id, equip_model "
-                        f"FROM db_yielddetail "
-                        f"WHERE workdt >= '{maxWorkdt[0]}' AND oper_old = '5600'"
-                        f"GROUP BY lot_id;")
+    lotListQuery = text("SELECT dy.workdt, dy.lot_id, dy.oper_old, dy.trans_time, dy.main_equip_id, dy.equip_model "
+                        "FROM db_yielddetail dy "
+                        "WHERE dy.oper_old = '5600' "
+                        "AND dy.workdt >= (SELECT COALESCE(MAX(workdt), '') FROM db_etLog) "
+                        "AND NOT EXISTS (SELECT 1 FROM db_etLog el WHERE el.lot_id = dy.lot_id) "
+                        "GROUP BY dy.lot_id;")
     with engine.connect() as connection:
         lotList = pd.read_sql(lotListQuery, connection)
     return lotList
 
 
 # 将lotList中的数据插入到MySQL数据库中
-def import_data(engine, df):
-    # 列名映射：source_column -> target_column
-    column_mapping = {
-        'workdt': 'workdt',  # 列名相同
-        'lot_id': 'lot_id',  # lot_id映射到lot_id
-        'oper_old': 'oper',  # oper_old映射到oper
-        'trans_time': 'trans_time',
-        'main_equip_id': 'equip',
-        'equip_model': 'model'
-    }
-
+def import_data(engine, df, table='db_etlog'):
     # 选择需要的列并进行重命名
-    df_to_insert = df[list(column_mapping.keys())].rename(columns=column_mapping)
+    df_to_insert = df[list(COLUMN_MAPPING.keys())].rename(columns=COLUMN_MAPPING)
 
     # 记录成功和失败的行数
     success_count = 0
@@ -45,7 +67,7 @@ def import_data(engine, df):
                 try:
                     # 将单行数据转换为DataFrame并插入
                     pd.DataFrame([row]).to_sql(
-                        name='db_etlog',
+                        name=table,
                         con=connection,
                         if_exists='append',
                         index=False
@@ -75,6 +97,85 @@ def import_data(engine, df):
             engine.dispose()  # 关闭数据库连接池
 
 
+# 分块批量插入：每块一条多行INSERT、单独提交；某块失败时仅该块逐行重试，仍失败的行写入REJECT_TABLE
+def import_data_bulk(engine, df, table='db_etlog', chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    :return: (成功行数, 拒绝行DataFrame（含error列）)
+    """
+    df_to_insert = df[list(COLUMN_MAPPING.keys())].rename(columns=COLUMN_MAPPING)
+    success_count = 0
+    rejected = []
+    for start in range(0, len(df_to_insert), chunk_size):
+        chunk = df_to_insert.iloc[start:start + chunk_size]
+        try:
+            with engine.begin() as connection:
+                chunk.to_sql(name=table, con=connection, if_exists='append', index=False, method='multi')
+            success_count += len(chunk)
+        except Exception as e:
+            print(f"第 {start} 行起的分块插入失败，逐行重试: {e}")
+            inserted, failed = _insert_rows(engine, chunk, table)
+            success_count += inserted
+            rejected.extend(failed)
+
+    rejected_df = pd.DataFrame(rejected, columns=list(COLUMN_MAPPING.values()) + ['error'])
+    if not rejected_df.empty:
+        _write_rejects(engine, rejected_df)
+    print(f"数据导入完成: 成功 {success_count} 行, 失败 {len(rejected_df)} 行（已写入{REJECT_TABLE}）")
+    return success_count, rejected_df
+
+
+# 逐行插入（仅用于失败分块），每行单独事务，失败行返回其数据和错误信息
+def _insert_rows(engine, chunk, table):
+    columns = list(chunk.columns)
+    insert = text(f"INSERT INTO {table} ({', '.join(columns)}) "
+                  f"VALUES ({', '.join(':' + column for column in columns)})")
+    # 空值转None，Timestamp转原生datetime，保证驱动可直接绑定
+    records = [{key: value.to_pydatetime() if isinstance(value, pd.Timestamp) else value
+                for key, value in record.items()}
+               for record in chunk.astype(object).where(chunk.notna(), None).to_dict('records')]
+    success_count = 0
+    failed = []
+    with engine.connect() as connection:
+        for record in records:
+            try:
+                with connection.begin():
+                    connection.execute(insert, record)
+                success_count += 1
+            except Exception as e:
+                print(f"lot {record.get('lot_id')} 插入失败: {e}")
+                failed.append({**record, 'error': str(e)})
+    return success_count, failed
+
+
+def _write_rejects(engine, rejected_df):
+    data = rejected_df.astype(object).where(rejected_df.notna(), None)
+    # 统一转为字符串，与REJECT_TABLE字段类型一致
+    data = data.apply(lambda column: column.map(lambda value: None if value is None else str(value)))
+    data['reject_time'] = pd.Timestamp.now().to_pydatetime().replace(microsecond=0)
+    with engine.begin() as connection:
+        connection.execute(text(REJECT_DDL))
+        data.to_sql(name=REJECT_TABLE, con=connection, if_exists='append', index=False, method='multi')
+
+
+# 插入速度对比：在db_etlog结构的临时表上分别执行逐行与分块批量插入，返回各自rows/second
+# 仅支持MySQL（CREATE TABLE ... LIKE复制db_etlog的字段与索引），应在与生产同配置的库上运行
+def benchmark_import(engine, df, table='db_etlog_bench'):
+    results = {}
+    for name, importer in [('row', lambda: import_data(engine, df, table=table)),
+                           ('bulk', lambda: import_data_bulk(engine, df, table=table))]:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            connection.execute(text(f"CREATE TABLE {table} LIKE db_etlog"))
+        start = time.perf_counter()
+        importer()
+        elapsed = time.perf_counter() - start
+        results[name] = len(df) / elapsed if elapsed > 0 else float('inf')
+        print(f"{name}: {len(df)} 行, {elapsed:.2f} 秒, {results[name]:.0f} rows/s")
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    return results
+
+
 # 获取还未执行过的lot_id
 def taskLot(engine):
     # 查询db_etLog中已有的lot_id
@@ -109,7 +210,7 @@ def main(mode):
         f'mysql+pymysql://{db_config["user"]}:{db_config["password"]}@{db_config["host"]}:{db_config["port"]}/{db_config["database"]}'
     )
     lotList = getLotList(engine)
-    import_data(engine, lotList)
+    import_data_bulk(engine, lotList)
     lotList = taskLot(engine)
     return lotList
 
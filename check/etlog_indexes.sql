@@ -0,0 +1,18 @@
+-- check/etlog_indexes.sql
+-- check_etLog 新lot反连接与待处理lot查询所需索引（一次性执行，不在日常任务中运行）
+-- db_yielddetail为大表，建议在维护窗口执行
+
+USE cmsalpha;
+
+-- 1. db_yielddetail: 5600工序按workdt范围扫描，SELECT字段全部在索引内（覆盖索引）
+CREATE INDEX idx_oper_workdt_etlog
+    ON db_yielddetail (oper_old, workdt, lot_id, trans_time, main_equip_id, equip_model);
+
+-- 2. db_etlog: NOT EXISTS按lot_id探测
+CREATE INDEX idx_lot_id ON db_etlog (lot_id);
+
+-- 3. db_etlog: MAX(workdt)子查询直接读索引末端
+CREATE INDEX idx_workdt ON db_etlog (workdt);
+
+-- 4. db_etlog: taskLot (log_check IS NULL -> lot_id)
+CREATE INDEX idx_log_check_lot ON db_etlog (log_check, lot_id);
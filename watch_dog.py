@@ -1,6 +1,92 @@
+import time
+import hashlib
+import threading
 import pymysql
 import numpy as np
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DATE_FORMATS = ["%Y%m%d", "%Y-%m-%d", "%Y/%m/%d"]  # 支持的日期格式列表
+# 判异条件取反: 统计不满足spec的数量
+DESC_MAPPING = {
+    '>': '<=',
+    '<': '>=',
+    '>=': '<',
+    '<=': '>',
+}
+# 判异规则 (Nelson 编号), Western Electric 为 1/5/6 + 连续8点同侧
+NELSON_RULES = ('1', '2', '3', '4', '5', '6', '7', '8')
+WESTERN_ELECTRIC_RULES = ('1', '2', '5', '6')
+# P图任务的 spec_desc -> (判异规则, 规则2连续同侧点数)
+SPC_RULE_PRESETS = {
+    'P_Chart': (('1',), 9),
+    'P_Chart_Nelson': (NELSON_RULES, 9),
+    'P_Chart_WE': (WESTERN_ELECTRIC_RULES, 8),
+}
+
+
+def mission_para(mission):
+    # db_watchdog_mission_list 行转任务参数, P图任务按 spec_desc 取判异规则
+    rules, run_length = SPC_RULE_PRESETS.get(mission[5], (('1',), 9))
+    return {'id': mission[0],
+            'type': mission[1],
+            'db_name': mission[4],
+            'indicator': mission[3],
+            'spec': mission[6],
+            'spec_desc': mission[5],
+            'status': mission[7],
+            'category': mission[2],
+            'rules': rules,
+            'run_length': run_length}
+
+
+def search_date(indicator, day):
+    # 按日期字段格式化查询日期
+    if indicator == 'workdt':
+        return day.strftime("%Y%m%d")
+    return day.strftime("%Y-%m-%d")
+
+
+def shift_day(day, days):
+    # 按原日期字符串格式平移天数, DATETIME值按其日期部分平移
+    for date_format in DATE_FORMATS:
+        try:
+            return (datetime.strptime(str(day)[:10], date_format) + timedelta(days=days)).strftime(date_format)
+        except ValueError:
+            continue
+    return day
+
+
+def p_chart_window(indicator, yesterday):
+    # P_Chart 取最近30天窗口
+    return search_date(indicator, yesterday - timedelta(days=30)), search_date(indicator, yesterday)
+
+
+def judge_max(para, result, yesterday):
+    if para['spec'] == 'yestoday':
+        for date_format in DATE_FORMATS:
+            try:
+                result_date = datetime.strptime(str(result), date_format)
+            except ValueError:
+                continue  # 如果解析失败，尝试下一个日期格式
+            # 检查result是否是昨天的日期
+            return (result, result_date.date() == yesterday.date())
+
+
+def judge_count(results):
+    # 不满足spec的数量为0则正常
+    return (results, results == 0)
+
+
+def judge_points(result):
+    # 异常点列表转为记录字符串: [(v1, v2, ...), (...)]
+    if result:
+        result_string = ", ".join("(" + ", ".join(f"{value}" for value in item.values()) + ")"
+                                  for item in result)
+        return (f"[{result_string}]", False)
+    else:
+        return ('-', True)
+
 
 # Watch_Dog class
 class Watch_Dog():
@@ -25,7 +111,6 @@ class Watch_Dog():
         # 获取系统时间相对昨天的日期
         today = datetime.now()
         yesterday = today - timedelta(days=1)
-        date_formats = ["%Y%m%d", "%Y-%m-%d", "%Y/%m/%d"]  # 支持的日期格式列表
         self.sql = (f"SELECT `indicator` FROM modulemte.db_watchdog_mission_list "
                     f"WHERE type = '{para['type']}' AND category = '0';")
         with self.connection.cursor() as cursor:
@@ -48,46 +133,18 @@ class Watch_Dog():
             with self.connection.cursor() as cursor:
                 cursor.execute(self.sql)
                 results = cursor.fetchone()
-                result = results[0]
-                if para['spec'] == 'yestoday':
-                    for date_format in date_formats:
-                        try:
-                            result_date = datetime.strptime(str(result), date_format)
-                            # 检查result是否是昨天的日期
-                            if result_date.date() == yesterday.date():
-                                return (result, True)
-                            else:
-                                return (result, False)
-                        except ValueError:
-                            continue  # 如果解析失败，尝试下一个日期格式
-        elif para['spec_desc'] in ['>','<', '>=', '<='] and prime_result == '0':
-            desc_mapping = {
-                '>': '<=',
-                '<': '>=',
-                '>=': '<',
-                '<=': '>',
-            }
-            spec_desc = desc_mapping.get(para['spec_desc'], para['spec_desc'])
-
-            if indicator == 'workdt':
-                searchDate = yesterday.strftime("%Y%m%d")
+            return judge_max(para, results[0], yesterday)
+        elif para['spec_desc'] in DESC_MAPPING and prime_result == '0':
+            spec_desc = DESC_MAPPING.get(para['spec_desc'], para['spec_desc'])
+            searchDate = search_date(indicator, yesterday)
             self.sql = (f"SELECT COUNT(*) FROM {para['db_name']} "
                         f"WHERE {indicator} = '{searchDate}' AND {para['indicator']} {spec_desc} {para['spec']};")
             with self.connection.cursor() as cursor:
                 cursor.execute(self.sql)
                 results = cursor.fetchone()[0]
-                # 判断results是否为空
-                if results == 0:
-                    return (results, True)
-                else:
-                    return (results, False)
-        elif para['spec_desc'] == 'P_Chart' and prime_result == '0':
-            if indicator == 'workdt':
-                search_end = yesterday.strftime("%Y%m%d")
-                search_start = (yesterday - timedelta(days=30)).strftime("%Y%m%d")
-            elif indicator == 'date_val' or indicator == 'date':
-                search_end = yesterday.strftime("%Y-%m-%d")
-                search_start = (yesterday - timedelta(days=30)).strftime("%Y-%m-%d")
+            return judge_count(results)
+        elif para['spec_desc'] in SPC_RULE_PRESETS and prime_result == '0':
+            search_start, search_end = p_chart_window(indicator, yesterday)
             indicator_list = para['indicator'].split(',')
             groupSizeField = indicator_list[0]
             sampleField =  indicator_list[1]
@@ -97,29 +154,11 @@ class Watch_Dog():
             with self.connection.cursor() as cursor:
                 cursor.execute(self.sql)
                 results = cursor.fetchall()
-            fields = []
-            group_size = []
-            sample = []
-            for item in results:
-                fields.append(item[0])
-                group_size.append(item[1])
-                sample.append(item[2])
-            p = P_Chart(fields, sample, group_size, para['spec'])
-            result = p.p_chart_judge()
-            if result:
-                result_string = "["
-                for item in result:
-                    result_string += "("
-                    for key, value in item.items():
-                        result_string += f"{value}, "
-                    result_string = result_string.rstrip(", ")  # 去除末尾的逗号和空格
-                    result_string += "), "
-
-                result_string = result_string.rstrip(", ")  # 去除最后一个逗号和空格
-                result_string += "]"
-                return (result_string, False)
-            else:
-                return ('-', True)
+            fields = [item[0] for item in results]
+            group_size = [item[1] for item in results]
+            sample = [item[2] for item in results]
+            p = P_Chart(fields, sample, group_size, para['spec'], para['rules'], para['run_length'])
+            return judge_points(p.p_chart_judge())
         elif para['spec_desc'] == 'Obsolete' and prime_result == '0':
             indicator_list = para['indicator'].split(',')
             searchDate = yesterday.strftime("%Y-%m-%d")
@@ -127,29 +166,11 @@ class Watch_Dog():
             with self.connection.cursor() as cursor:
                 cursor.execute(self.sql)
                 results = cursor.fetchall()
-            fields = []
-            group_size = []
-            sample = []
-            for item in results:
-                fields.append(item[0])
-                group_size.append('')
-                sample.append(item[1])
+            fields = [item[0] for item in results]
+            group_size = ['' for item in results]
+            sample = [item[1] for item in results]
             p = P_Chart(fields, sample, group_size, para['spec'])
-            result = p.obsolete()
-            if result:
-                result_string = "["
-                for item in result:
-                    result_string += "("
-                    for key, value in item.items():
-                        result_string += f"{value}, "
-                    result_string = result_string.rstrip(", ")  # 去除末尾的逗号和空格
-                    result_string += "), "
-
-                result_string = result_string.rstrip(", ")  # 去除最后一个逗号和空格
-                result_string += "]"
-                return (result_string, False)
-            else:
-                return ('-', True)
+            return judge_points(p.obsolete())
 
     def record(self, para, res):
         # 获取当前系统时间
@@ -209,38 +230,600 @@ class Watch_Dog():
             self.connection.close()
 
 
+class Record_Writer():
+    """
+    批量写入Watch_Dog结果: 收集一次运行的全部结果, 按 observe 哈希去重,
+    整批分配 B_id, 在同一事务中写入 db_watchdog_record / bus_detail
+    """
+    hash_table = 'modulemte.db_watchdog_observe_hash'
+
+    def __init__(self, charger='z130090'):
+        self.charger = charger
+        self.pending = []
+
+    def add(self, para, res):
+        if res:
+            self.pending.append((para, res))
+
+    def extend(self, results):
+        for para, res in results:
+            self.add(para, res)
+
+    @staticmethod
+    def observe_hash(observe):
+        return hashlib.md5(str(observe).encode('utf-8')).hexdigest()
+
+    def ensure_hash_table(self, connection):
+        # 首次建表时用历史记录回填, 之后随记录一起写入
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM information_schema.tables "
+                           "WHERE table_schema = 'modulemte' AND table_name = 'db_watchdog_observe_hash';")
+            if cursor.fetchone()[0]:
+                return
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.hash_table} ("
+                           f"observe_hash CHAR(32) NOT NULL PRIMARY KEY);")
+            cursor.execute(f"INSERT IGNORE INTO {self.hash_table} (observe_hash) "
+                           f"SELECT DISTINCT MD5(observe) FROM modulemte.db_watchdog_record;")
+        connection.commit()
+
+    def existing_hashes(self, connection, hashes):
+        if not hashes:
+            return set()
+        placeholders = ', '.join(['%s'] * len(hashes))
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT observe_hash FROM {self.hash_table} "
+                           f"WHERE observe_hash IN ({placeholders});", list(hashes))
+            return {row[0] for row in cursor.fetchall()}
+
+    def flush(self, connection):
+        if not self.pending:
+            return
+        self.ensure_hash_table(connection)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        abnormal_hashes = {self.observe_hash(res[0]) for para, res in self.pending if not res[1]}
+        seen = self.existing_hashes(connection, abnormal_hashes)
+        records = []
+        abnormal = []
+        hashes = []
+        for para, res in self.pending:
+            observe_hash = self.observe_hash(res[0])
+            if res[1]:
+                records.append((now, para['id'], para['spec'], res[0], '0', '-', 'auto'))
+            elif observe_hash in seen:
+                # 相同异常已记录过
+                continue
+            else:
+                seen.add(observe_hash)
+                records.append((now, para['id'], para['spec'], res[0], '1', '0', self.charger))
+                abnormal.append(para)
+            hashes.append((observe_hash,))
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany("INSERT INTO modulemte.db_watchdog_record "
+                                   "(id, watch_id, spec, observe, judgement, analysis_run, charger) "
+                                   "VALUES (%s, %s, %s, %s, %s, %s, %s)", records)
+                cursor.executemany(f"INSERT IGNORE INTO {self.hash_table} (observe_hash) VALUES (%s)", hashes)
+                if abnormal:
+                    # 锁定当前最大 B_id 后整批分配, 避免并发写入重复
+                    cursor.execute("SELECT MAX(B_id) FROM modulemte.bus_detail FOR UPDATE")
+                    maxB_id = cursor.fetchone()[0]
+                    sequence = int(str(maxB_id)[8:11]) if maxB_id else 0
+                    today = datetime.now().strftime("%Y%m%d")
+                    details = []
+                    for i, para in enumerate(abnormal, start=1):
+                        B_id = today + str(sequence + i).zfill(3) + '5'
+                        details.append((B_id, now, para['type'], self.charger))
+                    cursor.executemany("INSERT INTO modulemte.bus_detail "
+                                       "(B_id, P_id, B_Category, Occur_Time, Close_Time, Description, "
+                                       "Solution, user_id, B_Status) "
+                                       "VALUES (%s, NULL, '4', %s, NULL, %s, '', %s, '1')", details)
+            connection.commit()
+        except pymysql.MySQLError:
+            connection.rollback()
+            raise
+        self.pending = []
+
+
+class Daily_Agg_Cache():
+    """
+    P_Chart 日聚合缓存: 按 (目标表, 日期字段, 统计字段, 日期) 保存每日 SUM 值
+    每次运行重新聚合缓存最后一天及其前 refresh_days 天(补录/修正的数据), 30天窗口统计直接读取缓存行
+    """
+    table = 'modulemte.db_watchdog_daily_agg'
+    # day 保存日期字段的原始字符串值, DATETIME('YYYY-MM-DD HH:MM:SS[.ffffff]')也不截断
+    day_length = 32
+    ddl = ("CREATE TABLE IF NOT EXISTS modulemte.db_watchdog_daily_agg ("
+           "db_name VARCHAR(128) NOT NULL, "
+           "date_field VARCHAR(64) NOT NULL, "
+           "field VARCHAR(64) NOT NULL, "
+           f"day VARCHAR({day_length}) NOT NULL, "
+           "value DOUBLE NULL, "
+           "update_time DATETIME NOT NULL, "
+           "PRIMARY KEY (db_name, date_field, field, day));")
+
+    def __init__(self, refresh_days=7):
+        self.refresh_days = refresh_days
+
+    def ensure_table(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(self.ddl)
+            # 早期版本为 VARCHAR(10), 加宽已存在的表
+            cursor.execute("SELECT CHARACTER_MAXIMUM_LENGTH FROM information_schema.columns "
+                           "WHERE table_schema = 'modulemte' AND table_name = 'db_watchdog_daily_agg' "
+                           "AND column_name = 'day';")
+            length = cursor.fetchone()
+            if length and length[0] is not None and length[0] < self.day_length:
+                cursor.execute(f"ALTER TABLE {self.table} MODIFY day VARCHAR({self.day_length}) NOT NULL;")
+        connection.commit()
+
+    def refresh(self, connection, db_name, indicator, fields, search_start, search_end):
+        # 缓存最后一天可能只聚合了部分数据, 之前几天也可能有迟到或修正的数据, 从其前 refresh_days 天起重新聚合
+        sql = (f"SELECT field, MAX(day) FROM {self.table} "
+               f"WHERE db_name = %s AND date_field = %s GROUP BY field;")
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (db_name, indicator))
+            cached = dict(cursor.fetchall())
+        refresh_start = min((shift_day(cached[field], -self.refresh_days) if cached.get(field) else search_start)
+                            for field in fields)
+        refresh_start = max(refresh_start, search_start)
+        columns = ', '.join(f"SUM({field})" for field in fields)
+        sql = (f"SELECT {indicator}, {columns} FROM {db_name} "
+               f"WHERE {indicator} BETWEEN '{refresh_start}' AND '{search_end}' "
+               f"GROUP BY {indicator};")
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            results = cursor.fetchall()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        values = [(db_name, indicator, field, str(row[0]), row[i + 1], now)
+                  for row in results for i, field in enumerate(fields)]
+        # 重新聚合区间整体替换, 原始表中已删除的日期不残留
+        placeholders = ', '.join(['%s'] * len(fields))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE db_name = %s AND date_field = %s "
+                           f"AND field IN ({placeholders}) AND day BETWEEN %s AND %s;",
+                           (db_name, indicator, *fields, refresh_start, search_end))
+            if values:
+                cursor.executemany(f"INSERT INTO {self.table} (db_name, date_field, field, day, value, update_time) "
+                                   f"VALUES (%s, %s, %s, %s, %s, %s) "
+                                   f"ON DUPLICATE KEY UPDATE value = VALUES(value), "
+                                   f"update_time = VALUES(update_time);", values)
+        connection.commit()
+
+    def rows(self, connection, db_name, indicator, fields, search_start, search_end):
+        # 返回与原始聚合查询相同的行: (日期, SUM(field1), SUM(field2), ...)
+        distinct_fields = list(dict.fromkeys(fields))
+        self.refresh(connection, db_name, indicator, distinct_fields, search_start, search_end)
+        placeholders = ', '.join(['%s'] * len(distinct_fields))
+        sql = (f"SELECT day, field, value FROM {self.table} "
+               f"WHERE db_name = %s AND date_field = %s AND field IN ({placeholders}) "
+               f"AND day BETWEEN %s AND %s;")
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (db_name, indicator, *distinct_fields, search_start, search_end))
+            results = cursor.fetchall()
+        daily = {}
+        for day, field, value in results:
+            daily.setdefault(day, {})[field] = value
+        return [(day, *[daily[day].get(field) for field in fields]) for day in sorted(daily)]
+
+
+class Mission_Batch():
+    """
+    批量评估Watch_Dog任务:
+    任务列表/indicator/prime判定各一次查询加载, 同一目标表+日期字段的任务合并为一条聚合查询
+    """
+    def __init__(self, watch_dog, workers=4, timeout=300, batch_timeout=900, cache=None):
+        self.watch_dog = watch_dog
+        self.cache = cache  # Daily_Agg_Cache, 为 None 时 P_Chart 直接聚合原始表
+        self.missions = {'prime': [], 'daily': []}
+        self.indicators = {}  # type -> 日期字段
+        self.prime_ids = {}  # type -> prime任务id(MIN(id))
+        self.prime_results = {}  # watch_id -> 今日最新判定
+        self.timing = {}  # (category, kind) -> [任务数, 耗时]
+        self.wall_time = {}  # category -> 实际耗时
+        # 并发执行: 每个工作线程持有一个独立连接, timeout 为单条查询读超时(秒),
+        # batch_timeout 为一批任务的总等待时间(秒), 到期未完成的分组结果为 None
+        self.workers = workers
+        self.timeout = timeout
+        self.batch_timeout = batch_timeout
+        self._executor = None
+        self._local = threading.local()
+        self._connections = []
+        self._busy = set()  # 正在被工作线程使用的连接
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _fetchall(self, sql, connection=None):
+        if connection is None:
+            self.watch_dog.sql = sql
+            connection = self.watch_dog.connection
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchall()
+
+    def _worker_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = pymysql.connect(**{**self.watch_dog.db_config, 'read_timeout': self.timeout})
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_worker_connection(self):
+        # 超时或出错后连接状态不可信, 下次重新建立
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            with self._lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+            try:
+                connection.close()
+            except pymysql.MySQLError:
+                pass
+
+    def _add_timing(self, category, kind, count, elapsed):
+        with self._lock:
+            timing = self.timing.setdefault((category, kind), [0, 0.0])
+            timing[0] += count
+            timing[1] += elapsed
+
+    def load(self):
+        if self.cache is not None:
+            self.cache.ensure_table(self.watch_dog.connection)
+        # 有效任务列表
+        for mission in self._fetchall("SELECT * FROM modulemte.db_watchdog_mission_list WHERE STATUS = '1';"):
+            para = mission_para(mission)
+            category = 'prime' if str(para['category']) == '0' else 'daily'
+            self.missions[category].append(para)
+        # 各type的prime任务id及日期字段
+        sql = ("SELECT type, MIN(id), MAX(CASE WHEN category = '0' THEN `indicator` END) "
+               "FROM modulemte.db_watchdog_mission_list GROUP BY type;")
+        for mission_type, prime_id, indicator in self._fetchall(sql):
+            self.prime_ids[mission_type] = prime_id
+            self.indicators[mission_type] = indicator
+        self.load_prime_results()
+
+    def load_prime_results(self):
+        # 今日各任务最新判定, prime任务记录后需重新加载
+        sql = ("SELECT r.watch_id, r.judgement FROM modulemte.db_watchdog_record r "
+               "INNER JOIN (SELECT watch_id, MAX(id) AS id FROM modulemte.db_watchdog_record "
+               "WHERE id >= CURDATE() AND id < CURDATE() + INTERVAL 1 DAY GROUP BY watch_id) t "
+               "ON r.watch_id = t.watch_id AND r.id = t.id;")
+        self.prime_results = {watch_id: judgement for watch_id, judgement in self._fetchall(sql)}
+
+    def prime_result(self, para):
+        prime_id = self.prime_ids.get(para['type'])
+        return self.prime_results.get(prime_id, '1')
+
+    @staticmethod
+    def kind(para):
+        if para['spec_desc'] in DESC_MAPPING:
+            return 'Compare'
+        if para['spec_desc'] in SPC_RULE_PRESETS:
+            return 'P_Chart'
+        return para['spec_desc']
+
+    def group(self, category):
+        # 按 (任务类型, 目标表, 日期字段) 分组, prime判定非正常的任务跳过
+        groups = {}
+        skipped = []
+        for para in self.missions[category]:
+            kind = self.kind(para)
+            if kind not in ('Max', 'Compare', 'P_Chart', 'Obsolete'):
+                skipped.append(para)
+                continue
+            if kind != 'Max' and self.prime_result(para) != '0':
+                skipped.append(para)
+                continue
+            indicator = None if kind == 'Max' else self.indicators.get(para['type'])
+            groups.setdefault((kind, para['db_name'], indicator), []).append(para)
+        return groups, skipped
+
+    def evaluate_group(self, key, missions, yesterday, connection=None):
+        kind, db_name, indicator = key
+        if kind == 'Max':
+            columns = ', '.join(f"MAX({para['indicator']})" for para in missions)
+            row = self._fetchall(f"SELECT {columns} FROM {db_name};", connection)[0]
+            return [(para, judge_max(para, value, yesterday)) for para, value in zip(missions, row)]
+        elif kind == 'Compare':
+            columns = ', '.join(f"COALESCE(SUM(CASE WHEN {para['indicator']} {DESC_MAPPING[para['spec_desc']]} "
+                                f"{para['spec']} THEN 1 ELSE 0 END), 0)" for para in missions)
+            row = self._fetchall(f"SELECT {columns} FROM {db_name} "
+                                 f"WHERE {indicator} = '{search_date(indicator, yesterday)}';", connection)[0]
+            return [(para, judge_count(int(value))) for para, value in zip(missions, row)]
+        elif kind == 'P_Chart':
+            search_start, search_end = p_chart_window(indicator, yesterday)
+            sum_fields = [field for para in missions for field in para['indicator'].split(',')[:2]]
+            if self.cache is not None:
+                rows = self.cache.rows(connection or self.watch_dog.connection,
+                                       db_name, indicator, sum_fields, search_start, search_end)
+            else:
+                columns = ', '.join(f"SUM({field})" for field in sum_fields)
+                rows = self._fetchall(f"SELECT {indicator}, {columns} FROM {db_name} "
+                                      f"WHERE {indicator} BETWEEN '{search_start}' AND '{search_end}' "
+                                      f"GROUP BY {indicator} ORDER BY {indicator} ASC;", connection)
+            fields = [row[0] for row in rows]
+            # 各任务的 (样本数, 不良数) 序列
+            matrix = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), 2 * len(missions))
+            group_size = matrix[:, 0::2].T
+            sample = matrix[:, 1::2].T
+            # 同组任务按判异规则预设分批送入SPC引擎
+            judgements = {}
+            presets = dict.fromkeys((para['rules'], para['run_length']) for para in missions)
+            for rules, run_length in presets:
+                rows_index = [i for i, para in enumerate(missions)
+                              if (para['rules'], para['run_length']) == (rules, run_length)]
+                engine = SPC_Engine([float(missions[i]['spec']) for i in rows_index], rules, run_length)
+                result = engine.p_chart(sample[rows_index], group_size[rows_index])
+                for row, i in enumerate(rows_index):
+                    judgements[i] = judge_points(P_Chart.abnormal_points(fields, result, row))
+            return [(para, judgements[i]) for i, para in enumerate(missions)]
+        elif kind == 'Obsolete':
+            columns = ', '.join(field for para in missions for field in para['indicator'].split(',')[:2])
+            rows = self._fetchall(f"SELECT {columns} FROM {db_name} "
+                                  f"WHERE {indicator} = '{yesterday.strftime('%Y-%m-%d')}';", connection)
+            results = []
+            for i, para in enumerate(missions):
+                fields = [row[2 * i] for row in rows]
+                sample = [row[1 + 2 * i] for row in rows]
+                p = P_Chart(fields, sample, [''] * len(rows), para['spec'])
+                results.append((para, judge_points(p.obsolete())))
+            return results
+
+    def _release_connection(self, connection):
+        # 工作线程用完连接; close() 已执行时由工作线程自行关闭
+        with self._lock:
+            self._busy.discard(connection)
+            if not self._closed or connection not in self._connections:
+                return
+            self._connections.remove(connection)
+        self._local.connection = None
+        try:
+            connection.close()
+        except pymysql.MySQLError:
+            pass
+
+    def _run_group(self, category, key, missions, yesterday):
+        # 工作线程内执行一组任务, 失败或超时的任务结果为 None
+        start = time.perf_counter()
+        connection = None
+        try:
+            connection = self._worker_connection()
+            with self._lock:
+                self._busy.add(connection)
+            results = self.evaluate_group(key, missions, yesterday, connection)
+        except Exception as e:
+            print(f"{key[0]} mission on {key[1]} failed: {e}")
+            self._drop_worker_connection()
+            results = [(para, None) for para in missions]
+        finally:
+            if connection is not None:
+                self._release_connection(connection)
+        self._add_timing(category, key[0], len(missions), time.perf_counter() - start)
+        return results
+
+    def evaluate_concurrent(self, category):
+        # 各分组查询相互独立, 在线程池中并发执行, 总耗时取决于最慢的查询
+        yesterday = datetime.now() - timedelta(days=1)
+        start = time.perf_counter()
+        groups, skipped = self.group(category)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [self._executor.submit(self._run_group, category, key, missions, yesterday)
+                   for key, missions in groups.items()]
+        # 整批共用一个截止时间: 卡在读超时之外(建连、锁等待等)的分组不阻塞整批
+        done, _ = wait(futures, timeout=self.batch_timeout)
+        results = [(para, None) for para in skipped]
+        for future, (key, missions) in zip(futures, groups.items()):
+            if future in done:
+                results.extend(future.result())
+                continue
+            if future.cancel():
+                print(f"{key[0]} mission on {key[1]} not started within {self.batch_timeout}s")
+            else:
+                print(f"{key[0]} mission on {key[1]} still running after {self.batch_timeout}s")
+            results.extend((para, None) for para in missions)
+        self.wall_time[category] = time.perf_counter() - start
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            # 超时的分组可能仍在执行, 不等待其结束
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        # 仍在执行的分组使用的连接由其工作线程结束后关闭
+        with self._lock:
+            self._closed = True
+            idle = [connection for connection in self._connections if connection not in self._busy]
+            self._connections = [connection for connection in self._connections if connection in self._busy]
+        for connection in idle:
+            connection.close()
+
+    def report_timing(self):
+        for category in ('prime', 'daily'):
+            items = [(kind, value) for (cat, kind), value in self.timing.items() if cat == category]
+            total = sum(value[1] for kind, value in items)
+            print(f"{category} missions: {sum(value[0] for kind, value in items)}, {total:.3f}s "
+                  f"(wall {self.wall_time.get(category, 0.0):.3f}s)")
+            for kind, (count, elapsed) in items:
+                print(f"  {kind}: {count} missions, {elapsed:.3f}s")
+
+
+# Xbar-R 控制图系数: 子组容量 n -> (d2, d3)
+XBAR_R_CONSTANTS = {2: (1.128, 0.853), 3: (1.693, 0.888), 4: (2.059, 0.880), 5: (2.326, 0.864),
+                    6: (2.534, 0.848), 7: (2.704, 0.833), 8: (2.847, 0.820), 9: (2.970, 0.808),
+                    10: (3.078, 0.797)}
+
+
+def pad_series(series):
+    # 不等长序列补NaN为 (序列数, 点数) 矩阵
+    series = [np.asarray(item, dtype=float).ravel() for item in series]
+    width = max((len(item) for item in series), default=0)
+    matrix = np.full((len(series), width), np.nan)
+    for i, item in enumerate(series):
+        matrix[i, :len(item)] = item
+    return matrix
+
+
+def _window_count(mask, window, need):
+    # 每点向前 window 个点中满足 mask 的点数 >= need, 结果标记在窗口末点
+    flags = np.zeros(mask.shape, dtype=bool)
+    if mask.shape[1] < window:
+        return flags
+    counts = np.lib.stride_tricks.sliding_window_view(mask, window, axis=1).sum(axis=2)
+    flags[:, window - 1:] = counts >= need
+    return flags
+
+
+class SPC_Result():
+    """SPC计算结果, 各数组形状均为 (序列数, 点数)"""
+    def __init__(self, value, center, sigma_point, UCL, LCL, rules):
+        self.value = value
+        self.center = center
+        self.sigma_point = sigma_point
+        self.UCL = UCL
+        self.LCL = LCL
+        self.rules = rules  # 规则编号 -> bool矩阵
+        self.abnormal = np.zeros(value.shape, dtype=bool)
+        for mask in rules.values():
+            self.abnormal |= mask
+
+
+class SPC_Engine():
+    """
+    向量化SPC引擎: 一次计算多条序列的中心线、逐点控制限及判异规则
+    sigma 可为标量或每条序列一个值
+    """
+    def __init__(self, sigma=3.0, rules=('1',), run_length=9):
+        self.sigma = sigma
+        self.rules = rules
+        self.run_length = run_length  # 规则2连续同侧点数, Western Electric 为8
+
+    def _k(self, rows):
+        return np.broadcast_to(np.asarray(self.sigma, dtype=float).reshape(-1, 1), (rows, 1))
+
+    def run_rules(self, z, k):
+        # z: 以逐点sigma标准化后的偏离量
+        valid = ~np.isnan(z)
+        z = np.where(valid, z, 0.0)
+        above, below = (z > 0) & valid, (z < 0) & valid
+        rules = {}
+        if '1' in self.rules:
+            rules['1'] = (np.abs(z) > k) & valid
+        if '2' in self.rules:
+            rules['2'] = (_window_count(above, self.run_length, self.run_length)
+                          | _window_count(below, self.run_length, self.run_length))
+        if '3' in self.rules:
+            diff = np.diff(z, axis=1)
+            diff_valid = valid[:, 1:] & valid[:, :-1]
+            rise = np.zeros(z.shape, dtype=bool)
+            fall = np.zeros(z.shape, dtype=bool)
+            rise[:, 1:] = _window_count((diff > 0) & diff_valid, 5, 5)
+            fall[:, 1:] = _window_count((diff < 0) & diff_valid, 5, 5)
+            rules['3'] = rise | fall
+        if '4' in self.rules:
+            diff = np.diff(z, axis=1)
+            turn = np.zeros(z.shape, dtype=bool)
+            turn[:, 2:] = (diff[:, 1:] * diff[:, :-1] < 0) & valid[:, 2:] & valid[:, 1:-1] & valid[:, :-2]
+            rules['4'] = _window_count(turn, 12, 12)
+        if '5' in self.rules:
+            rules['5'] = _window_count(z > 2, 3, 2) | _window_count(z < -2, 3, 2)
+        if '6' in self.rules:
+            rules['6'] = _window_count(z > 1, 5, 4) | _window_count(z < -1, 5, 4)
+        if '7' in self.rules:
+            rules['7'] = _window_count((np.abs(z) < 1) & valid, 15, 15)
+        if '8' in self.rules:
+            rules['8'] = (_window_count((np.abs(z) > 1) & valid, 8, 8)
+                          & _window_count(above, 8, 1) & _window_count(below, 8, 1))
+        return rules
+
+    def _result(self, value, center, sigma_point, lower_bound=None):
+        k = self._k(value.shape[0])
+        UCL = center + k * sigma_point
+        LCL = center - k * sigma_point
+        if lower_bound is not None:
+            LCL = np.maximum(LCL, lower_bound)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(sigma_point > 0, (value - center) / sigma_point, 0.0)
+        z = np.where(np.isnan(value), np.nan, z)
+        return SPC_Result(value, center, sigma_point, UCL, LCL, self.run_rules(z, k))
+
+    def p_chart(self, observe, sample_size):
+        # 不良数/样本数 -> p 图, p̄ = Σ不良 / Σ样本
+        observe, sample_size = pad_series(observe), pad_series(sample_size)
+        sample_size = np.where(sample_size > 0, sample_size, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = observe / sample_size
+            valid = ~np.isnan(value)
+            p_bar = (np.where(valid, observe, 0).sum(axis=1, keepdims=True)
+                     / np.where(valid, sample_size, 0).sum(axis=1, keepdims=True))
+            sigma_point = np.sqrt(p_bar * (1 - p_bar) / sample_size)
+        center = np.broadcast_to(p_bar, value.shape)
+        return self._result(value, center, sigma_point, lower_bound=0.0)
+
+    def u_chart(self, defects, units):
+        # 缺陷数/单位数 -> u 图, ū = Σ缺陷 / Σ单位
+        defects, units = pad_series(defects), pad_series(units)
+        units = np.where(units > 0, units, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = defects / units
+            valid = ~np.isnan(value)
+            u_bar = (np.where(valid, defects, 0).sum(axis=1, keepdims=True)
+                     / np.where(valid, units, 0).sum(axis=1, keepdims=True))
+            sigma_point = np.sqrt(u_bar / units)
+        center = np.broadcast_to(u_bar, value.shape)
+        return self._result(value, center, sigma_point, lower_bound=0.0)
+
+    def xbar_r(self, subgroups):
+        # subgroups: (序列数, 点数, 子组容量), 返回 (Xbar图, R图)
+        subgroups = np.asarray(subgroups, dtype=float)
+        if subgroups.ndim == 2:
+            subgroups = subgroups[np.newaxis]
+        n = subgroups.shape[2]
+        d2, d3 = XBAR_R_CONSTANTS[n]
+        xbar = subgroups.mean(axis=2)
+        r = subgroups.max(axis=2) - subgroups.min(axis=2)
+        xbar_bar = np.nanmean(xbar, axis=1, keepdims=True)
+        r_bar = np.nanmean(r, axis=1, keepdims=True)
+        xbar_sigma = np.broadcast_to(r_bar / (d2 * np.sqrt(n)), xbar.shape)
+        r_sigma = np.broadcast_to(d3 * r_bar / d2, r.shape)
+        xbar_result = self._result(xbar, np.broadcast_to(xbar_bar, xbar.shape), xbar_sigma)
+        r_engine = SPC_Engine(self.sigma, ('1',))
+        r_result = r_engine._result(r, np.broadcast_to(r_bar, r.shape), r_sigma, lower_bound=0.0)
+        return xbar_result, r_result
+
+
 class P_Chart():
-    def __init__(self, field, observe, sample_size, sigma):
+    def __init__(self, field, observe, sample_size, sigma, rules=('1',), run_length=9):
         self.observe = observe
         self.sample_size = sample_size
         self.field = field
         self.sigma = float(sigma)
+        self.rules = rules
+        self.run_length = run_length
 
-    def p_chart_judge(self):
-        p_values = [float(obs) / float(sample_size) for obs, sample_size in zip(self.observe, self.sample_size)]
-        # 计算总体P值均值和标准差
-        mean_p = np.mean(p_values)
-        std_p = np.std(p_values)
-        # 判异结果
+    @staticmethod
+    def abnormal_points(field, result, row=0):
+        # 将SPC结果中第 row 条序列的异常点转为记录格式
         abnormal_points = []
-        for i, (obs, sample_size) in enumerate(zip(self.observe, self.sample_size)):
-            p = float(obs) / float(sample_size)
-            n = float(sample_size)
-            UCL = mean_p + self.sigma * np.sqrt((p * (1 - p)) / n)
-            LCL = mean_p - self.sigma * np.sqrt((p * (1 - p)) / n)
-            if p > UCL or p < LCL:
-                abnormal_points.append({
-                    'field': self.field[i],  # 异常点的field
-                    'p_value': round(p * 1000000),  # 异常点的p_value
-                    'UCL': round(UCL * 1000000),  # 控制限的UCL
-                    'LCL': round(LCL * 1000000),  # 控制限的LCL
-                    'result': True  # 结果为异常
-                })
+        for i in np.flatnonzero(result.abnormal[row]):
+            abnormal_points.append({
+                'field': field[i],  # 异常点的field
+                'p_value': round(result.value[row, i] * 1000000),  # 异常点的p_value
+                'UCL': round(result.UCL[row, i] * 1000000),  # 控制限的UCL
+                'LCL': round(result.LCL[row, i] * 1000000),  # 控制限的LCL
+                'result': True  # 结果为异常
+            })
         if abnormal_points:
             return abnormal_points
         else:
             return False  # 无异常
 
+    def p_chart_judge(self):
+        result = SPC_Engine(self.sigma, self.rules, self.run_length).p_chart([self.observe], [self.sample_size])
+        return self.abnormal_points(self.field, result)
+
     def obsolete(self):
         outliers = []  # 用于存储离群点信息的列表
         mean_obs = float(np.mean(self.observe))
@@ -269,33 +852,20 @@ def main():
         'user': 'remoteuser',
         'password': 'password'}
     watch_dog = Watch_Dog(db_config)
-    missionList = watch_dog.check_mission('prime')
-    for mission in missionList:
-        missionPara = {'id': mission[0],
-                    'type':mission[1],
-                    'db_name': mission[4],
-                    'indicator': mission[3],
-                    'spec': mission[6],
-                    'spec_desc': mission[5],
-                    'status': mission[7],
-                    'category': mission[2]}
-        mission_result = watch_dog.mission(missionPara)
-        watch_dog.record(missionPara, mission_result)
-
-    missionList = watch_dog.check_mission('daily')
-    for mission in missionList:
-        missionPara = {'id': mission[0],
-                       'type': mission[1],
-                       'db_name': mission[4],
-                       'indicator': mission[3],
-                       'spec': mission[6],
-                       'spec_desc': mission[5],
-                       'status': mission[7],
-                       'category': mission[2]}
-        mission_result = watch_dog.mission(missionPara)
-        if mission_result:
-            watch_dog.record(missionPara, mission_result)
+    batch = Mission_Batch(watch_dog, cache=Daily_Agg_Cache())
+    batch.load()
+    # 任务并发评估, 记录统一在评估结束后整批写入
+    writer = Record_Writer()
+    writer.extend(batch.evaluate_concurrent('prime'))
+    writer.flush(watch_dog.connection)
+
+    # prime任务判定更新后再评估日常任务
+    batch.load_prime_results()
+    writer.extend(batch.evaluate_concurrent('daily'))
+    writer.flush(watch_dog.connection)
 
+    batch.report_timing()
+    batch.close()
     watch_dog.close_connection()
 
 